@@ -0,0 +1,79 @@
+"""
+Amazon-Reviews-2023 商品元数据的读取工具，供 download_images.py 与 index.py 共用。
+
+元数据既可以从本地导出的 raw_meta_<类别>.jsonl / .parquet 文件读取（完全离线），
+也可以在本地文件不存在时从 Hugging Face 流式读取（只拉取需要的前若干条，而不是整个类别）。
+"""
+import json
+import os
+from typing import Any, Dict, Iterator, List, Optional
+
+HF_DATASET_NAME = "McAuley-Lab/Amazon-Reviews-2023"
+
+
+def read_categories(path: str = "categories.txt") -> List[str]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def first_large_image(item: Dict[str, Any]) -> Optional[str]:
+    """
+    返回商品的第一张大图 URL。兼容两种格式：
+    Hugging Face 的 {"large": [...], ...}，以及原始 JSONL 导出中的 [{"large": ..., ...}, ...]。
+    """
+    images = item.get("images")
+    if isinstance(images, dict):
+        large = images.get("large") or []
+        return large[0] if len(large) > 0 else None
+    if isinstance(images, (list, tuple)):
+        for image in images:
+            if isinstance(image, dict) and image.get("large"):
+                return image["large"]
+    return None
+
+
+def _iter_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _iter_parquet(path: str) -> Iterator[Dict[str, Any]]:
+    import pyarrow.parquet as pq
+
+    # 按记录批次读取，只解析实际用到的前若干条
+    for batch in pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=1024):
+        yield from batch.to_pylist()
+
+
+def _iter_hf(category: str) -> Iterator[Dict[str, Any]]:
+    from datasets import load_dataset
+
+    yield from load_dataset(HF_DATASET_NAME, f"raw_meta_{category}", split="full", streaming=True)
+
+
+def iter_category_meta(category: str, source_dir: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """按顺序产出某个类别的商品元数据，优先使用 source_dir 中的本地导出文件。"""
+    if source_dir:
+        for extension, reader in ((".jsonl", _iter_jsonl), (".parquet", _iter_parquet)):
+            path = os.path.join(source_dir, f"raw_meta_{category}{extension}")
+            if os.path.exists(path):
+                return reader(path)
+        print(f"警告: {source_dir} 中没有类别 {category} 的本地元数据，将从 Hugging Face 流式读取。")
+    return _iter_hf(category)
+
+
+def iter_products(categories: List[str], per_category: int, source_dir: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    产出每个类别前 per_category 条商品中带图片的商品：
+    {'name': '<类别>_<序号>', 'category': 类别, 'image_url': 大图 URL, 'meta': 原始元数据}。
+    序号与旧版脚本一致（按类别内的原始位置计数），保证重建后的 name 不变。
+    """
+    for category in categories:
+        for i, item in enumerate(iter_category_meta(category, source_dir)):
+            if i >= per_category:
+                break
+            image_url = first_large_image(item)
+            if image_url:
+                yield {'name': f"{category}_{i}", 'category': category, 'image_url': image_url, 'meta': item}
@@ -0,0 +1,298 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence
+
+from auto_annotate import ANNOTATION_STATUS_COLUMN, CONFIDENCE_COLUMN, DRAFT_STATUS
+
+# url / desc / category / 标注状态 / 置信度单独建列，其余列以 JSON 形式保存在 extra 中
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rows (
+    row_id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL DEFAULT '',
+    desc TEXT NOT NULL DEFAULT '',
+    category TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL DEFAULT '',
+    confidence REAL,
+    annotated INTEGER NOT NULL DEFAULT 0,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS category_counts (
+    category TEXT PRIMARY KEY,
+    total INTEGER NOT NULL,
+    annotated INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_rows_annotated ON rows (annotated, row_id);
+CREATE INDEX IF NOT EXISTS idx_rows_category ON rows (category, annotated, row_id);
+"""
+
+# 按类别维护的计数由触发器随每次写入增量更新，统计时只需汇总类别数量级的行
+_TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS rows_after_insert AFTER INSERT ON rows BEGIN
+    INSERT INTO category_counts (category, total, annotated) VALUES (NEW.category, 1, NEW.annotated)
+    ON CONFLICT (category) DO UPDATE SET total = total + 1, annotated = annotated + NEW.annotated;
+END;
+CREATE TRIGGER IF NOT EXISTS rows_after_delete AFTER DELETE ON rows BEGIN
+    UPDATE category_counts SET total = total - 1, annotated = annotated - OLD.annotated WHERE category = OLD.category;
+END;
+CREATE TRIGGER IF NOT EXISTS rows_after_update AFTER UPDATE OF category, annotated ON rows BEGIN
+    UPDATE category_counts SET total = total - 1, annotated = annotated - OLD.annotated WHERE category = OLD.category;
+    INSERT INTO category_counts (category, total, annotated) VALUES (NEW.category, 1, NEW.annotated)
+    ON CONFLICT (category) DO UPDATE SET total = total + 1, annotated = annotated + NEW.annotated;
+END;
+"""
+
+
+def _statements(script: str) -> Iterator[str]:
+    """把 SQL 脚本拆成单条语句（触发器体内的分号不拆开），以便在同一个事务中逐条执行。"""
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement.strip()
+            statement = ''
+
+
+def _text(value: Any) -> str:
+    if value is None or (isinstance(value, float) and value != value):
+        return ''
+    return str(value).strip()
+
+
+def is_annotated(desc: Any, category: Any, status: Any = '') -> bool:
+    """描述和类别都不为空，且不是等待审核的自动标注草稿。"""
+    return bool(_text(desc)) and bool(_text(category)) and _text(status) != DRAFT_STATUS
+
+
+class AnnotationStore:
+    """
+    标注平台的本地数据存储（SQLite）。
+
+    标注状态和类别上建有索引，各类别的总数与已标注数由触发器增量维护，
+    因此统计、筛选和分页都是索引上的查询，交互延迟与数据总量基本无关；
+    数据导入后即落盘，刷新页面或重新上传同一文件时不会丢失已有的标注。
+    """
+    def __init__(self, db_path: str):
+        """
+        :param db_path: SQLite 数据库文件路径，不存在时自动创建。
+        """
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # Streamlit 每次重新运行可能在不同线程中执行，连接由锁保护
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA + _INDEXES + _TRIGGERS)
+
+    # --- 导入 ---
+
+    @staticmethod
+    def _row_values(row_id: int, record: Mapping[str, Any]) -> tuple:
+        extra = dict(record)
+        desc, category = _text(extra.pop('desc', None)), _text(extra.pop('category', None))
+        url, status = _text(extra.pop('url', None)), _text(extra.pop(ANNOTATION_STATUS_COLUMN, None))
+        confidence = extra.pop(CONFIDENCE_COLUMN, None)
+        confidence = None if confidence in (None, '') or confidence != confidence else float(confidence)
+        extra = {k: v for k, v in extra.items() if v is not None and v == v and v != ''}
+        return (
+            row_id, url, desc, category, status, confidence,
+            int(bool(desc) and bool(category) and status != DRAFT_STATUS),
+            json.dumps(extra, ensure_ascii=False, default=str) if extra else None
+        )
+
+    def import_batches(self, batches: Iterable[List[Mapping[str, Any]]], source: Optional[str] = None) -> int:
+        """
+        清空现有数据并导入记录批次（例如 data_sources.iter_record_batches 的输出），row_id 为记录在数据源中的位置。
+        导入期间暂停触发器并删除二级索引，结束后一次性重建索引和类别计数。
+        整个导入（包括删除与重建触发器、索引）在同一个事务中执行，中途失败时回滚到导入前的状态。
+        :param source: 数据源标识，记录在库中供 source 属性查询。
+        :return: 导入的行数。
+        """
+        total = 0
+        with self._lock, self._conn:
+            # sqlite3 模块不会为 DDL 语句隐式开启事务，需要显式 BEGIN，否则删除触发器和索引会立即提交
+            self._conn.execute("BEGIN")
+            for name in ('rows_after_insert', 'rows_after_delete', 'rows_after_update'):
+                self._conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+            for name in ('idx_rows_annotated', 'idx_rows_category'):
+                self._conn.execute(f"DROP INDEX IF EXISTS {name}")
+            self._conn.execute("DELETE FROM rows")
+            self._conn.execute("DELETE FROM category_counts")
+            self._conn.execute("DELETE FROM meta")
+            for batch in batches:
+                self._conn.executemany(
+                    "INSERT INTO rows (row_id, url, desc, category, status, confidence, annotated, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [self._row_values(total + i, record) for i, record in enumerate(batch)]
+                )
+                total += len(batch)
+            self._conn.execute(
+                "INSERT INTO category_counts (category, total, annotated) "
+                "SELECT category, COUNT(*), SUM(annotated) FROM rows GROUP BY category"
+            )
+            # 不能使用 executescript：它会先提交当前事务
+            for statement in _statements(_INDEXES + _TRIGGERS):
+                self._conn.execute(statement)
+            self._conn.execute("INSERT INTO meta (key, value) VALUES ('source', ?)", (source or '',))
+        return total
+
+    @property
+    def source(self) -> Optional[str]:
+        """最近一次完整导入的数据源标识，从未导入时返回 None。"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+        return row['value'] if row else None
+
+    # --- 统计与查询 ---
+
+    def counts(self) -> Dict[str, int]:
+        """总数、已标注数和待标注数。"""
+        with self._lock:
+            row = self._conn.execute("SELECT COALESCE(SUM(total), 0), COALESCE(SUM(annotated), 0) FROM category_counts").fetchone()
+        total, annotated = row[0], row[1]
+        return {'total': total, 'annotated': annotated, 'unannotated': total - annotated}
+
+    def categories(self) -> List[str]:
+        """当前出现过的全部非空类别。"""
+        with self._lock:
+            rows = self._conn.execute("SELECT category FROM category_counts WHERE total > 0 AND category != '' ORDER BY category").fetchall()
+        return [row['category'] for row in rows]
+
+    @staticmethod
+    def _where(unannotated_only: bool, categories: Optional[Sequence[str]]) -> tuple:
+        clauses, params = [], []
+        if unannotated_only:
+            clauses.append("annotated = 0")
+        if categories:
+            clauses.append(f"category IN ({', '.join('?' * len(categories))})")
+            params.extend(categories)
+        return (f"WHERE {' AND '.join(clauses)}" if clauses else ""), params
+
+    def count(self, unannotated_only: bool = False, categories: Optional[Sequence[str]] = None) -> int:
+        """符合筛选条件的行数，由类别计数汇总得到，无需扫描数据。"""
+        column = "total - annotated" if unannotated_only else "total"
+        sql = f"SELECT COALESCE(SUM({column}), 0) FROM category_counts"
+        params: List[Any] = []
+        if categories:
+            sql += f" WHERE category IN ({', '.join('?' * len(categories))})"
+            params.extend(categories)
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()[0]
+
+    def _record(self, row: sqlite3.Row) -> Dict[str, Any]:
+        record = json.loads(row['extra']) if row['extra'] else {}
+        record.update({'row_id': row['row_id'], 'url': row['url'], 'desc': row['desc'], 'category': row['category']})
+        if row['status']:
+            record[ANNOTATION_STATUS_COLUMN] = row['status']
+        if row['confidence'] is not None:
+            record[CONFIDENCE_COLUMN] = row['confidence']
+        return record
+
+    def page(
+        self,
+        offset: int,
+        limit: int,
+        unannotated_only: bool = False,
+        categories: Optional[Sequence[str]] = None,
+        after: Optional[Dict[str, Any]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        返回一页符合筛选条件的记录。未按类别筛选时按 row_id 排序，按类别筛选时按 (类别, row_id) 排序。
+        :param offset: 跳过的行数；提供 after 时相对于 after 计算。
+        :param after: 键集分页的游标，即上一页的最后一条记录（至少包含 row_id 与 category）。
+            从游标处沿索引定位，顺序翻页的耗时与数据量和页码无关；不提供游标时需要在索引上跳过 offset 行，
+            耗时随 offset 线性增长。
+        """
+        where, params = self._where(unannotated_only, categories)
+        order = "category, row_id" if categories else "row_id"
+        if after is not None:
+            where += " AND " if where else "WHERE "
+            if categories:
+                where += "(category, row_id) > (?, ?)"
+                params += [after['category'], after['row_id']]
+            else:
+                where += "row_id > ?"
+                params += [after['row_id']]
+        # 先在索引上定位本页的 row_id，再取完整的行
+        sql = (
+            f"SELECT rows.* FROM rows JOIN (SELECT row_id FROM rows {where} ORDER BY {order} LIMIT ? OFFSET ?) AS page "
+            f"USING (row_id) ORDER BY {order}"
+        )
+        with self._lock:
+            rows = self._conn.execute(sql, params + [limit, offset]).fetchall()
+        return [self._record(row) for row in rows]
+
+    def get(self, row_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM rows WHERE row_id = ?", (row_id,)).fetchone()
+        return self._record(row) if row else None
+
+    def iter_batches(self, chunk_size: int = 2000, pending_only: bool = False) -> Iterator[List[Dict[str, Any]]]:
+        """
+        按 row_id 顺序分批产出记录（键集分页，遍历期间的修改不会导致跳行或重复）。
+        :param pending_only: 只产出待自动标注的行：未标注、不是草稿且有图片。
+        """
+        where = "WHERE row_id > ?"
+        if pending_only:
+            where += " AND annotated = 0 AND status != ? AND url != ''"
+        last_row_id = -1
+        while True:
+            params = [last_row_id] + ([DRAFT_STATUS] if pending_only else [])
+            with self._lock:
+                rows = self._conn.execute(f"SELECT * FROM rows {where} ORDER BY row_id LIMIT ?", params + [chunk_size]).fetchall()
+            if not rows:
+                return
+            last_row_id = rows[-1]['row_id']
+            yield [self._record(row) for row in rows]
+
+    def count_pending(self) -> int:
+        """待自动标注的行数。"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM rows WHERE annotated = 0 AND status != ? AND url != ''", (DRAFT_STATUS,)
+            ).fetchone()[0]
+
+    # --- 修改 ---
+
+    def update(self, row_id: int, **fields: Any) -> Dict[str, Any]:
+        """
+        修改一行的 desc / category / 标注状态 / 置信度，并重新计算是否已标注，返回修改后的完整记录。
+        字段名与记录中的键一致，例如 update(3, desc='...', category='...', annotation_status='reviewed')。
+        """
+        return self.update_many([(row_id, fields)])[0]
+
+    def update_many(self, updates: Sequence[tuple]) -> List[Dict[str, Any]]:
+        """在一个事务中批量修改，updates 为 (row_id, fields) 列表。"""
+        columns = {'desc': 'desc', 'category': 'category', ANNOTATION_STATUS_COLUMN: 'status', CONFIDENCE_COLUMN: 'confidence'}
+        records = []
+        with self._lock, self._conn:
+            for row_id, fields in updates:
+                row = self._conn.execute("SELECT * FROM rows WHERE row_id = ?", (row_id,)).fetchone()
+                if row is None:
+                    raise KeyError(f"标注数据中不存在 row_id={row_id}")
+                values = {column: row[column] for column in columns.values()}
+                for key, value in fields.items():
+                    if key not in columns:
+                        raise ValueError(f"不支持修改的字段: {key}，可选: {list(columns)}")
+                    values[columns[key]] = value if key == CONFIDENCE_COLUMN else _text(value)
+                values['annotated'] = int(is_annotated(values['desc'], values['category'], values['status']))
+                self._conn.execute(
+                    "UPDATE rows SET desc = ?, category = ?, status = ?, confidence = ?, annotated = ? WHERE row_id = ?",
+                    (values['desc'], values['category'], values['status'], values['confidence'], values['annotated'], row_id)
+                )
+                records.append(self._record(self._conn.execute("SELECT * FROM rows WHERE row_id = ?", (row_id,)).fetchone()))
+        return records
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,470 @@
+"""
+检索与问答链路的无界面 HTTP 服务，供其他服务（例如审核服务）直接调用。
+
+接口：
+    GET  /health            服务状态、索引版本与向量数
+    POST /search            编码查询并检索候选项
+    POST /answer            检索 + 重排序 + 生成回答
+    POST /classify          近邻投票 + 类别质心直接给出类别与置信度，置信度不足时才调用 LLM（见 category_classifier.py）
+    POST /reload            重新加载向量存储与类别质心（后台索引任务提交新索引之后调用）
+    GET  /metrics           Prometheus 文本格式的指标（各阶段耗时分位数、批大小、缓存命中、token 数，见 telemetry.py）
+
+/search、/answer 与 /classify 接受 JSON 请求体：
+    单条查询: {"text": "...", "image_base64": "...", "top_k": 5, "filters": {"category": ["a", "b"]}, "instruction": "..."}
+    批量查询: {"queries": [{...}, {...}], "top_k": 5, "filters": {...}}，查询中的同名字段覆盖外层的值。
+也可以直接 POST 图片字节（Content-Type: image/*），text / top_k / instruction 通过 URL 查询参数传入。
+filters 按元数据字段做等值匹配，值为列表时匹配其中任意一个。
+
+请求由线程池并发处理；来自不同请求的查询在编码工作线程中合并成批推理，
+批量请求中各查询的 LLM 阶段并发执行（见 llm_batch.py）。
+
+使用示例:
+    python api_server.py --port 8000
+    curl -X POST localhost:8000/search --data-binary @query.jpg -H "Content-Type: image/jpeg"
+"""
+import base64
+import io
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from PIL import Image
+
+import telemetry
+from backend import create_backend
+from category_classifier import CategoryClassifier
+from encoders import BaseEncoder
+from llm_batch import BatchAnswerer
+from query_cache import QueryResultCache
+from reranker import GenerativeAssistant, is_cacheable_answer
+from stores import BaseVectorStore
+
+DEFAULT_INSTRUCTION = "请描述这张图片，并找到相似的商品。"
+
+
+class EncodeBatcher:
+    """
+    将并发请求中的查询合并成批交给编码器推理。请求线程负责解码和预处理图片，
+    编码工作线程每次最多取 max_batch_size 条，凑批时最多等待 batch_linger 秒。
+    """
+    def __init__(self, encoder: BaseEncoder, workers: int = 1, max_batch_size: int = 32, batch_linger: float = 0.005):
+        """
+        :param encoder: 编码器，使用其 preprocess_image / encode_batch。
+        :param workers: 编码工作线程数，GPU 推理通常为 1。
+        :param max_batch_size: 每次推理的最大批大小。
+        :param batch_linger: 凑批时等待更多查询的最长时间（秒）。
+        """
+        self.encoder = encoder
+        self.max_batch_size = max_batch_size
+        self.batch_linger = batch_linger
+        self._queue: "queue.Queue[Tuple[Any, Optional[str], Future]]" = queue.Queue()
+        self._threads = [threading.Thread(target=self._run, name=f"encode-{i}", daemon=True) for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, image: Optional[Image.Image], text: Optional[str]) -> Future:
+        """提交一条查询，返回结果为查询向量的 Future。"""
+        if image is None and not (text and text.strip()):
+            raise ValueError("必须提供图片或非空的文本进行编码。")
+        future = Future()
+        self._queue.put((self.encoder.preprocess_image(image) if image is not None else None, text, future))
+        return future
+
+    def encode(self, queries: List[Tuple[Optional[Image.Image], Optional[str]]]) -> List[np.ndarray]:
+        futures = [self.submit(image, text) for image, text in queries]
+        return [future.result() for future in futures]
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_linger
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=max(remaining, 0)) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                telemetry.observe("batch_size", len(batch), stage="encode")
+                with telemetry.span("encode", batch_size=len(batch)):
+                    vectors = self.encoder.encode_batch([item[0] for item in batch], [item[1] for item in batch])
+                for (_, _, future), vector in zip(batch, vectors):
+                    future.set_result(vector)
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+
+
+def _matches(item: Dict[str, Any], filters: Dict[str, Any]) -> bool:
+    for field, expected in filters.items():
+        value = item.get(field)
+        if isinstance(expected, list):
+            if value not in expected:
+                return False
+        elif value != expected:
+            return False
+    return True
+
+
+class QueryService:
+    """编码 → 检索 →（重排序 → 生成）的线程安全服务对象，与 HTTP 层无关。"""
+    def __init__(
+        self,
+        encoder: BaseEncoder,
+        vector_store: BaseVectorStore,
+        assistant: GenerativeAssistant,
+        query_cache: Optional[QueryResultCache] = None,
+        encode_workers: int = 1,
+        encode_batch_size: int = 32,
+        batch_linger: float = 0.005,
+        default_top_k: int = 5,
+        max_top_k: int = 100,
+        filter_overfetch: int = 5,
+        llm_batch_config: Optional[Dict[str, Any]] = None,
+        classifier: Optional[CategoryClassifier] = None
+    ):
+        """
+        :param query_cache: 问答结果缓存，为 None 时不缓存。
+        :param default_top_k: 请求未指定 top_k 时的检索条数。
+        :param max_top_k: 允许请求的最大 top_k。
+        :param filter_overfetch: 带 filters 时先检索 top_k 的多少倍，再按元数据过滤。
+        :param llm_batch_config: 批量问答时 LLM 阶段的并发与限流设置（llm.batch 配置段）。
+        :param classifier: /classify 使用的类别分类器，为 None 时只使用近邻投票。
+        """
+        self.encoder = encoder
+        self.vector_store = vector_store
+        self.assistant = assistant
+        self.query_cache = query_cache
+        self.batcher = EncodeBatcher(encoder, encode_workers, encode_batch_size, batch_linger)
+        self.default_top_k = default_top_k
+        self.max_top_k = max_top_k
+        self.filter_overfetch = filter_overfetch
+        self.llm_batch_config = llm_batch_config or {}
+        # 批量查询的 LLM 阶段共用一个长期运行的事件循环、异步客户端与限流器，首次使用时创建
+        self._batch_answerer: Optional[BatchAnswerer] = None
+        self._batch_answerer_lock = threading.Lock()
+        self.classifier = classifier or CategoryClassifier()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "QueryService":
+        """根据完整的应用配置创建服务，api 段提供服务本身的参数。"""
+        encoder, vector_store, assistant = create_backend(config)
+        query_cache = None
+        cache_config = config.get("query_cache", {})
+        if cache_config.get("enabled", False):
+            query_cache = QueryResultCache(cache_config.get("max_entries", 1024), cache_config.get("ttl_seconds", 600))
+        # host / port / max_queries 由 HTTP 层使用
+        api_config = {k: v for k, v in config.get("api", {}).items() if k not in ("host", "port", "max_queries")}
+        return cls(
+            encoder,
+            vector_store,
+            assistant,
+            query_cache=query_cache,
+            llm_batch_config=config.get("llm", {}).get("batch", {}),
+            classifier=CategoryClassifier.from_config(config.get("classification")),
+            **api_config
+        )
+
+    @property
+    def batch_answerer(self) -> BatchAnswerer:
+        with self._batch_answerer_lock:
+            if self._batch_answerer is None:
+                self._batch_answerer = BatchAnswerer(self.assistant, self.llm_batch_config)
+            return self._batch_answerer
+
+    def _top_k(self, query: Dict[str, Any]) -> int:
+        top_k = int(query.get("top_k") or self.default_top_k)
+        if not 1 <= top_k <= self.max_top_k:
+            raise ValueError(f"top_k 必须在 1 到 {self.max_top_k} 之间。")
+        return top_k
+
+    def _search_one(self, vector: np.ndarray, top_k: int, filters: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if not filters:
+            with telemetry.span("search", top_k=top_k):
+                return self.vector_store.search(vector=vector, top_k=top_k)
+        with telemetry.span("search", top_k=top_k, filtered=True):
+            candidates = self.vector_store.search(vector=vector, top_k=min(top_k * self.filter_overfetch, self.max_top_k * self.filter_overfetch))
+        return [item for item in candidates if _matches(item, filters)][:top_k]
+
+    def search(self, queries: List[Dict[str, Any]]) -> List[Tuple[np.ndarray, List[Dict[str, Any]]]]:
+        """
+        :param queries: 每项包含 image（PIL 图像，可选）、text（可选）、top_k、filters。
+        :return: 与 queries 对应的 (查询向量, 候选项列表)。
+        """
+        top_ks = [self._top_k(query) for query in queries]
+        vectors = self.batcher.encode([(query.get("image"), query.get("text")) for query in queries])
+        return [
+            (vector, self._search_one(vector, top_k, query.get("filters")))
+            for query, vector, top_k in zip(queries, vectors, top_ks)
+        ]
+
+    def _answer_uncached(self, query: Dict[str, Any]) -> Tuple[str, Optional[int], List[Dict[str, Any]]]:
+        vector, candidates = self.search([query])[0]
+        return self.assistant.answer(
+            instruction=query.get("instruction") or query.get("text") or DEFAULT_INSTRUCTION,
+            candidates=candidates,
+            query_image=query.get("image"),
+            query_text=query.get("text"),
+            query_vector=vector
+        )
+
+    def _cache_text(self, query: Dict[str, Any]) -> str:
+        # 指令、top_k 和过滤条件不同的请求不能共享结果
+        return json.dumps([query.get("text"), query.get("instruction"), query.get("top_k"), query.get("filters")], ensure_ascii=False, sort_keys=True)
+
+    def answer(self, queries: List[Dict[str, Any]]) -> List[Tuple[str, Optional[int], List[Dict[str, Any]]]]:
+        """单条查询走问答缓存（相同请求合并计算）；多条查询先批量检索，再并发执行 LLM 阶段。"""
+        if len(queries) == 1:
+            query = queries[0]
+            if self.query_cache is None:
+                return [self._answer_uncached(query)]
+            return [self.query_cache.get_or_compute(
+                compute_fn=lambda: self._answer_uncached(query),
+                should_cache=is_cacheable_answer,
+                image_bytes=query.get("image_bytes"),
+                text=self._cache_text(query),
+                index_version=self.vector_store.index_version
+            )]
+        searched = self.search(queries)
+        return self.batch_answerer.answer([
+            {
+                "instruction": query.get("instruction") or query.get("text") or DEFAULT_INSTRUCTION,
+                "candidates": candidates,
+                "query_image": query.get("image"),
+                "query_text": query.get("text"),
+            }
+            for query, (_, candidates) in zip(queries, searched)
+        ])
+
+    def classify(self, queries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        分类快速通道：整批查询只做一次矩阵检索，由近邻投票与类别质心给出类别和置信度；
+        只有置信度低于阈值的查询才进入 LLM 阶段（多条时并发执行），结论中 source 为 'llm'。
+        """
+        top_k = self.classifier.top_k
+        vectors = self.batcher.encode([(query.get("image"), query.get("text")) for query in queries])
+        filtered = any(query.get("filters") for query in queries)
+        # search_batch 的结果带有距离，近邻按相似度加权投票
+        with telemetry.span("search", top_k=top_k, queries=len(queries)):
+            searched = self.vector_store.search_batch(vectors, top_k * self.filter_overfetch if filtered else top_k)
+        if filtered:
+            searched = [
+                [item for item in candidates if _matches(item, query["filters"])][:top_k] if query.get("filters") else candidates[:top_k]
+                for query, candidates in zip(queries, searched)
+            ]
+        with telemetry.span("classify", queries=len(queries)):
+            results = [self.classifier.classify(vector, candidates) for vector, candidates in zip(vectors, searched)]
+
+        uncertain = [i for i, result in enumerate(results) if not result["confident"] and searched[i]]
+        if uncertain:
+            llm_queries = [
+                {
+                    "instruction": queries[i].get("instruction") or self.classifier.instruction,
+                    "candidates": searched[i],
+                    "query_image": queries[i].get("image"),
+                    "query_text": queries[i].get("text"),
+                }
+                for i in uncertain
+            ]
+            if len(llm_queries) == 1:
+                answers = [self.assistant.answer(**llm_queries[0], query_vector=vectors[uncertain[0]])]
+            else:
+                answers = self.batch_answerer.answer(llm_queries)
+            for i, answer in zip(uncertain, answers):
+                results[i] = CategoryClassifier.apply_llm_answer(results[i], answer, self.classifier.category_field)
+        for result, candidates in zip(results, searched):
+            result["references"] = candidates
+            telemetry.increment("classify_decisions", source=result["source"])
+        return results
+
+
+def _decode_image(data: bytes) -> Image.Image:
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except Exception as e:
+        raise ValueError(f"无法解析图片: {e}")
+    return image.convert("RGB")
+
+
+def parse_queries(body: bytes, content_type: str, params: Dict[str, str], max_queries: int) -> List[Dict[str, Any]]:
+    """将请求体解析为查询列表，图片直接在内存中解码。"""
+    if content_type.startswith("image/"):
+        raw_queries = [dict(params)]
+        raw_queries[0]["image_bytes"] = body
+    else:
+        try:
+            payload = json.loads(body or b"{}")
+        except json.JSONDecodeError as e:
+            raise ValueError(f"请求体不是合法的 JSON: {e}")
+        if not isinstance(payload, dict):
+            raise ValueError("请求体必须是 JSON 对象。")
+        shared = {k: v for k, v in payload.items() if k != "queries"}
+        raw_queries = [dict(shared, **query) for query in payload["queries"]] if "queries" in payload else [shared]
+    if not raw_queries or len(raw_queries) > max_queries:
+        raise ValueError(f"每个请求包含 1 到 {max_queries} 条查询。")
+
+    queries = []
+    for raw in raw_queries:
+        query = {k: raw.get(k) for k in ("text", "instruction", "top_k", "filters")}
+        image_bytes = raw.get("image_bytes")
+        if raw.get("image_base64"):
+            try:
+                image_bytes = base64.b64decode(raw["image_base64"])
+            except ValueError as e:
+                raise ValueError(f"image_base64 解码失败: {e}")
+        if image_bytes:
+            query["image_bytes"] = image_bytes
+            query["image"] = _decode_image(image_bytes)
+        if query["filters"] is not None and not isinstance(query["filters"], dict):
+            raise ValueError("filters 必须是对象。")
+        if query.get("image") is None and not (query["text"] and str(query["text"]).strip()):
+            raise ValueError("每条查询需要提供图片或非空的 text。")
+        queries.append(query)
+    return queries
+
+
+def _candidate_json(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: (v.item() if isinstance(v, np.generic) else v) for k, v in item.items()}
+
+
+class APIServer(ThreadingHTTPServer):
+    # 默认的监听队列只有 5，突发的并发连接会被重置
+    request_queue_size = 256
+    daemon_threads = True
+
+
+def make_handler(service: QueryService, max_queries: int = 64, max_body_bytes: int = 20 << 20):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, payload: Dict[str, Any], close: bool = False):
+            body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            if close:
+                # send_header 收到 Connection: close 时会同时设置 close_connection
+                self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_text(self, status: int, text: str, content_type: str):
+            body = text.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/metrics":
+                self._send_text(200, telemetry.render_prometheus(), "text/plain; version=0.0.4; charset=utf-8")
+            elif path == "/health":
+                self._send_json(200, {
+                    "status": "ok",
+                    "index_version": service.vector_store.index_version,
+                    "count": service.vector_store.count(),
+                })
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > max_body_bytes:
+                # 未读取的请求体仍留在连接上，保持连接会把它当作下一个请求解析，因此回复后关闭连接
+                self._send_json(413, {"error": f"请求体超过 {max_body_bytes} 字节。"}, close=True)
+                return
+            body = self.rfile.read(length)
+            try:
+                if url.path == "/reload":
+                    service.vector_store.reload()
+                    service.classifier.reload()
+                    self._send_json(200, {"index_version": service.vector_store.index_version, "count": service.vector_store.count()})
+                    return
+                if url.path not in ("/search", "/answer", "/classify"):
+                    self._send_json(404, {"error": "not found"})
+                    return
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                queries = parse_queries(body, self.headers.get("Content-Type", ""), params, max_queries)
+                start = time.perf_counter()
+                with telemetry.span("http" + url.path.replace("/", "_"), queries=len(queries)):
+                    if url.path == "/search":
+                        results = [
+                            {"candidates": [_candidate_json(item) for item in candidates]}
+                            for _, candidates in service.search(queries)
+                        ]
+                    elif url.path == "/classify":
+                        results = [
+                            dict(result, references=[_candidate_json(item) for item in result["references"]])
+                            for result in service.classify(queries)
+                        ]
+                    else:
+                        results = [
+                            {
+                                "answer": answer_text,
+                                "recommended_index": recommended_idx,
+                                "recommended_item": _candidate_json(references[recommended_idx]) if recommended_idx is not None else None,
+                                "references": [_candidate_json(item) for item in references],
+                            }
+                            for answer_text, recommended_idx, references in service.answer(queries)
+                        ]
+                elapsed_ms = (time.perf_counter() - start) * 1000
+            except ValueError as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            except Exception as e:
+                print(f"处理 {url.path} 请求失败: {e}")
+                self._send_json(500, {"error": str(e)})
+                return
+            payload = {"results": results, "elapsed_ms": round(elapsed_ms, 2)}
+            if len(results) == 1:
+                payload.update(results[0])
+            self._send_json(200, payload)
+
+    return Handler
+
+
+def start_api_server(service: QueryService, host: str = "127.0.0.1", port: int = 8000, **handler_options) -> Tuple[APIServer, str]:
+    """在后台线程中启动服务，返回 (server, base_url)，主要用于测试与压测。"""
+    server = APIServer((host, port), make_handler(service, **handler_options))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    import argparse
+    import yaml
+
+    parser = argparse.ArgumentParser(description="检索与问答链路的 HTTP 服务")
+    parser.add_argument("--config_path", type=str, default="configs/config.yaml", help="配置文件路径")
+    parser.add_argument("--host", type=str, default=None, help="监听地址，默认使用配置中的 api.host")
+    parser.add_argument("--port", type=int, default=None, help="监听端口，默认使用配置中的 api.port")
+    args = parser.parse_args()
+
+    with open(args.config_path, 'r', encoding='utf-8') as f:
+        app_config = yaml.safe_load(f)
+    api_config = app_config.get("api", {})
+    host = args.host or api_config.get("host", "127.0.0.1")
+    port = args.port or api_config.get("port", 8000)
+
+    service = QueryService.from_config(app_config)
+    server = APIServer((host, port), make_handler(service, max_queries=api_config.get("max_queries", 64)))
+    print(f"HTTP 服务已启动: http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,349 @@
+import asyncio
+import json
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import yaml
+from tqdm import tqdm
+
+from encoders import create_encoder, BaseEncoder
+from stores import create_vector_store, BaseVectorStore
+from generators import create_async_generator, LLM_ERROR_PREFIX
+from generators.rate_limit import AsyncRateLimiter
+from prompts import create_annotation_prompt
+from data_sources import read_dataframe, PARQUET_EXTENSIONS, ARROW_EXTENSIONS
+
+# 自动标注写回的状态列：'draft' 表示由系统起草、等待人工审核
+ANNOTATION_STATUS_COLUMN = 'annotation_status'
+DRAFT_STATUS = 'draft'
+# 建议类别的置信度列，便于审核时优先处理低置信度的数据
+CONFIDENCE_COLUMN = 'suggested_confidence'
+
+
+def _is_blank(value: Any) -> bool:
+    return value is None or (isinstance(value, float) and np.isnan(value)) or str(value).strip() == ''
+
+
+def find_unannotated(df: pd.DataFrame) -> pd.Index:
+    """返回缺少描述或类别、且不是待审核草稿的行索引。"""
+    desc = df['desc'].fillna('').astype(str).str.strip() if 'desc' in df.columns else pd.Series('', index=df.index)
+    category = df['category'].fillna('').astype(str).str.strip() if 'category' in df.columns else pd.Series('', index=df.index)
+    mask = (desc == '') | (category == '')
+    if ANNOTATION_STATUS_COLUMN in df.columns:
+        mask &= df[ANNOTATION_STATUS_COLUMN].fillna('') != DRAFT_STATUS
+    if 'url' in df.columns:
+        mask &= df['url'].notna()
+    return df.index[mask]
+
+
+def knn_vote(
+    query_vector: np.ndarray,
+    neighbours: List[Dict[str, Any]],
+    neighbour_vectors: Optional[np.ndarray]
+) -> Tuple[Optional[str], float]:
+    """
+    按与查询向量的余弦相似度加权，对近邻的类别进行投票。
+    :return: (得票最高的类别, 置信度)，置信度为该类别的得票占总票数的比例。
+    """
+    labelled = [(i, item.get('category')) for i, item in enumerate(neighbours) if not _is_blank(item.get('category'))]
+    if not labelled:
+        return None, 0.0
+    if neighbour_vectors is not None and len(neighbour_vectors) == len(neighbours):
+        vectors = np.asarray(neighbour_vectors, dtype='float32')
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        query = np.asarray(query_vector, dtype='float32').ravel()
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        # 负相似度不参与投票
+        weights = np.clip(vectors @ query, 0.0, None)
+    else:
+        # 无法取回向量时按排名加权
+        weights = 1.0 / np.arange(1, len(neighbours) + 1)
+
+    votes: Dict[str, float] = {}
+    for i, category in labelled:
+        votes[str(category)] = votes.get(str(category), 0.0) + float(weights[i])
+    total = sum(votes.values())
+    if total <= 0:
+        return str(labelled[0][1]), 0.0
+    best = max(votes, key=votes.get)
+    return best, votes[best] / total
+
+
+class AutoAnnotator:
+    """
+    批量自动标注器。
+    对每条待标注数据：先用图片在已标注的索引中做近邻检索，按相似度加权投票得到建议类别；
+    再（可选地）让 LLM 参考近邻样本起草描述。LLM 调用在后台事件循环中并发执行，
+    并受并发数和 RPM/TPM 限流约束。结果以 'draft' 状态写回，等待人工审核。
+    """
+    def __init__(
+        self,
+        encoder: BaseEncoder,
+        vector_store: BaseVectorStore,
+        llm_config: Optional[Dict[str, Any]] = None,
+        top_k: int = 5,
+        max_concurrency: int = 8,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None
+    ):
+        """
+        :param encoder: 编码器。
+        :param vector_store: 包含已标注数据的向量存储。
+        :param llm_config: LLM 配置，为 None 时只建议类别、不起草描述。
+        :param top_k: 参与投票的近邻数。
+        :param max_concurrency: 同时进行的 LLM 请求数上限。
+        :param requests_per_minute: 每分钟最多发出的 LLM 请求数。
+        :param tokens_per_minute: 每分钟最多消耗的 token 数。
+        """
+        self.encoder = encoder
+        self.vector_store = vector_store
+        self.top_k = top_k
+        self.max_concurrency = max_concurrency
+        self.generator = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        if llm_config is not None:
+            # 生成器与限流器绑定在同一个长期运行的事件循环上，跨批次复用
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._loop.run_forever, daemon=True).start()
+            self.generator = create_async_generator(llm_config)
+            if requests_per_minute or tokens_per_minute:
+                self.generator.rate_limiter = AsyncRateLimiter(requests_per_minute, tokens_per_minute)
+            self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def close(self):
+        """关闭 LLM 客户端并停止后台事件循环。"""
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self.generator.aclose(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
+
+    def suggest(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """为一批数据检索近邻并投票得到建议类别。编码失败的行返回 error。"""
+        suggestions = []
+        for row in rows:
+            try:
+                query_vector = self.encoder.encode(image=row['url'])
+            except Exception as e:
+                suggestions.append({'error': str(e)})
+                continue
+            neighbours = self.vector_store.search(vector=query_vector, top_k=self.top_k)
+            ids = [item['id'] for item in neighbours if 'id' in item]
+            vectors = self.vector_store.get_vectors(ids) if len(ids) == len(neighbours) else None
+            category, confidence = knn_vote(query_vector, neighbours, vectors)
+            suggestions.append({'category': category, 'confidence': confidence, 'neighbours': neighbours})
+        return suggestions
+
+    async def _draft(self, row: Dict[str, Any], suggestion: Dict[str, Any]) -> Dict[str, Any]:
+        prompt = create_annotation_prompt(
+            suggestion.get('category'),
+            suggestion.get('neighbours', []),
+            existing_desc=None if _is_blank(row.get('desc')) else str(row.get('desc'))
+        )
+        async with self._semaphore:
+            response = await self.generator.agenerate(prompt, response_format={"type": "json_object"})
+        if response.startswith(LLM_ERROR_PREFIX):
+            return {'error': response}
+        json_match = re.search(r'\{.*\}', response, re.DOTALL)
+        try:
+            data = json.loads(json_match.group(0)) if json_match else {}
+        except json.JSONDecodeError:
+            data = {}
+        return {'desc': data.get('desc') or None, 'category': data.get('category') or None}
+
+    async def _draft_all(self, rows: List[Dict[str, Any]], suggestions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        tasks = []
+        for row, suggestion in zip(rows, suggestions):
+            if 'error' in suggestion or not _is_blank(row.get('desc')) and not _is_blank(row.get('category')):
+                tasks.append(asyncio.sleep(0, result={}))
+            else:
+                tasks.append(self._draft(row, suggestion))
+        return await asyncio.gather(*tasks)
+
+    def annotate_batch(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        标注一批数据，返回与 rows 一一对应的结果字典：
+        category / desc 为需要写回的值（已有值不会被覆盖），confidence 为类别置信度，error 为失败原因。
+        """
+        suggestions = self.suggest(rows)
+        drafts = [{} for _ in rows]
+        if self.generator is not None:
+            drafts = asyncio.run_coroutine_threadsafe(self._draft_all(rows, suggestions), self._loop).result()
+
+        results = []
+        for row, suggestion, draft in zip(rows, suggestions, drafts):
+            if 'error' in suggestion or 'error' in draft:
+                results.append({'error': suggestion.get('error') or draft.get('error')})
+                continue
+            result = {'confidence': suggestion['confidence']}
+            if _is_blank(row.get('category')):
+                # 类别以近邻投票为准，LLM 的建议只在没有近邻类别时使用
+                result['category'] = suggestion['category'] or draft.get('category')
+            if _is_blank(row.get('desc')) and draft.get('desc'):
+                result['desc'] = draft['desc']
+            results.append(result)
+        return results
+
+    def annotate_dataframe(
+        self,
+        df: pd.DataFrame,
+        batch_size: int = 32,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+        on_batch_written: Optional[Callable[[pd.DataFrame], None]] = None
+    ) -> Dict[str, int]:
+        """
+        对 DataFrame 中所有待标注行进行自动标注，按批写回 df（原地修改）。
+        :param progress_callback: 每批完成后以 (已处理行数, 总行数) 调用。
+        :param on_batch_written: 每批写回后调用，可用于持久化中间结果。
+        :return: 统计信息 {'total', 'annotated', 'failed'}。
+        """
+        for column in ['desc', 'category', ANNOTATION_STATUS_COLUMN]:
+            if column not in df.columns:
+                df[column] = ''
+        if CONFIDENCE_COLUMN not in df.columns:
+            df[CONFIDENCE_COLUMN] = np.nan
+        # 统一为 object 类型，避免全空列被推断为浮点数后无法写入文本
+        for column in ['desc', 'category', ANNOTATION_STATUS_COLUMN]:
+            df[column] = df[column].astype(object)
+
+        pending = find_unannotated(df)
+        stats = {'total': len(pending), 'annotated': 0, 'failed': 0}
+        for start in range(0, len(pending), batch_size):
+            batch_index = pending[start:start + batch_size]
+            rows = df.loc[batch_index].to_dict('records')
+            for index, result in zip(batch_index, self.annotate_batch(rows)):
+                if 'error' in result:
+                    stats['failed'] += 1
+                    continue
+                for column in ['category', 'desc']:
+                    if result.get(column):
+                        df.at[index, column] = result[column]
+                df.at[index, CONFIDENCE_COLUMN] = result['confidence']
+                df.at[index, ANNOTATION_STATUS_COLUMN] = DRAFT_STATUS
+                stats['annotated'] += 1
+            if on_batch_written is not None:
+                on_batch_written(df)
+            if progress_callback is not None:
+                progress_callback(min(start + batch_size, len(pending)), len(pending))
+        return stats
+
+    def annotate_store(
+        self,
+        store: Any,
+        batch_size: int = 32,
+        progress_callback: Optional[Callable[[int, int], None]] = None
+    ) -> Dict[str, int]:
+        """
+        对标注存储（annotation_store.AnnotationStore）中所有待标注行进行自动标注，每批在一个事务中写回。
+        :param progress_callback: 每批完成后以 (已处理行数, 总行数) 调用。
+        :return: 统计信息 {'total', 'annotated', 'failed'}。
+        """
+        stats = {'total': store.count_pending(), 'annotated': 0, 'failed': 0}
+        done = 0
+        for rows in store.iter_batches(chunk_size=batch_size, pending_only=True):
+            updates = []
+            for row, result in zip(rows, self.annotate_batch(rows)):
+                if 'error' in result:
+                    stats['failed'] += 1
+                    continue
+                fields = {column: result[column] for column in ['category', 'desc'] if result.get(column)}
+                fields[CONFIDENCE_COLUMN] = result['confidence']
+                fields[ANNOTATION_STATUS_COLUMN] = DRAFT_STATUS
+                updates.append((row['row_id'], fields))
+                stats['annotated'] += 1
+            store.update_many(updates)
+            done += len(rows)
+            if progress_callback is not None:
+                progress_callback(min(done, stats['total']), max(stats['total'], 1))
+        return stats
+
+
+def _write_dataframe(df: pd.DataFrame, path: str):
+    if path.endswith('.csv'):
+        df.to_csv(path, index=False)
+    elif path.endswith(PARQUET_EXTENSIONS):
+        df.to_parquet(path, index=False)
+    elif path.endswith(ARROW_EXTENSIONS):
+        df.reset_index(drop=True).to_feather(path)
+    elif path.endswith('.jsonl'):
+        df.to_json(path, orient='records', lines=True, force_ascii=False)
+    else:
+        df.to_excel(path, index=False)
+
+
+def main(
+    config_path: str = "configs/config.yaml",
+    data_path: str = "dataset/template.xlsx",
+    output_path: Optional[str] = None,
+    batch_size: int = 32,
+    top_k: int = 5,
+    use_llm: bool = True,
+    flush_every: int = 10
+):
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+
+    df = read_dataframe(data_path)
+    output_path = output_path or re.sub(r'(\.\w+)$', r'_annotated\1', data_path)
+
+    encoder = create_encoder(config['encoder'])
+    vector_store = create_vector_store(config['vector_store'])
+    llm_config = config.get('llm') if use_llm else None
+    batch_config = (config.get('llm') or {}).get('batch', {})
+    annotator = AutoAnnotator(
+        encoder,
+        vector_store,
+        llm_config=llm_config,
+        top_k=top_k,
+        max_concurrency=batch_config.get('max_concurrency', 8),
+        requests_per_minute=batch_config.get('requests_per_minute'),
+        tokens_per_minute=batch_config.get('tokens_per_minute')
+    )
+
+    total = len(find_unannotated(df))
+    print(f"共 {total} 条待标注数据，结果将写入 {output_path}")
+    progress = tqdm(total=total, desc="自动标注")
+    written_batches = {'count': 0}
+
+    def flush(current_df: pd.DataFrame):
+        written_batches['count'] += 1
+        if written_batches['count'] % flush_every == 0:
+            _write_dataframe(current_df, output_path)
+
+    try:
+        stats = annotator.annotate_dataframe(
+            df,
+            batch_size=batch_size,
+            progress_callback=lambda done, _: progress.update(done - progress.n),
+            on_batch_written=flush
+        )
+    finally:
+        progress.close()
+        annotator.close()
+        _write_dataframe(df, output_path)
+    print(f"✅ 自动标注完成：成功 {stats['annotated']} 条，失败 {stats['failed']} 条。请在标注平台中审核状态为 '{DRAFT_STATUS}' 的数据。")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="基于已标注索引的批量自动标注脚本")
+    parser.add_argument("--config_path", type=str, default="configs/config.yaml", help="配置文件的路径")
+    parser.add_argument("--data_path", type=str, default="dataset/template.xlsx", help="待标注数据文件的路径")
+    parser.add_argument("--output_path", type=str, default=None, help="结果文件路径，默认为 <原文件名>_annotated")
+    parser.add_argument("--batch_size", type=int, default=32, help="每批处理的行数")
+    parser.add_argument("--top_k", type=int, default=5, help="参与类别投票的近邻数")
+    parser.add_argument("--no_llm", action="store_true", help="只建议类别，不调用 LLM 起草描述")
+    parser.add_argument("--flush_every", type=int, default=10, help="每处理多少批写一次结果文件")
+    args = parser.parse_args()
+
+    main(
+        config_path=args.config_path,
+        data_path=args.data_path,
+        output_path=args.output_path,
+        batch_size=args.batch_size,
+        top_k=args.top_k,
+        use_llm=not args.no_llm,
+        flush_every=args.flush_every
+    )
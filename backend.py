@@ -0,0 +1,36 @@
+from typing import Any, Dict, Tuple
+
+import telemetry
+from encoders import create_encoder, BaseEncoder
+from stores import create_vector_store, BaseVectorStore
+from reranker import GenerativeAssistant
+from rerankers import create_reranker
+from semantic_cache import SemanticAnswerCache
+
+
+def create_backend(config: Dict[str, Any]) -> Tuple[BaseEncoder, BaseVectorStore, GenerativeAssistant]:
+    """
+    根据完整的应用配置创建问答链路的核心组件（编码器、向量存储、生成式助理），供 UI 与 HTTP 服务共用。
+    """
+    telemetry.configure(config.get("telemetry"))
+    llm_config = config.get("llm", {})
+    encoder = create_encoder(config["encoder"])
+    vector_store = create_vector_store(config["vector_store"])
+    reranker_config = config.get("reranker", {})
+    reranker = create_reranker(reranker_config, encoder, vector_store)
+    semantic_cache = None
+    semantic_cache_config = config.get("semantic_cache", {})
+    if semantic_cache_config.get("enabled", False):
+        semantic_cache = SemanticAnswerCache(
+            similarity_threshold=semantic_cache_config.get("similarity_threshold", 0.95),
+            max_entries=semantic_cache_config.get("max_entries", 2048),
+            ttl_seconds=semantic_cache_config.get("ttl_seconds", 3600)
+        )
+    assistant = GenerativeAssistant(
+        llm_config,
+        reranker=reranker,
+        fallback_to_llm=reranker_config.get("fallback_to_llm", True),
+        semantic_cache=semantic_cache,
+        vector_store=vector_store
+    )
+    return encoder, vector_store, assistant
@@ -0,0 +1,462 @@
+"""
+离线批量查询：用一个查询文件（图片路径/URL 与可选文本）批量检索风险知识库，用于夜间的批量审核巡检。
+
+查询按块流式读取，下载、解码、编码与检索分阶段并行执行（复用 ingest_pipeline.IngestPipeline，
+写入目标换成批量检索），每批查询向量只调用一次向量存储的 search_batch。
+每条查询的 top_k 个匹配项（距离、相似度、类别等）按长表格式写入 Parquet 或 CSV，每个匹配项一行；
+只有风险分达到阈值的查询才会调用 LLM 生成结论（需开启 --answer），结论写在该查询 rank 为 0 的行上。
+
+风险分为 top_k 候选项中属于 risk_categories 的最高相似度（未配置 risk_categories 时统计全部类别）。
+相似度由平方 L2 距离换算：向量经过 L2 归一化时，余弦相似度 = 1 - 距离 / 2。
+
+输出与检查点：每处理 checkpoint_every 行，先把已写出的结果落盘，再保存检查点（数据源游标与输出位置），
+--resume 时将输出截断到检查点时的位置后从游标处继续，结果不会重复或缺失。
+Parquet 输出在运行期间以分块文件写入 <output>.parts/ 目录，全部完成后合并为单个文件。
+
+用法:
+    python batch_query.py --data_path queries.parquet --output results.parquet
+    python batch_query.py --data_path queries.csv --output results.csv --answer --resume
+"""
+import csv
+import os
+import shutil
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+import telemetry
+from stores import BaseVectorStore, similarity_from_distance
+
+DEFAULT_INSTRUCTION = "判断查询商品是否与这些知识库条目属于同一风险类型，并说明理由。"
+
+# 输出的列，每行对应一条查询的一个匹配项；查询没有任何匹配项时输出一行，匹配项字段为空
+RESULT_COLUMNS = [
+    'query_row', 'query_url', 'query_text',
+    'rank', 'match_id', 'distance', 'similarity', 'match_category', 'match_url', 'match_description',
+    'risk_score', 'flagged', 'answer', 'recommended_index',
+]
+
+
+def _result_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ('query_row', pa.int64()),
+        ('query_url', pa.string()),
+        ('query_text', pa.string()),
+        ('rank', pa.int32()),
+        ('match_id', pa.int64()),
+        ('distance', pa.float64()),
+        ('similarity', pa.float64()),
+        ('match_category', pa.string()),
+        ('match_url', pa.string()),
+        ('match_description', pa.string()),
+        ('risk_score', pa.float64()),
+        ('flagged', pa.bool_()),
+        ('answer', pa.string()),
+        ('recommended_index', pa.int64()),
+    ])
+
+
+class CsvResultWriter:
+    """
+    以追加方式写出 CSV。输出位置为文件的字节数，恢复时截断到该位置即可丢弃检查点之后写入的行。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = None
+        self._writer = None
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8', newline='')
+            self._writer = csv.DictWriter(self._file, fieldnames=RESULT_COLUMNS)
+            if self._file.tell() == 0:
+                self._writer.writeheader()
+
+    def write(self, rows: List[Dict[str, Any]]):
+        self._open()
+        self._writer.writerows(rows)
+
+    def commit(self) -> int:
+        """将已写入的行落盘并返回输出位置。"""
+        self._open()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def truncate(self, position: int):
+        """丢弃 position 之后的内容，position 为 0 时删除输出文件。"""
+        self.close()
+        if not os.path.exists(self.path):
+            return
+        if position == 0:
+            os.remove(self.path)
+            return
+        with open(self.path, 'r+b') as f:
+            f.truncate(position)
+
+    def finalize(self):
+        self.commit()
+        self.close()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._writer = None
+
+
+class ParquetResultWriter:
+    """
+    Parquet 文件无法追加，运行期间每次 commit 将缓冲的行写成 <output>.parts/ 下的一个分块文件，
+    输出位置为分块数量；finalize 时按顺序流式合并为单个文件并删除分块目录。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.parts_dir = path + ".parts"
+        os.makedirs(self.parts_dir, exist_ok=True)
+        self._rows: List[Dict[str, Any]] = []
+        self._parts = len(self._part_files())
+
+    def _part_path(self, index: int) -> str:
+        return os.path.join(self.parts_dir, f"part-{index:06d}.parquet")
+
+    def _part_files(self) -> List[str]:
+        return sorted(name for name in os.listdir(self.parts_dir) if name.startswith('part-') and name.endswith('.parquet'))
+
+    def write(self, rows: List[Dict[str, Any]]):
+        self._rows.extend(rows)
+
+    def commit(self) -> int:
+        """将缓冲的行写成一个分块文件并返回输出位置（分块数量）。"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self._rows:
+            table = pa.Table.from_pylist(self._rows, schema=_result_schema())
+            path = self._part_path(self._parts)
+            pq.write_table(table, path + ".tmp")
+            os.replace(path + ".tmp", path)
+            self._parts += 1
+            self._rows = []
+        return self._parts
+
+    def truncate(self, position: int):
+        """删除编号不小于 position 的分块文件。"""
+        self._rows = []
+        for name in self._part_files():
+            if int(name[len('part-'):-len('.parquet')]) >= position:
+                os.remove(os.path.join(self.parts_dir, name))
+        self._parts = len(self._part_files())
+        if position == 0 and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def finalize(self):
+        import pyarrow.parquet as pq
+
+        self.commit()
+        tmp_path = self.path + ".tmp"
+        with pq.ParquetWriter(tmp_path, _result_schema()) as writer:
+            for name in self._part_files():
+                writer.write_table(pq.read_table(os.path.join(self.parts_dir, name)))
+        os.replace(tmp_path, self.path)
+        shutil.rmtree(self.parts_dir)
+
+    def close(self):
+        self._rows = []
+
+
+def open_result_writer(path: str):
+    """根据输出文件的扩展名创建写出器。"""
+    lower = path.lower()
+    if lower.endswith('.csv'):
+        return CsvResultWriter(path)
+    if lower.endswith('.parquet'):
+        return ParquetResultWriter(path)
+    raise ValueError("不支持的输出格式，请使用 .parquet 或 .csv。")
+
+
+class BatchQuerySink:
+    """
+    IngestPipeline 的写入目标：对每批查询向量执行一次批量检索，计算风险分，
+    为达到阈值的查询并发调用 LLM，然后把结果交给写出器。只在流水线的 writer 线程中调用。
+
+    LLM 阶段是异步的：达到阈值的查询提交给 answerer 后立即返回，writer 线程继续检索后续批次，
+    各批次的结果按提交顺序在回答完成后写出。提交检查点前必须先调用 flush，等待所有回答完成并写出。
+    """
+    def __init__(
+        self,
+        vector_store: BaseVectorStore,
+        writer: Any,
+        top_k: int = 10,
+        risk_threshold: float = 0.85,
+        risk_categories: Optional[Sequence[str]] = None,
+        answerer: Any = None,
+        instruction: str = DEFAULT_INSTRUCTION,
+        max_pending_batches: int = 8
+    ):
+        """
+        :param writer: CsvResultWriter 或 ParquetResultWriter。
+        :param risk_categories: 参与计算风险分的类别，为空时统计全部类别。
+        :param answerer: llm_batch.BatchAnswerer，为 None 时不生成结论。整个任务共用一个，
+            各写入批次共享同一个异步客户端与 RPM/TPM 限流配额。
+        :param max_pending_batches: 等待 LLM 回答的批次上限，超过时 add 阻塞直到最早的批次完成。
+        """
+        self.vector_store = vector_store
+        self.writer = writer
+        self.top_k = top_k
+        self.risk_threshold = risk_threshold
+        self.risk_categories = set(risk_categories) if risk_categories else None
+        self.answerer = answerer
+        self.instruction = instruction
+        self.max_pending_batches = max_pending_batches
+        self.queries_written = 0
+        self.flagged = 0
+        # 按提交顺序排列的 (metadata, results, scores, flagged, future)，future 为 None 表示无需回答
+        self._pending: Deque[tuple] = deque()
+
+    def risk_score(self, candidates: List[Dict[str, Any]]) -> Optional[float]:
+        """候选项中属于风险类别的最高相似度，没有这样的候选项时返回 None。"""
+        scores = [
+            similarity_from_distance(item.get('distance'))
+            for item in candidates
+            if item.get('distance') is not None and (self.risk_categories is None or item.get('category') in self.risk_categories)
+        ]
+        return max(scores) if scores else None
+
+    def _rows(self, query: Dict[str, Any], candidates: List[Dict[str, Any]], risk_score: Optional[float], flagged: bool,
+              answer: Optional[tuple]) -> List[Dict[str, Any]]:
+        base = dict(query, risk_score=risk_score, flagged=flagged)
+        answer_fields = {'answer': answer[0], 'recommended_index': answer[1]} if answer else {'answer': None, 'recommended_index': None}
+        if not candidates:
+            return [dict(base, rank=None, match_id=None, distance=None, similarity=None, match_category=None, match_url=None,
+                         match_description=None, **answer_fields)]
+        rows = []
+        for rank, item in enumerate(candidates):
+            rows.append(dict(
+                base,
+                rank=rank,
+                match_id=item.get('id'),
+                distance=item.get('distance'),
+                similarity=similarity_from_distance(item.get('distance')),
+                match_category=item.get('category'),
+                match_url=item.get('url'),
+                match_description=item.get('description'),
+                **(answer_fields if rank == 0 else {'answer': None, 'recommended_index': None})
+            ))
+        return rows
+
+    def add(self, vectors: List[np.ndarray], metadata: List[Dict[str, Any]], **kwargs):
+        telemetry.observe("batch_size", len(vectors), stage="batch_search")
+        with telemetry.span("batch_search", batch_size=len(vectors)):
+            results = self.vector_store.search_batch(vectors, self.top_k)
+        scores = [self.risk_score(candidates) for candidates in results]
+        flagged = [i for i, score in enumerate(scores) if score is not None and score >= self.risk_threshold]
+        future = None
+        if self.answerer is not None and flagged:
+            # 只有达到阈值的少量查询进入 LLM 阶段，同一批内并发执行，不阻塞后续批次的检索
+            future = self.answerer.submit([
+                {
+                    'instruction': self.instruction,
+                    'candidates': results[i],
+                    'query_image': metadata[i]['query_url'],
+                    'query_text': metadata[i]['query_text'] or None,
+                }
+                for i in flagged
+            ])
+        self._pending.append((metadata, results, scores, flagged, future))
+        self._write_ready(block=len(self._pending) > self.max_pending_batches)
+
+    def _write_ready(self, block: bool = False, wait_all: bool = False):
+        """按提交顺序写出回答已完成的批次；block 时至少等待最早的一批，wait_all 时等待全部。"""
+        while self._pending:
+            metadata, results, scores, flagged, future = self._pending[0]
+            if future is not None and not future.done() and not (block or wait_all):
+                break
+            answers = {}
+            if future is not None:
+                with telemetry.span("batch_answer_wait", batch_size=len(flagged)):
+                    answers = dict(zip(flagged, future.result()))
+            self._pending.popleft()
+            block = False
+            flagged_set = set(flagged)
+            rows = []
+            for i, (query, candidates) in enumerate(zip(metadata, results)):
+                rows.extend(self._rows(query, candidates, scores[i], i in flagged_set, answers.get(i)))
+            self.writer.write(rows)
+            self.queries_written += len(metadata)
+            self.flagged += len(flagged)
+
+    def flush(self):
+        """等待所有进行中的 LLM 回答完成，并写出对应批次的结果。提交检查点或合并输出前调用。"""
+        self._write_ready(wait_all=True)
+
+
+def _iter_queries(record_batches: Iterator[List[Dict[str, Any]]], start_row: int) -> Iterator[Dict[str, Any]]:
+    # 记录中附带数据源行号，写出结果时用于关联查询
+    row = start_row
+    for records in record_batches:
+        for record in records:
+            yield dict(record, _row=row)
+            row += 1
+
+
+def main(config_path: str = "configs/config.yaml", data_path: str = "dataset/queries.parquet", output: str = "batch_results.parquet",
+         answer: Optional[bool] = None, resume: bool = False, image_field: str = 'url', text_field: Optional[str] = 'desc',
+         top_k: Optional[int] = None, risk_threshold: Optional[float] = None, chunk_size: int = None):
+    import yaml
+    from tqdm import tqdm
+
+    from checkpoint import FailedRowLog, IndexingCheckpoint
+    from data_sources import DEFAULT_CHUNK_SIZE, estimate_row_count, iter_record_batches
+    from ingest_pipeline import IngestPipeline
+
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    batch_config = config.get('batch_query', {})
+    answer = batch_config.get('answer', False) if answer is None else answer
+    top_k = top_k or batch_config.get('top_k', 10)
+    risk_threshold = batch_config.get('risk_threshold', 0.85) if risk_threshold is None else risk_threshold
+    checkpoint_every = batch_config.get('checkpoint_every', 20000)
+
+    print("1. 初始化后端组件...")
+    assistant = None
+    if answer:
+        from backend import create_backend
+        encoder, vector_store, assistant = create_backend(config)
+    else:
+        # 不生成结论时无需 LLM 配置
+        from encoders import create_encoder
+        from stores import create_vector_store
+        telemetry.configure(config.get('telemetry'))
+        encoder = create_encoder(config['encoder'])
+        vector_store = create_vector_store(config['vector_store'])
+    print(f"知识库中共有 {vector_store.count()} 条向量。")
+
+    print(f"2. 打开查询文件: {data_path}...")
+    checkpoint = IndexingCheckpoint(batch_config.get('checkpoint_path', 'faiss_data/batch_query_checkpoint.json'))
+    state = checkpoint.load(data_path) if resume else None
+    if state is not None and state.get('output') != os.path.abspath(output):
+        print(f"警告: 检查点对应的输出文件为 {state.get('output')}，将从头开始。")
+        state = None
+    if state is not None and state.get('completed'):
+        print("✅ 该查询文件已在上次运行中全部完成，无需续传。")
+        return
+    writer = open_result_writer(output)
+    writer.truncate(state['output_position'] if state else 0)
+    rows_consumed = state['rows_consumed'] if state else 0
+    if state:
+        print(f"从检查点恢复：已处理 {rows_consumed} 行。")
+    failed_log = FailedRowLog(
+        batch_config.get('failed_rows_path', 'faiss_data/batch_query_failed.jsonl'),
+        keep_entries=state['failed_rows'] if state else 0
+    )
+
+    answerer = None
+    if assistant is not None:
+        from llm_batch import BatchAnswerer
+        # 整个任务只创建一个，各写入批次共享同一份限流配额
+        answerer = BatchAnswerer(assistant, config.get('llm', {}).get('batch', {}))
+    sink = BatchQuerySink(
+        vector_store,
+        writer,
+        top_k=top_k,
+        risk_threshold=risk_threshold,
+        risk_categories=batch_config.get('risk_categories'),
+        answerer=answerer,
+        instruction=batch_config.get('instruction', DEFAULT_INSTRUCTION)
+    )
+    if state:
+        sink.queries_written = state.get('queries_written', 0)
+        sink.flagged = state.get('flagged', 0)
+    # 以索引流水线的配置为基础，batch_query.pipeline 中的同名参数覆盖之
+    pipeline_config = dict(config.get('indexing', {}).get('pipeline', {}), **batch_config.get('pipeline', {}))
+    pipeline = IngestPipeline.from_config(
+        encoder,
+        sink,
+        pipeline_config,
+        image_field=image_field,
+        text_field=text_field,
+        metadata_fn=lambda record: {
+            'query_row': record['_row'],
+            'query_url': str(record[image_field]),
+            'query_text': str(record.get(text_field) or '') if text_field else '',
+        }
+    )
+
+    def save_checkpoint(rows, completed=False):
+        # 前 rows 行中仍在等待 LLM 回答的结果先写出，检查点才能覆盖这些行
+        sink.flush()
+        # 完成时输出文件已由 finalize 合并，不再有可提交的内容
+        position = None if completed else writer.commit()
+        failed_log.flush()
+        checkpoint.save(data_path, rows, None, failed_log.count, completed=completed, output=os.path.abspath(output),
+                        output_position=position, queries_written=sink.queries_written, flagged=sink.flagged)
+
+    start_row = rows_consumed
+    last_checkpoint = [start_row]
+
+    def on_written(completed):
+        # 在 writer 线程中执行，此时前 completed 行的结果都已交给写出器
+        if start_row + completed - last_checkpoint[0] >= checkpoint_every:
+            save_checkpoint(start_row + completed)
+            last_checkpoint[0] = start_row + completed
+
+    columns = [image_field] + ([text_field] if text_field else [])
+    record_batches = iter_record_batches(data_path, chunk_size=chunk_size or DEFAULT_CHUNK_SIZE, start_row=start_row, columns=columns)
+    print("3. 开始批量查询...")
+    with tqdm(total=estimate_row_count(data_path), initial=start_row, desc="查询进度", unit="行") as progress:
+        def report(stats):
+            progress.update(start_row + stats.completed - progress.n)
+            progress.set_postfix_str(f"命中 {sink.flagged} | 失败 {failed_log.count} | {stats.format()}")
+
+        stats = pipeline.run(
+            _iter_queries(record_batches, start_row),
+            # 单条查询失败（例如图片链接失效）只记录到失败文件，不中断任务
+            on_error=lambda seq, row, error: failed_log.write(start_row + seq, row, error),
+            on_written=on_written,
+            progress_callback=report
+        )
+
+    sink.flush()
+    if answerer is not None:
+        answerer.close()
+    # 先保存剩余结果的检查点，合并输出文件之后再标记完成：合并中途失败时仍可从检查点续传
+    save_checkpoint(start_row + stats.completed)
+    writer.finalize()
+    save_checkpoint(start_row + stats.completed, completed=True)
+    failed_log.close()
+    print(f"✅ 批量查询完成！本次处理 {stats.completed} 行，累计输出 {sink.queries_written} 条查询，其中 {sink.flagged} 条达到风险阈值。")
+    print(f"结果已写入 {output}")
+    print(f"各阶段吞吐量: {stats.format()}")
+    if telemetry.enabled():
+        print(f"各阶段耗时: {telemetry.format_stage_summary()}")
+    telemetry.shutdown()
+    if failed_log.count:
+        print(f"⚠️ 共有 {failed_log.count} 行处理失败，已写入 {failed_log.path}，修复后可将该文件作为 --data_path 重新查询。")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="离线批量查询风险知识库")
+    parser.add_argument("--config_path", type=str, default="configs/config.yaml", help="配置文件的路径")
+    parser.add_argument("--data_path", type=str, required=True, help="查询文件路径（Parquet / Arrow / CSV / JSONL / Excel）")
+    parser.add_argument("--output", type=str, required=True, help="结果输出路径，扩展名为 .parquet 或 .csv")
+    parser.add_argument("--image_field", type=str, default="url", help="查询文件中图片路径/URL 的列名")
+    parser.add_argument("--text_field", type=str, default="desc", help="查询文件中与图片一起编码的文本列名，传入空字符串时只编码图片")
+    parser.add_argument("--top_k", type=int, default=None, help="每条查询输出的匹配数，默认使用配置 batch_query.top_k")
+    parser.add_argument("--risk_threshold", type=float, default=None, help="风险分阈值，默认使用配置 batch_query.risk_threshold")
+    parser.add_argument("--answer", action="store_true", default=None, help="为达到风险阈值的查询调用 LLM 生成结论")
+    parser.add_argument("--chunk_size", type=int, default=None, help="每次从查询文件读取的行数")
+    parser.add_argument("--resume", action="store_true", help="从上次的检查点继续，而不是覆盖输出重新开始")
+    args = parser.parse_args()
+
+    main(config_path=args.config_path, data_path=args.data_path, output=args.output, answer=args.answer, resume=args.resume,
+         image_field=args.image_field, text_field=args.text_field or None, top_k=args.top_k, risk_threshold=args.risk_threshold,
+         chunk_size=args.chunk_size)
@@ -0,0 +1,565 @@
+"""
+端到端性能基准与压测套件。
+
+使用确定性的替身编码器（encoders/hash_encoder.py）和本地 OpenAI 兼容假服务（fake_openai_server.py），
+不需要模型权重和外部 API，同样的参数在同一台机器上可以复现。合成数据（图片与表格）由固定的随机种子生成。
+
+场景：
+    ingest     生成合成图片与表格，运行 index_data.py 的完整索引流程，测量行/秒与各阶段利用率
+    store      各向量存储后端的写入吞吐、单条检索延迟、批量检索吞吐以及不同并发下的检索 QPS
+    assistant  编码 → 检索 → GenerativeAssistant（重排 + 生成）的端到端问答在不同并发下的延迟与 QPS，
+               以及 llm_batch.answer_batch 的批量吞吐
+    api        api_server.py 的 /search 与 /answer 在不同并发下的延迟与 QPS（含 HTTP 开销与编码合批）
+
+每个结果附带 telemetry 记录的各阶段耗时分位数。结果写入 JSON（含 git 提交、运行环境与全部参数），
+--compare 与之前的结果逐项对比，每次性能改动都可以给出可复现的前后数字。
+
+用法:
+    python benchmark.py --output benchmark_results/before.json
+    python benchmark.py --output benchmark_results/after.json --compare benchmark_results/before.json
+    python benchmark.py --scenarios store,assistant --concurrency 1,8,32 --llm_latency_ms 300
+"""
+import base64
+import copy
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import yaml
+
+import telemetry
+
+SCENARIOS = ('ingest', 'store', 'assistant', 'api')
+CATEGORIES = ['apparel', 'shoes', 'bags', 'electronics', 'toys', 'cosmetics', 'food', 'furniture']
+VOCABULARY = ['red', 'blue', 'green', 'large', 'small', 'cotton', 'leather', 'plastic', 'wireless', 'portable',
+              'vintage', 'classic', 'sport', 'kids', 'premium', 'organic', 'wooden', 'metal', 'soft', 'waterproof']
+# 数值越大越好的指标，对比时据此判断改善还是退化
+HIGHER_IS_BETTER = ('rows_per_second', 'qps', 'vectors_per_second')
+
+
+# --- 统计 ---
+
+def latency_stats(latencies: Sequence[float]) -> Dict[str, float]:
+    """延迟列表（秒）的毫秒级统计。"""
+    if not latencies:
+        return {'count': 0}
+    values = np.asarray(latencies) * 1000
+    return {
+        'count': len(values),
+        'mean_ms': float(values.mean()),
+        'p50_ms': float(np.percentile(values, 50)),
+        'p90_ms': float(np.percentile(values, 90)),
+        'p99_ms': float(np.percentile(values, 99)),
+        'max_ms': float(values.max()),
+    }
+
+
+def run_concurrent(fn: Callable[[Any], Any], inputs: Sequence[Any], concurrency: int) -> Dict[str, Any]:
+    """以 concurrency 个线程并发调用 fn 处理 inputs，返回吞吐量、延迟分布与失败数。"""
+    latencies: List[float] = []
+    errors: List[str] = []
+    lock = threading.Lock()
+
+    def timed(item):
+        start = time.perf_counter()
+        try:
+            fn(item)
+        except Exception as e:
+            with lock:
+                errors.append(f"{type(e).__name__}: {e}")
+            return
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed, inputs))
+    elapsed = time.perf_counter() - start
+    result = {'concurrency': concurrency, 'seconds': elapsed, 'qps': len(latencies) / elapsed, 'errors': len(errors)}
+    result.update(latency_stats(latencies))
+    if errors:
+        result['first_error'] = errors[0]
+    return result
+
+
+def stage_breakdown() -> Dict[str, Dict[str, float]]:
+    """telemetry 自上次 reset 以来记录的各阶段耗时分位数（毫秒）。"""
+    stages = {}
+    for (name, labels), stats in telemetry.snapshot()['summaries'].items():
+        if name == 'stage_seconds':
+            stages[dict(labels)['stage']] = {
+                'count': stats['count'],
+                'p50_ms': stats.get('p50', 0) * 1000,
+                'p99_ms': stats.get('p99', 0) * 1000,
+            }
+    return stages
+
+
+# --- 合成数据 ---
+
+def generate_dataset(workdir: str, rows: int, image_size: int = 224, data_format: str = 'xlsx', seed: int = 0,
+                     image_base_url: Optional[str] = None) -> str:
+    """
+    生成 rows 张合成图片和对应的数据表（url / desc / category），返回数据文件路径。
+    同一类别的图片共享底色，因此检索结果有意义；相同参数总是生成相同的数据。
+    :param image_base_url: 不为空时 url 列写成 HTTP 地址（图片目录需由 serve_directory 提供），用于测量下载阶段。
+    """
+    import pandas as pd
+    from PIL import Image, ImageDraw
+
+    rng = np.random.default_rng(seed)
+    image_dir = os.path.join(workdir, 'images')
+    os.makedirs(image_dir, exist_ok=True)
+    base_colors = rng.integers(0, 256, size=(len(CATEGORIES), 3))
+    records = []
+    for i in range(rows):
+        category_index = int(rng.integers(len(CATEGORIES)))
+        noise = rng.normal(0, 24, size=(image_size, image_size, 3))
+        pixels = np.clip(base_colors[category_index] + noise, 0, 255).astype('uint8')
+        image = Image.fromarray(pixels)
+        x0, y0 = rng.integers(0, image_size // 2, size=2)
+        width, height = rng.integers(image_size // 8, image_size // 2, size=2)
+        x1, y1 = x0 + width, y0 + height
+        ImageDraw.Draw(image).rectangle([int(x0), int(y0), int(x1), int(y1)], fill=tuple(int(c) for c in rng.integers(0, 256, size=3)))
+        name = f"{i:07d}.jpg"
+        image.save(os.path.join(image_dir, name), quality=85)
+        words = rng.choice(VOCABULARY, size=4, replace=False)
+        records.append({
+            'url': f"{image_base_url}/images/{name}" if image_base_url else os.path.join(image_dir, name),
+            'desc': f"{CATEGORIES[category_index]} " + " ".join(words),
+            'category': CATEGORIES[category_index],
+        })
+    df = pd.DataFrame(records)
+    data_path = os.path.join(workdir, f"data.{data_format}")
+    if data_format == 'xlsx':
+        df.to_excel(data_path, index=False)
+    elif data_format == 'csv':
+        df.to_csv(data_path, index=False)
+    elif data_format == 'parquet':
+        df.to_parquet(data_path, index=False)
+    else:
+        raise ValueError(f"不支持的数据格式: {data_format}")
+    return data_path
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_directory(directory: str) -> Tuple[ThreadingHTTPServer, str]:
+    """在后台线程中以 HTTP 提供 directory 下的文件，返回 (server, base_url)。"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(_QuietHandler, directory=directory))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def build_config(base_config: Dict[str, Any], workdir: str, llm_url: Optional[str], dimension: int,
+                 encoder_options: Dict[str, Any], enable_caches: bool = False) -> Dict[str, Any]:
+    """以应用配置为基础，将编码器、向量存储、LLM 与各类输出路径替换为基准测试专用的设置。"""
+    config = copy.deepcopy(base_config)
+    config['encoder'] = {'type': 'hash', 'hash': dict(encoder_options, dimension=dimension)}
+    config['vector_store'] = {
+        'type': 'faiss',
+        'faiss': {
+            'index_path': os.path.join(workdir, 'store', 'index.bin'),
+            'metadata_path': os.path.join(workdir, 'store', 'metadata.json'),
+            'dimension': dimension,
+        },
+    }
+    llm_config = config.setdefault('llm', {})
+    llm_config['type'] = 'custom'
+    llm_config['custom'] = {'model': 'benchmark-model', 'base_url': llm_url or 'http://127.0.0.1:9/v1', 'api_key': 'benchmark'}
+    llm_config['stream'] = False
+    indexing_config = config.setdefault('indexing', {})
+    indexing_config['checkpoint_path'] = os.path.join(workdir, 'index_checkpoint.json')
+    indexing_config['failed_rows_path'] = os.path.join(workdir, 'failed_rows.jsonl')
+    config.setdefault('classification', {})['centroids_path'] = os.path.join(workdir, 'category_centroids.npz')
+    config.pop('thumbnails', None)
+    for section in ('query_cache', 'semantic_cache'):
+        config.setdefault(section, {})['enabled'] = enable_caches
+    # 只在内存中汇总各阶段耗时，不写日志和指标文件
+    config['telemetry'] = {'enabled': True}
+    return config
+
+
+# --- 场景 ---
+
+def bench_ingest(config_path: str, data_path: str, rows: int) -> Dict[str, Any]:
+    import index_data
+
+    telemetry.reset()
+    start = time.perf_counter()
+    stats = index_data.main(config_path=config_path, data_path=data_path)
+    elapsed = time.perf_counter() - start
+    snapshot = stats.snapshot()
+    return {
+        'rows': rows,
+        'seconds': elapsed,
+        'rows_per_second': rows / elapsed,
+        'written': stats.written,
+        'failed': stats.failed,
+        'pipeline': {name: {'throughput': s['throughput'], 'utilization': s['utilization']} for name, s in snapshot['stages'].items()},
+        'stages': stage_breakdown(),
+    }
+
+
+def _store_configs(workdir: str, dimension: int, milvus_uri: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    configs = {
+        'faiss': {'type': 'faiss', 'faiss': {
+            'index_path': os.path.join(workdir, 'bench_store', 'index.bin'),
+            'metadata_path': os.path.join(workdir, 'bench_store', 'metadata.json'),
+            'dimension': dimension,
+        }},
+        'faiss_partitioned': {'type': 'faiss_partitioned', 'faiss_partitioned': {
+            'root_dir': os.path.join(workdir, 'bench_store_partitioned'),
+            'dimension': dimension,
+        }},
+    }
+    if milvus_uri:
+        configs['milvus'] = {'type': 'milvus', 'milvus': {
+            'uri': milvus_uri, 'user': '', 'password': '', 'db_name': 'default',
+            'collection_name': 'benchmark_vectors', 'dimension': dimension,
+        }}
+    return configs
+
+
+def bench_store(workdir: str, dimension: int, size: int, queries: int, concurrency: Sequence[int], top_k: int = 5,
+                milvus_uri: Optional[str] = None, seed: int = 0) -> List[Dict[str, Any]]:
+    from stores import create_vector_store
+
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((size, dimension)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    query_vectors = vectors[rng.integers(0, size, size=queries)] + rng.normal(0, 0.05, size=(queries, dimension)).astype('float32')
+    results = []
+    for backend, store_config in _store_configs(workdir, dimension, milvus_uri).items():
+        telemetry.reset()
+        create_vector_store(store_config).delete_collection()
+        store = create_vector_store(store_config)
+        metadata = [{'url': f"item-{i}", 'category': CATEGORIES[i % len(CATEGORIES)], 'description': ''} for i in range(size)]
+        start = time.perf_counter()
+        for offset in range(0, size, 1000):
+            store.add(vectors=list(vectors[offset:offset + 1000]), metadata=metadata[offset:offset + 1000])
+        store.checkpoint()
+        store.build_index()
+        add_seconds = time.perf_counter() - start
+
+        single = run_concurrent(lambda v: store.search(vector=v, top_k=top_k), list(query_vectors), 1)
+        start = time.perf_counter()
+        for offset in range(0, queries, 256):
+            store.search_batch(list(query_vectors[offset:offset + 256]), top_k)
+        batch_seconds = time.perf_counter() - start
+        result = {
+            'backend': backend,
+            'size': size,
+            'dimension': dimension,
+            'add_seconds': add_seconds,
+            'vectors_per_second': size / add_seconds,
+            'search': single,
+            'search_batch': {'batch_size': 256, 'seconds': batch_seconds, 'qps': queries / batch_seconds},
+            'concurrent_search': [
+                run_concurrent(lambda v: store.search(vector=v, top_k=top_k), list(query_vectors), level)
+                for level in concurrency
+            ],
+        }
+        store.delete_collection()
+        results.append(result)
+    return results
+
+
+def _sample_queries(data_path: str, count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    from data_sources import read_dataframe
+
+    df = read_dataframe(data_path)
+    rows = df.sample(n=count, replace=count > len(df), random_state=seed)
+    # 查询文本去掉开头的类别词，避免直接给出答案
+    return [{'image': row['url'], 'text': row['desc'].split(' ', 1)[1]} for _, row in rows.iterrows()]
+
+
+def bench_assistant(config: Dict[str, Any], queries: List[Dict[str, Any]], concurrency: Sequence[int], top_k: int = 5) -> Dict[str, Any]:
+    from backend import create_backend
+    from llm_batch import answer_batch
+
+    encoder, vector_store, assistant = create_backend(config)
+    instruction = "找到与查询最相似的商品。"
+
+    def answer_one(query):
+        with telemetry.span("encode", batch_size=1):
+            vector = encoder.encode(image=query['image'], text=query['text'])
+        with telemetry.span("search", top_k=top_k):
+            candidates = vector_store.search(vector=vector, top_k=top_k)
+        return assistant.answer(instruction=instruction, candidates=candidates, query_image=query['image'],
+                                query_text=query['text'], query_vector=vector)
+
+    levels = []
+    for level in concurrency:
+        telemetry.reset()
+        result = run_concurrent(answer_one, queries, level)
+        result['stages'] = stage_breakdown()
+        levels.append(result)
+
+    telemetry.reset()
+    prepared = []
+    for query in queries:
+        vector = encoder.encode(image=query['image'], text=query['text'])
+        prepared.append({
+            'instruction': instruction,
+            'candidates': vector_store.search(vector=vector, top_k=top_k),
+            'query_image': query['image'],
+            'query_text': query['text'],
+        })
+    batch_config = config.get('llm', {}).get('batch', {})
+    start = time.perf_counter()
+    answer_batch(assistant, prepared, batch_config)
+    batch_seconds = time.perf_counter() - start
+    return {
+        'queries': len(queries),
+        'answer': levels,
+        'answer_batch': {
+            'max_concurrency': batch_config.get('max_concurrency', 8),
+            'seconds': batch_seconds,
+            'qps': len(queries) / batch_seconds,
+            'stages': stage_breakdown(),
+        },
+    }
+
+
+def bench_api(config: Dict[str, Any], queries: List[Dict[str, Any]], concurrency: Sequence[int], top_k: int = 5) -> Dict[str, Any]:
+    from api_server import QueryService, start_api_server
+
+    service = QueryService.from_config(config)
+    server, url = start_api_server(service, port=0)
+    bodies = []
+    for query in queries:
+        with open(query['image'], 'rb') as f:
+            image_base64 = base64.b64encode(f.read()).decode('ascii')
+        bodies.append(json.dumps({'text': query['text'], 'image_base64': image_base64, 'top_k': top_k}).encode('utf-8'))
+
+    def post(path, body):
+        request = urllib.request.Request(url + path, data=body, headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=120) as response:
+            response.read()
+
+    results = {}
+    try:
+        for path in ('/search', '/answer'):
+            levels = []
+            for level in concurrency:
+                telemetry.reset()
+                result = run_concurrent(partial(post, path), bodies, level)
+                result['stages'] = stage_breakdown()
+                levels.append(result)
+            results[path.strip('/')] = levels
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+# --- 结果 ---
+
+def environment_info() -> Dict[str, Any]:
+    info = {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+    }
+    try:
+        import faiss
+        info['faiss'] = faiss.__version__
+    except (ImportError, AttributeError):
+        pass
+    try:
+        root = os.path.dirname(os.path.abspath(__file__))
+        info['git_commit'] = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=root, capture_output=True, text=True, check=True).stdout.strip()
+        info['git_dirty'] = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                                                capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return info
+
+
+def _flatten(value: Any, prefix: str = '') -> Dict[str, float]:
+    """将嵌套结果展开为 {路径: 数值}，列表项以其 concurrency / backend 标识，便于逐项对比。"""
+    flat = {}
+    if isinstance(value, dict):
+        for key, item in value.items():
+            flat.update(_flatten(item, f"{prefix}.{key}" if prefix else str(key)))
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            label = index
+            if isinstance(item, dict):
+                label = item.get('backend') or (f"c{item['concurrency']}" if 'concurrency' in item else index)
+            flat.update(_flatten(item, f"{prefix}[{label}]"))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        flat[prefix] = float(value)
+    return flat
+
+
+def compare_results(before: Dict[str, Any], after: Dict[str, Any]) -> List[str]:
+    """逐项对比两次运行中同名的吞吐量与延迟指标，返回可读的差异行。"""
+    if before.get('params') != after.get('params'):
+        print("警告: 两次运行的参数不同，对比结果仅供参考。")
+    old = _flatten(before.get('results', {}))
+    new = _flatten(after.get('results', {}))
+    lines = []
+    for key in sorted(set(old) & set(new)):
+        metric = key.rsplit('.', 1)[-1]
+        if not (metric.endswith('_ms') or metric in HIGHER_IS_BETTER) or '.stages.' in key:
+            continue
+        if old[key] == 0:
+            continue
+        change = (new[key] - old[key]) / old[key]
+        better = change > 0 if metric in HIGHER_IS_BETTER else change < 0
+        marker = "↑" if better else "↓"
+        lines.append(f"{key}: {old[key]:.2f} -> {new[key]:.2f} ({change:+.1%} {marker if abs(change) >= 0.05 else '='})")
+    return lines
+
+
+def summarize(results: Dict[str, Any]) -> List[str]:
+    """每个场景的关键数字。"""
+    lines = []
+    if 'ingest' in results:
+        r = results['ingest']
+        lines.append(f"ingest: {r['rows_per_second']:.1f} 行/秒（{r['rows']} 行，失败 {r['failed']}）")
+    for r in results.get('store', []):
+        lines.append(f"store[{r['backend']}]: 写入 {r['vectors_per_second']:.0f} 条/秒，单条检索 p50 {r['search']['p50_ms']:.2f}ms "
+                     f"p99 {r['search']['p99_ms']:.2f}ms，批量检索 {r['search_batch']['qps']:.0f} QPS")
+    if 'assistant' in results:
+        for r in results['assistant']['answer']:
+            lines.append(f"assistant c={r['concurrency']}: {r['qps']:.1f} QPS，p50 {r.get('p50_ms', 0):.0f}ms p99 {r.get('p99_ms', 0):.0f}ms，失败 {r['errors']}")
+        lines.append(f"assistant answer_batch: {results['assistant']['answer_batch']['qps']:.1f} QPS")
+    for path, levels in results.get('api', {}).items():
+        for r in levels:
+            lines.append(f"api /{path} c={r['concurrency']}: {r['qps']:.1f} QPS，p50 {r.get('p50_ms', 0):.1f}ms p99 {r.get('p99_ms', 0):.1f}ms，失败 {r['errors']}")
+    return lines
+
+
+def main(args):
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f"未知的场景: {', '.join(sorted(unknown))}，可选 {', '.join(SCENARIOS)}")
+    concurrency = [int(level) for level in args.concurrency.split(',')]
+    with open(args.config_path, 'r', encoding='utf-8') as f:
+        base_config = yaml.safe_load(f)
+    params = {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'workdir', 'keep_workdir')}
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='rag-benchmark-')
+    os.makedirs(workdir, exist_ok=True)
+    print(f"工作目录: {workdir}")
+    servers = []
+    results: Dict[str, Any] = {}
+    try:
+        llm_url = None
+        if {'assistant', 'api'} & set(scenarios):
+            from fake_openai_server import start_fake_openai_server
+            llm_server, llm_url = start_fake_openai_server(latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms, seed=args.seed)
+            servers.append(llm_server)
+            llm_url += "/v1"
+        image_base_url = None
+        if args.serve_images:
+            image_server, image_base_url = serve_directory(workdir)
+            servers.append(image_server)
+
+        encoder_options = {'batch_latency_ms': args.encoder_batch_ms, 'item_latency_ms': args.encoder_item_ms}
+        config = build_config(base_config, workdir, llm_url, args.dimension, encoder_options, enable_caches=args.enable_caches)
+        config_path = os.path.join(workdir, 'config.yaml')
+        with open(config_path, 'w', encoding='utf-8') as f:
+            yaml.safe_dump(config, f, allow_unicode=True)
+
+        data_path = None
+        if {'ingest', 'assistant', 'api'} & set(scenarios):
+            print(f"生成 {args.rows} 行合成数据...")
+            data_path = generate_dataset(workdir, args.rows, args.image_size, args.data_format, args.seed, image_base_url)
+            # 问答场景需要已建好的知识库；未选择 ingest 场景时同样构建，但不计入结果
+            ingest_result = bench_ingest(config_path, data_path, args.rows)
+            if 'ingest' in scenarios:
+                results['ingest'] = ingest_result
+        if 'store' in scenarios:
+            results['store'] = bench_store(workdir, args.dimension, args.store_size, args.queries, concurrency,
+                                           milvus_uri=args.milvus_uri, seed=args.seed)
+        if {'assistant', 'api'} & set(scenarios):
+            queries = _sample_queries(data_path, args.queries, args.seed)
+            # 使用本地路径作为查询图片，避免测到图片服务本身
+            if image_base_url:
+                for query in queries:
+                    query['image'] = os.path.join(workdir, query['image'][len(image_base_url) + 1:])
+            if 'assistant' in scenarios:
+                results['assistant'] = bench_assistant(config, queries, concurrency)
+            if 'api' in scenarios:
+                results['api'] = bench_api(config, queries, concurrency)
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        telemetry.shutdown()
+        if not args.keep_workdir and not args.workdir:
+            import shutil
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'environment': environment_info(),
+        'params': params,
+        'results': results,
+    }
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print("\n===== 基准测试结果 =====")
+    for line in summarize(results):
+        print(line)
+    print(f"完整结果已写入 {args.output}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"\n===== 与 {args.compare} 对比 =====")
+        for line in compare_results(baseline, report):
+            print(line)
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="端到端性能基准与压测（离线替身编码器 + 本地假 LLM 服务）")
+    parser.add_argument("--config_path", type=str, default="configs/config.yaml", help="作为基础的应用配置（流水线、LLM 批处理等设置）")
+    parser.add_argument("--scenarios", type=str, default=",".join(SCENARIOS), help=f"逗号分隔的场景，可选 {', '.join(SCENARIOS)}")
+    parser.add_argument("--output", type=str, default=f"benchmark_results/{time.strftime('%Y%m%d-%H%M%S')}.json", help="结果 JSON 的输出路径")
+    parser.add_argument("--compare", type=str, default=None, help="与之前的结果 JSON 对比")
+    parser.add_argument("--rows", type=int, default=2000, help="合成数据的行数（索引场景）")
+    parser.add_argument("--data_format", type=str, default="xlsx", choices=["xlsx", "csv", "parquet"], help="合成数据表的格式")
+    parser.add_argument("--image_size", type=int, default=224, help="合成图片的边长")
+    parser.add_argument("--serve_images", action="store_true", help="通过本地 HTTP 服务提供图片，使索引场景包含下载阶段")
+    parser.add_argument("--store_size", type=int, default=20000, help="存储场景写入的向量数")
+    parser.add_argument("--dimension", type=int, default=512, help="向量维度")
+    parser.add_argument("--queries", type=int, default=200, help="每个并发级别执行的查询数")
+    parser.add_argument("--concurrency", type=str, default="1,4,16", help="逗号分隔的并发级别")
+    parser.add_argument("--llm_latency_ms", type=float, default=200.0, help="假 LLM 服务的基础延迟（毫秒）")
+    parser.add_argument("--llm_jitter_ms", type=float, default=50.0, help="假 LLM 服务的延迟抖动（毫秒）")
+    parser.add_argument("--encoder_batch_ms", type=float, default=0.0, help="替身编码器每次推理的模拟耗时（毫秒）")
+    parser.add_argument("--encoder_item_ms", type=float, default=0.0, help="替身编码器每条数据的模拟耗时（毫秒）")
+    parser.add_argument("--enable_caches", action="store_true", help="保留问答缓存与语义缓存（默认关闭以测量未命中路径）")
+    parser.add_argument("--milvus_uri", type=str, default=None, help="同时测试 Milvus 后端（例如 http://localhost:19530）")
+    parser.add_argument("--seed", type=int, default=0, help="合成数据与假服务的随机种子")
+    parser.add_argument("--workdir", type=str, default=None, help="工作目录，默认使用临时目录并在结束后删除")
+    parser.add_argument("--keep_workdir", action="store_true", help="保留临时工作目录")
+    main(parser.parse_args())
@@ -0,0 +1,255 @@
+"""
+类别分类快速通道：直接回答"查询属于哪个类别"，置信度足够时不调用 LLM。
+
+分类分数由两部分加权得到：
+    1. 近邻投票：top_k 个近邻按余弦相似度加权，对其类别投票；
+    2. 类别质心：建立索引时为每个类别预先计算的归一化质心向量，查询与各质心的余弦相似度经 softmax 得到分布。
+类别是层级化的（例如 risk/prohibited/firearms）：末级类别置信度不足时，逐级向上合并子类别的分数，
+返回第一个达到阈值的上级类别（例如只能确定属于 risk/prohibited，但无法确定具体子类）。
+仍然达不到阈值时由调用方回退到 LLM（见 api_server.py 的 /classify）。
+快速通道只用于 /classify 这类固定的"属于哪个类别"问题；问答选项卡与 batch_query.py 回答的是任意指令
+（例如描述商品、判断是否同一风险类型），分类结果不能代替其回答，因此仍然调用 LLM。
+
+质心文件在 index_data.py 与后台索引任务完成时自动生成；分片注册或合并、增量更新之后可以手动重建:
+    python category_classifier.py --config_path configs/config.yaml
+"""
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from stores import BaseVectorStore, similarity_from_distance
+
+CATEGORY_SEPARATOR = '/'
+DEFAULT_INSTRUCTION = "判断查询商品属于哪个类别、是否为违禁品，并推荐类别最匹配的参考条目。"
+
+
+def category_prefixes(category: str) -> List[str]:
+    """返回层级类别的全部上级类别（由近到远），例如 'risk/prohibited/firearms' -> ['risk/prohibited', 'risk']。"""
+    parts = category.split(CATEGORY_SEPARATOR)
+    return [CATEGORY_SEPARATOR.join(parts[:i]) for i in range(len(parts) - 1, 0, -1)]
+
+
+class CategoryCentroids:
+    """每个类别的归一化质心向量，以 .npz 文件保存。"""
+    def __init__(self, labels: List[str], vectors: np.ndarray, counts: np.ndarray):
+        """
+        :param labels: 类别名。
+        :param vectors: 形状为 (len(labels), dim) 的归一化质心矩阵。
+        :param counts: 每个类别参与计算的向量数。
+        """
+        self.labels = list(labels)
+        self.vectors = np.asarray(vectors, dtype='float32')
+        self.counts = np.asarray(counts, dtype='int64')
+
+    @classmethod
+    def build(cls, batches: Iterable[Tuple[np.ndarray, List[Dict[str, Any]]]], category_field: str = 'category') -> "CategoryCentroids":
+        """
+        由 (向量矩阵, 元数据列表) 批次累加得到各类别的质心，没有类别的向量被忽略。
+        """
+        sums: Dict[str, np.ndarray] = {}
+        counts: Dict[str, int] = {}
+        dimension = 0
+        for vectors, metadata in batches:
+            vectors = np.asarray(vectors, dtype='float32')
+            dimension = vectors.shape[1]
+            vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            labels = np.array([str(item.get(category_field) or '').strip() for item in metadata])
+            for label in np.unique(labels):
+                if not label:
+                    continue
+                mask = labels == label
+                sums[label] = sums.get(label, 0) + vectors[mask].sum(axis=0)
+                counts[label] = counts.get(label, 0) + int(mask.sum())
+        labels = sorted(sums)
+        matrix = np.stack([sums[label] for label in labels]) if labels else np.empty((0, dimension), dtype='float32')
+        matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        return cls(labels, matrix, np.array([counts[label] for label in labels], dtype='int64'))
+
+    @classmethod
+    def from_vector_store(cls, vector_store: BaseVectorStore, category_field: str = 'category') -> "CategoryCentroids":
+        """遍历向量存储中的全部向量计算质心。"""
+        return cls.build(vector_store.iter_vectors(), category_field=category_field)
+
+    def save(self, path: str):
+        """先写入临时文件再原子替换。"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path + ".tmp", 'wb') as f:
+            np.savez(f, labels=np.array(self.labels, dtype=str), vectors=self.vectors, counts=self.counts)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["CategoryCentroids"]:
+        """读取质心文件，文件不存在时返回 None。"""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return cls(data['labels'].tolist(), data['vectors'], data['counts'])
+
+
+def build_and_save_centroids(vector_store: BaseVectorStore, classification_config: Optional[Dict[str, Any]]) -> Optional[CategoryCentroids]:
+    """
+    索引完成后调用：配置了 classification.centroids_path 时计算并保存类别质心。
+    存储不支持遍历向量时只给出提示，不影响索引结果。
+    """
+    path = (classification_config or {}).get('centroids_path')
+    if not path:
+        return None
+    try:
+        centroids = CategoryCentroids.from_vector_store(vector_store, (classification_config or {}).get('category_field', 'category'))
+    except NotImplementedError as e:
+        print(f"跳过类别质心的计算: {e}")
+        return None
+    centroids.save(path)
+    print(f"已保存 {len(centroids.labels)} 个类别的质心到 {path}")
+    return centroids
+
+
+class CategoryClassifier:
+    """
+    近邻投票与类别质心相结合的分类器，只做矩阵运算，不调用 LLM。
+    classify 的结果中 confident 为 False 时，调用方应回退到 LLM，并用 apply_llm_answer 合并结论。
+    """
+    def __init__(
+        self,
+        centroids: Optional[CategoryCentroids] = None,
+        top_k: int = 10,
+        confidence_threshold: float = 0.7,
+        centroid_weight: float = 0.3,
+        centroid_temperature: float = 0.05,
+        hierarchical: bool = True,
+        category_field: str = 'category',
+        instruction: str = DEFAULT_INSTRUCTION
+    ):
+        """
+        :param centroids: 类别质心，为 None 时只使用近邻投票。
+        :param top_k: 参与投票的近邻数。
+        :param confidence_threshold: 置信度达到该值时直接返回类别，否则需要 LLM 判断。
+        :param centroid_weight: 质心分布在最终分数中的权重（0 到 1），其余为近邻投票的权重。
+        :param centroid_temperature: 质心相似度做 softmax 时的温度，越小分布越尖锐。
+        :param hierarchical: 末级类别置信度不足时，是否返回达到阈值的上级类别。
+        :param category_field: 元数据中的类别字段。
+        :param instruction: 置信度不足、回退到 LLM 时使用的指令（请求未指定时）。
+        """
+        self.centroids = centroids if centroids is not None and centroids.labels else None
+        self.top_k = top_k
+        self.confidence_threshold = confidence_threshold
+        self.centroid_weight = centroid_weight
+        self.centroid_temperature = centroid_temperature
+        self.hierarchical = hierarchical
+        self.category_field = category_field
+        self.instruction = instruction
+        # 由 from_config 设置，reload 时从该文件重新读取质心
+        self.centroids_path: Optional[str] = None
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]]) -> "CategoryClassifier":
+        """根据 classification 配置段创建分类器，质心文件不存在时只使用近邻投票。"""
+        config = dict(config or {})
+        centroids_path = config.pop('centroids_path', None)
+        classifier = cls(**config)
+        classifier.centroids_path = centroids_path
+        classifier.reload()
+        return classifier
+
+    def reload(self):
+        """重新读取质心文件（例如后台索引任务提交了新的索引之后）。"""
+        if not self.centroids_path:
+            return
+        centroids = CategoryCentroids.load(self.centroids_path)
+        if centroids is None:
+            print(f"警告: 类别质心文件 {self.centroids_path} 不存在，分类只使用近邻投票。重新建立索引或运行 category_classifier.py 可生成该文件。")
+        self.centroids = centroids if centroids is not None and centroids.labels else None
+
+    def _knn_scores(self, neighbours: List[Dict[str, Any]]) -> Dict[str, float]:
+        votes: Dict[str, float] = {}
+        for rank, item in enumerate(neighbours):
+            label = str(item.get(self.category_field) or '').strip()
+            if not label:
+                continue
+            similarity = similarity_from_distance(item.get('distance'))
+            # 没有距离时按排名加权；负相似度不参与投票
+            weight = max(similarity, 0.0) if similarity is not None else 1.0 / (rank + 1)
+            votes[label] = votes.get(label, 0.0) + weight
+        total = sum(votes.values())
+        return {label: vote / total for label, vote in votes.items()} if total > 0 else {}
+
+    def _centroid_scores(self, query_vector: np.ndarray) -> Dict[str, float]:
+        query = np.asarray(query_vector, dtype='float32').ravel()
+        if self.centroids is None or query.shape[0] != self.centroids.vectors.shape[1]:
+            return {}
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        logits = self.centroids.vectors @ query / self.centroid_temperature
+        weights = np.exp(logits - logits.max())
+        weights /= weights.sum()
+        return dict(zip(self.centroids.labels, weights.tolist()))
+
+    def classify(self, query_vector: np.ndarray, neighbours: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        :param query_vector: 查询的编码向量。
+        :param neighbours: 检索结果（带 'distance' 时按相似度加权）。
+        :return: category（类别，可能是上级类别）、confidence、confident（是否达到阈值）、
+            scores（得分最高的若干末级类别）、source（'knn'），以及回退到 LLM 时才有值的 answer / recommended_index。
+        """
+        knn_scores = self._knn_scores(neighbours[:self.top_k])
+        centroid_scores = self._centroid_scores(query_vector)
+        if knn_scores and centroid_scores:
+            scores = {
+                label: (1 - self.centroid_weight) * knn_scores.get(label, 0.0) + self.centroid_weight * centroid_scores.get(label, 0.0)
+                for label in set(knn_scores) | set(centroid_scores)
+            }
+        else:
+            scores = knn_scores or centroid_scores
+        top_scores = dict(sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:5])
+        if not scores:
+            return {'category': None, 'confidence': 0.0, 'confident': False, 'scores': {}, 'source': 'knn', 'answer': None, 'recommended_index': None}
+
+        category = max(scores, key=scores.get)
+        confidence = scores[category]
+        if confidence < self.confidence_threshold and self.hierarchical:
+            for prefix in category_prefixes(category):
+                group_confidence = sum(score for label, score in scores.items() if label == prefix or label.startswith(prefix + CATEGORY_SEPARATOR))
+                if group_confidence >= self.confidence_threshold:
+                    category, confidence = prefix, group_confidence
+                    break
+        return {
+            'category': category,
+            'confidence': float(confidence),
+            'confident': confidence >= self.confidence_threshold,
+            'scores': top_scores,
+            'source': 'knn',
+            'answer': None,
+            'recommended_index': None,
+        }
+
+    @staticmethod
+    def apply_llm_answer(result: Dict[str, Any], answer: Tuple[str, Optional[int], List[Dict[str, Any]]], category_field: str = 'category') -> Dict[str, Any]:
+        """
+        合并 LLM 的结论：LLM 推荐了某个候选项时采用其类别，否则保留分类器的结果。
+        """
+        answer_text, recommended_index, references = answer
+        merged = dict(result, source='llm', answer=answer_text, recommended_index=recommended_index)
+        if recommended_index is not None and references[recommended_index].get(category_field):
+            merged['category'] = references[recommended_index][category_field]
+        return merged
+
+
+if __name__ == "__main__":
+    import argparse
+    import yaml
+
+    from stores import create_vector_store
+
+    parser = argparse.ArgumentParser(description="根据当前向量存储重建类别质心文件")
+    parser.add_argument("--config_path", type=str, default="configs/config.yaml", help="配置文件路径")
+    args = parser.parse_args()
+
+    with open(args.config_path, 'r', encoding='utf-8') as f:
+        app_config = yaml.safe_load(f)
+    classification_config = app_config.get('classification', {})
+    if not classification_config.get('centroids_path'):
+        print("配置中没有 classification.centroids_path。")
+    else:
+        build_and_save_centroids(create_vector_store(app_config['vector_store']), classification_config)
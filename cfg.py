@@ -6,6 +6,12 @@ class Config:
         # Set the path where images will be downloaded to "./images".
         self.imgs_per_category = 300
         # Define the number of images to download per category, set to 300.
+        self.download_workers = 16
+        # Set the number of concurrent image downloads.
+        self.source_dir = None
+        # Set the directory holding local raw_meta_<category>.jsonl/.parquet dumps, None to stream from Hugging Face.
+        self.config_path = "configs/config.yaml"
+        # Set the config file providing the encoder and vector store used by index.py.
         self.milvus_uri = "milvus.db"
         # Set the URI for the Milvus database, you can change to "http://localhost:19530" for a standard Milvus.
         self.collection_name = "cir_demo_large"
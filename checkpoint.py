@@ -0,0 +1,118 @@
+import itertools
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+
+def atomic_write_json(path: str, payload: Dict[str, Any]):
+    """先写入临时文件并落盘，再原子替换，避免进程被终止时留下半个文件。"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class IndexingCheckpoint:
+    """
+    索引任务的检查点：记录数据源中已处理到的行号（游标）以及当时向量存储中的向量数量。
+    恢复时从游标处继续读取数据源，并将向量存储截断到检查点时的数量，丢弃检查点之后未确认的写入。
+    """
+    def __init__(self, path: str):
+        """
+        :param path: 检查点文件路径（JSON）。
+        """
+        self.path = path
+        self.state: Dict[str, Any] = {}
+
+    @staticmethod
+    def _source_signature(data_path: str) -> Dict[str, Any]:
+        stat = os.stat(data_path)
+        return {'data_path': os.path.abspath(data_path), 'source_size': stat.st_size, 'source_mtime': stat.st_mtime}
+
+    def load(self, data_path: str) -> Optional[Dict[str, Any]]:
+        """
+        读取检查点。检查点不存在或不属于该数据源时返回 None；数据源在检查点之后被修改过时给出警告。
+        """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        signature = self._source_signature(data_path)
+        if state.get('data_path') != signature['data_path']:
+            print(f"警告: 检查点属于另一个数据源 ({state.get('data_path')})，将忽略该检查点。")
+            return None
+        if state.get('source_size') != signature['source_size'] or state.get('source_mtime') != signature['source_mtime']:
+            print("警告: 数据源在上次检查点之后被修改过，续传结果可能不一致。")
+        self.state = state
+        return state
+
+    def save(self, data_path: str, rows_consumed: int, vectors_indexed: Optional[int], failed_rows: int, completed: bool = False, **extra):
+        """
+        写入检查点。必须在向量存储的 checkpoint() 成功之后调用，保证游标不会超前于已持久化的数据。
+        :param rows_consumed: 数据源中已处理的行数（不含表头）。
+        :param vectors_indexed: 检查点时向量存储中的向量数量。
+        :param failed_rows: 累计写入重试文件的行数。
+        :param completed: 索引是否已全部完成。
+        :param extra: 调用方需要一并保存的其他状态（例如批量查询的输出位置）。
+        """
+        self.state = dict(
+            self._source_signature(data_path),
+            rows_consumed=rows_consumed,
+            vectors_indexed=vectors_indexed,
+            failed_rows=failed_rows,
+            completed=completed,
+            updated_at=time.strftime('%Y-%m-%d %H:%M:%S'),
+            **extra
+        )
+        atomic_write_json(self.path, self.state)
+
+    def clear(self):
+        """删除检查点文件。"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.state = {}
+
+
+class FailedRowLog:
+    """
+    以 JSONL 格式追加记录处理失败的行（例如图片 URL 失效），便于修复后用该文件重新索引。
+    每行保留原始字段，另加 _row（数据源中的行号）与 _error（失败原因）。
+    """
+    def __init__(self, path: str, keep_entries: int = 0):
+        """
+        :param path: 重试文件路径。
+        :param keep_entries: 保留文件中已有的前若干条记录（从检查点恢复时传入检查点记录的数量，
+            丢弃检查点之后写入、恢复后会被重新处理的记录）；为 0 时清空文件。
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if keep_entries and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as src, open(path + ".tmp", 'w', encoding='utf-8') as dst:
+                for line in itertools.islice(src, keep_entries):
+                    dst.write(line)
+            os.replace(path + ".tmp", path)
+            self._file = open(path, 'a', encoding='utf-8')
+        else:
+            self._file = open(path, 'w', encoding='utf-8')
+        self.count = keep_entries
+
+    def write(self, row_number: int, record: Dict[str, Any], error: BaseException):
+        entry = dict(record, _row=row_number, _error=f"{type(error).__name__}: {error}")
+        self._file.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+        self.count += 1
+
+    def flush(self):
+        """与检查点一同调用，将失败记录落盘。"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,286 @@
+import itertools
+import os
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import pandas as pd
+
+# 每次从数据源读取的默认行数
+DEFAULT_CHUNK_SIZE = 2000
+# 索引流程实际用到的列，列式格式只读取这些列
+INDEX_COLUMNS = ['url', 'desc', 'category']
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+ARROW_EXTENSIONS = ('.arrow', '.feather', '.arrows', '.ipc')
+
+
+def _clean_records(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """将缺失值统一为空字符串，与 CSV 读取的结果保持一致。"""
+    for record in records:
+        for key, value in record.items():
+            if value is None or (isinstance(value, float) and value != value):
+                record[key] = ''
+    return records
+
+
+class ColumnarRow(Mapping):
+    """
+    列式批次中某一行的只读视图，按需从列中取值，不为每行构造字典。
+    支持 row['url'] / row.get('desc') / dict(row) 等映射操作。
+    """
+    __slots__ = ('_columns', '_index')
+
+    def __init__(self, columns: Dict[str, List[Any]], index: int):
+        self._columns = columns
+        self._index = index
+
+    def __getitem__(self, key: str) -> Any:
+        return self._columns[key][self._index]
+
+    def __iter__(self):
+        return iter(self._columns)
+
+    def __len__(self) -> int:
+        return len(self._columns)
+
+    def __repr__(self) -> str:
+        return f"ColumnarRow({dict(self)!r})"
+
+
+def _rows_from_arrow_batch(batch) -> List[ColumnarRow]:
+    """将 Arrow RecordBatch 按列整体转换为 Python 列表（C 层批量转换），再包装为行视图。"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    columns = {}
+    for name, column in zip(batch.schema.names, batch.columns):
+        # 字符串列的空值统一为空字符串，与 CSV 读取的结果保持一致
+        if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+            column = pc.fill_null(column, '')
+        columns[name] = column.to_pylist()
+    return [ColumnarRow(columns, i) for i in range(batch.num_rows)]
+
+
+def _select_columns(names: Sequence[str], columns: Optional[List[str]]) -> Optional[List[str]]:
+    if columns is None:
+        return None
+    return [name for name in names if name in columns]
+
+
+def _iter_parquet(path: str, chunk_size: int, start_row: int, columns: Optional[List[str]]) -> Iterator[List[ColumnarRow]]:
+    import pyarrow.parquet as pq
+
+    # 内存映射读取，只解码需要的列；续传时整体跳过起始行之前的 row group
+    parquet_file = pq.ParquetFile(path, memory_map=True)
+    row_groups, skip, offset = [], start_row, 0
+    for i in range(parquet_file.num_row_groups):
+        rows = parquet_file.metadata.row_group(i).num_rows
+        if offset + rows > start_row:
+            row_groups.append(i)
+        elif row_groups == []:
+            skip -= rows
+        offset += rows
+    if not row_groups:
+        return
+    selected = _select_columns(parquet_file.schema_arrow.names, columns)
+    for batch in parquet_file.iter_batches(batch_size=chunk_size, row_groups=row_groups, columns=selected):
+        if skip:
+            dropped = min(skip, batch.num_rows)
+            batch = batch.slice(dropped)
+            skip -= dropped
+            if batch.num_rows == 0:
+                continue
+        yield _rows_from_arrow_batch(batch)
+
+
+def _iter_arrow(path: str, chunk_size: int, start_row: int, columns: Optional[List[str]]) -> Iterator[List[ColumnarRow]]:
+    import pyarrow as pa
+
+    # Arrow IPC 文件通过内存映射零拷贝读取，批次切片也不复制数据
+    source = pa.memory_map(path, 'r')
+    try:
+        try:
+            reader = pa.ipc.open_file(source)
+            batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+            names = reader.schema.names
+        except pa.ArrowInvalid:
+            # 流式 IPC 格式（没有文件尾部索引）
+            source.seek(0)
+            reader = pa.ipc.open_stream(source)
+            batches = iter(reader)
+            names = reader.schema.names
+        selected = _select_columns(names, columns)
+        skip = start_row
+        for batch in batches:
+            if skip >= batch.num_rows:
+                skip -= batch.num_rows
+                continue
+            batch = batch.slice(skip)
+            skip = 0
+            if selected is not None:
+                batch = batch.select(selected)
+            for start in range(0, batch.num_rows, chunk_size):
+                yield _rows_from_arrow_batch(batch.slice(start, chunk_size))
+    finally:
+        source.close()
+
+
+def _iter_csv(path: str, chunk_size: int, start_row: int, columns: Optional[List[str]] = None) -> Iterator[List[Dict[str, Any]]]:
+    # 全部按字符串读取，避免类型推断在不同分块间不一致；跳过的行只做行切分，不解析字段
+    reader = pd.read_csv(path, chunksize=chunk_size, dtype=str, keep_default_na=False,
+                         skiprows=range(1, start_row + 1) if start_row else None,
+                         usecols=(lambda name: name in columns) if columns is not None else None)
+    for chunk in reader:
+        yield chunk.to_dict('records')
+
+
+def _iter_jsonl(path: str, chunk_size: int, start_row: int) -> Iterator[List[Dict[str, Any]]]:
+    reader = pd.read_json(path, lines=True, chunksize=chunk_size, dtype=False)
+    skipped = 0
+    for chunk in reader:
+        if skipped < start_row:
+            drop = min(start_row - skipped, len(chunk))
+            skipped += drop
+            chunk = chunk.iloc[drop:]
+            if chunk.empty:
+                continue
+        yield _clean_records(chunk.to_dict('records'))
+
+
+def _iter_xlsx(path: str, chunk_size: int, start_row: int) -> Iterator[List[Dict[str, Any]]]:
+    from openpyxl import load_workbook
+
+    # read_only 模式按行流式解析工作表，不会把整个表加载到内存
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(name) if name is not None else f"column_{i}" for i, name in enumerate(header)]
+        # 空行同样计入行号，与 CSV 的行号保持一致
+        rows = itertools.islice(rows, start_row, None)
+        batch: List[Dict[str, Any]] = []
+        for values in rows:
+            batch.append(dict(zip(columns, values or ())))
+            if len(batch) >= chunk_size:
+                yield _clean_records(batch)
+                batch = []
+        if batch:
+            yield _clean_records(batch)
+    finally:
+        workbook.close()
+
+
+def iter_dataframe_batches(
+    df: pd.DataFrame,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    start_row: int = 0,
+    index_field: Optional[str] = None
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    按固定大小分批将已加载的 DataFrame 转换为记录列表，避免一次性转换整个表。
+    :param index_field: 不为 None 时，将 DataFrame 的索引以该字段名写入每条记录。
+    """
+    for start in range(start_row, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size]
+        records = chunk.to_dict('records')
+        if index_field is not None:
+            for record, index in zip(records, chunk.index.tolist()):
+                record[index_field] = index
+        yield _clean_records(records)
+
+
+def iter_record_batches(
+    path: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    start_row: int = 0,
+    columns: Optional[List[str]] = None
+) -> Iterator[List[Mapping]]:
+    """
+    流式读取数据文件，每次产出最多 chunk_size 条记录（映射列表）。
+    Parquet / Arrow IPC 通过内存映射按列读取，记录为 ColumnarRow 行视图；
+    CSV / JSONL 使用 pandas 分块读取，xlsx 使用 openpyxl 的只读模式逐行解析，记录为字典。内存占用与文件大小无关。
+    :param path: 数据文件路径，支持 .parquet / .arrow / .feather / .csv / .jsonl / .xlsx / .xls。
+    :param chunk_size: 每批的最大行数。
+    :param start_row: 跳过表头之后的前 start_row 行数据，用于断点续传。
+    :param columns: 只读取这些列（不存在的列会被忽略），为 None 时读取全部列。Parquet / Arrow / CSV 支持列裁剪。
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"数据文件不存在: {path}")
+    lower = path.lower()
+    if lower.endswith(PARQUET_EXTENSIONS):
+        return _iter_parquet(path, chunk_size, start_row, columns)
+    if lower.endswith(ARROW_EXTENSIONS):
+        return _iter_arrow(path, chunk_size, start_row, columns)
+    if lower.endswith('.csv'):
+        return _iter_csv(path, chunk_size, start_row, columns)
+    if lower.endswith('.jsonl'):
+        return _iter_jsonl(path, chunk_size, start_row)
+    if lower.endswith('.xlsx'):
+        return _iter_xlsx(path, chunk_size, start_row)
+    if lower.endswith('.xls'):
+        # 旧版 .xls 格式没有流式解析器，只能整体读取后再分批
+        print("警告: .xls 格式不支持流式读取，将整体加载到内存。建议转换为 .xlsx 或 .csv。")
+        return iter_dataframe_batches(pd.read_excel(path), chunk_size, start_row)
+    raise ValueError("不支持的数据文件格式。请使用 Parquet、Arrow、CSV、JSONL 或 Excel 文件。")
+
+
+def estimate_row_count(path: str) -> Optional[int]:
+    """
+    在不读取全部数据的前提下估计数据行数（不含表头），用于显示进度。无法廉价估计时返回 None。
+    """
+    lower = path.lower()
+    if lower.endswith(PARQUET_EXTENSIONS):
+        # 行数记录在文件尾部的元数据中，无需读取数据
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path, memory_map=True).metadata.num_rows
+    if lower.endswith(ARROW_EXTENSIONS):
+        import pyarrow as pa
+        with pa.memory_map(path, 'r') as source:
+            try:
+                reader = pa.ipc.open_file(source)
+            except pa.ArrowInvalid:
+                return None
+            return sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+    if lower.endswith('.xlsx'):
+        from openpyxl import load_workbook
+        workbook = load_workbook(path, read_only=True)
+        try:
+            max_row = workbook.active.max_row
+        finally:
+            workbook.close()
+        return max(0, max_row - 1) if max_row else None
+    if lower.endswith(('.csv', '.jsonl')):
+        # 按块统计换行数，速度远快于解析 CSV；字段内含换行时结果会偏大
+        lines = 0
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                lines += block.count(b'\n')
+        return max(0, lines - 1) if lower.endswith('.csv') else lines
+    return None
+
+
+def read_dataframe(source: Any, name: Optional[str] = None) -> pd.DataFrame:
+    """
+    将整个数据文件读取为 DataFrame，供需要随机访问全部数据的场景（如在线标注平台）使用。
+    :param source: 文件路径或文件对象（例如 Streamlit 上传的文件）。
+    :param name: 用于判断格式的文件名，source 为路径时可省略。
+    """
+    lower = (name or str(source)).lower()
+    if lower.endswith(PARQUET_EXTENSIONS):
+        return pd.read_parquet(source)
+    if lower.endswith(ARROW_EXTENSIONS):
+        import pyarrow as pa
+        try:
+            return pa.ipc.open_file(source).read_pandas()
+        except pa.ArrowInvalid:
+            if hasattr(source, 'seek'):
+                source.seek(0)
+            return pa.ipc.open_stream(source).read_pandas()
+    if lower.endswith('.csv'):
+        return pd.read_csv(source)
+    if lower.endswith('.jsonl'):
+        return pd.read_json(source, lines=True)
+    if lower.endswith(('.xls', '.xlsx')):
+        return pd.read_excel(source)
+    raise ValueError("不支持的数据文件格式。请使用 Parquet、Arrow、CSV、JSONL 或 Excel 文件。")
@@ -1,26 +1,101 @@
-from datasets import load_dataset
-from cfg import Config
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Optional
+
+import requests
+import urllib3
+from tqdm import tqdm
+
+from amazon_reviews import iter_products, read_categories
+from cfg import Config
+
+_local = threading.local()
+
 
+def _session(verify: bool) -> requests.Session:
+    # 每个下载线程复用自己的连接
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        session.verify = verify
+        _local.session = session
+    return session
 
-def download_images():
+
+def download_file(url: str, target_path: str, verify: bool = False, timeout: float = 30.0, max_retries: int = 3) -> bool:
+    """
+    下载单个文件。先写入 .part 临时文件，完成后再重命名，中断后重新运行不会留下不完整的图片。
+    :return: True 表示新下载，False 表示文件已存在而跳过。
+    """
+    if os.path.exists(target_path):
+        return False
+    tmp_path = f"{target_path}.part"
+    for attempt in range(max_retries + 1):
+        try:
+            with _session(verify).get(url, timeout=timeout, stream=True) as response:
+                response.raise_for_status()
+                with open(tmp_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=1 << 16):
+                        f.write(chunk)
+            os.replace(tmp_path, target_path)
+            return True
+        except requests.RequestException:
+            if attempt == max_retries:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            time.sleep(random.uniform(0, 2 ** attempt))
+
+
+def download_images(workers: Optional[int] = None, source_dir: Optional[str] = None, verify: bool = False) -> Dict[str, int]:
+    """
+    并发下载 categories.txt 中各类别前 imgs_per_category 个商品的主图。
+    按文件名去重（与旧版 wget -P 的落盘路径一致），已存在的文件直接跳过，因此可以随时中断后重新运行。
+    """
     config = Config()
-    with open("categories.txt") as fw:
-        lines = fw.readlines()
-        for line in lines:
-            l = line.strip()
-            meta_dataset = load_dataset(
-                "McAuley-Lab/Amazon-Reviews-2023", f"raw_meta_{l}", split="full"
-            )
-            for i in range(config.imgs_per_category):
-                if len(meta_dataset[i]["images"]["large"]) > 0:
-                    img_name = meta_dataset[i]["images"]["large"][0]
-                    basename = os.path.basename(img_name)
-                    if os.path.exists(f"{config.download_path}/{basename}") is False:
-                        os.system(
-                            f"wget {img_name} -P {config.download_path} --no-check-certificate"
-                        )
+    workers = workers or config.download_workers
+    source_dir = source_dir or config.source_dir
+    os.makedirs(config.download_path, exist_ok=True)
+    if not verify:
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    stats = {'downloaded': 0, 'skipped': 0, 'failed': 0}
+    seen = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor, tqdm(desc="下载图片", unit="张") as progress:
+        futures = {}
+        for product in iter_products(read_categories(), config.imgs_per_category, source_dir):
+            basename = os.path.basename(product['image_url'])
+            if basename in seen:
+                continue
+            seen.add(basename)
+            target_path = os.path.join(config.download_path, basename)
+            if os.path.exists(target_path):
+                stats['skipped'] += 1
+                progress.update(1)
+                continue
+            futures[executor.submit(download_file, product['image_url'], target_path, verify)] = product['image_url']
+
+        for future in as_completed(futures):
+            try:
+                stats['downloaded' if future.result() else 'skipped'] += 1
+            except Exception as e:
+                stats['failed'] += 1
+                print(f"下载失败: {futures[future]}，错误: {e}")
+            progress.update(1)
+            progress.set_postfix(stats)
+    print(f"✅ 下载完成: 新下载 {stats['downloaded']} 张，已存在 {stats['skipped']} 张，失败 {stats['failed']} 张。")
+    return stats
 
 
 if __name__ == "__main__":
-    download_images()
+    import argparse
+    parser = argparse.ArgumentParser(description="并发、可断点续传地下载 Amazon-Reviews-2023 商品图片")
+    parser.add_argument("--workers", type=int, default=None, help="并发下载数，默认使用 cfg.Config.download_workers")
+    parser.add_argument("--source_dir", type=str, default=None, help="本地 raw_meta_<类别>.jsonl/.parquet 所在目录，默认使用 cfg.Config.source_dir")
+    parser.add_argument("--verify_ssl", action="store_true", help="校验 HTTPS 证书（旧版脚本使用 --no-check-certificate，默认不校验）")
+    args = parser.parse_args()
+
+    download_images(workers=args.workers, source_dir=args.source_dir, verify=args.verify_ssl)
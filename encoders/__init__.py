@@ -1,5 +1,6 @@
 from .base import BaseEncoder
 from .hf_clip import HFClipEncoder
+from .hash_encoder import HashEncoder
 
 def create_encoder(config: dict) -> BaseEncoder:
     """
@@ -11,6 +12,9 @@ def create_encoder(config: dict) -> BaseEncoder:
         if not clip_config.get("model_name"):
             raise ValueError("HuggingFace Clip 'hf_clip' 配置中缺少 'model_name'。")
         return HFClipEncoder(model_name=clip_config.get("model_name"))
+    elif encoder_type == "hash":
+        # 不需要模型权重的确定性替身编码器，用于基准测试和离线环境
+        return HashEncoder(**config.get("hash", {}))
     # 在此添加对其他编码器类型的支持
     # elif encoder_type == "some_other_encoder":
     #     return SomeOtherEncoder(...)
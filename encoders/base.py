@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
 import numpy as np
-from typing import Optional
+from PIL import Image
+from typing import Any, List, Optional, Tuple, Union
 
 
 class BaseEncoder(ABC):
@@ -8,12 +9,46 @@ class BaseEncoder(ABC):
     所有编码器实现的抽象基类。
     """
     @abstractmethod
-    def encode(self, image: Optional[str] = None, text: Optional[str] = None) -> np.ndarray:
+    def encode(self, image: Optional[Union[str, Image.Image]] = None, text: Optional[str] = None) -> np.ndarray:
         """
         将图像或文本编码为向量。
-        :param image: 图像的路径或URL。
+        :param image: 图像的路径、URL 或已解码的 PIL 图像。
         :param text: 要编码的文本。
         :return: 表示图像/文本的Numpy向量。
         :raises ValueError: 如果图像和文本都未提供。
         """
-        pass 
\ No newline at end of file
+        pass
+
+    def encode_separate(
+        self,
+        image: Optional[str] = None,
+        text: Optional[str] = None
+    ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """
+        分别编码图像和文本，不做融合。未提供的部分返回 None。
+        供需要区分图像相似度与文本相似度的场景（如本地重排序）使用。
+        """
+        raise NotImplementedError(f"{type(self).__name__} 不支持分别编码图像和文本。")
+
+    def encode_texts(self, texts: List[str]) -> np.ndarray:
+        """
+        批量编码文本，返回形状为 (len(texts), dim) 的归一化矩阵。
+        默认实现逐条调用 encode，子类可覆盖以进行真正的批量推理。
+        """
+        return np.stack([self.encode(text=text) for text in texts])
+
+    def preprocess_image(self, image: Image.Image) -> Any:
+        """
+        对已解码的图像做推理前的预处理（缩放、归一化等），结果传给 encode_batch。
+        该步骤不依赖模型，可以在多个线程中并行执行。默认原样返回 PIL 图像。
+        """
+        return image
+
+    def encode_batch(self, images: List[Optional[Any]], texts: List[Optional[str]]) -> np.ndarray:
+        """
+        批量编码图文对，返回形状为 (len(images), dim) 的矩阵，融合方式与 encode 相同。
+        :param images: preprocess_image 的输出，缺失的位置为 None。
+        :param texts: 对应的文本，缺失的位置为 None 或空字符串。
+        默认实现逐条调用 encode，子类可覆盖以进行真正的批量推理。
+        """
+        return np.stack([self.encode(image=image, text=text) for image, text in zip(images, texts)])
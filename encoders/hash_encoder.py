@@ -0,0 +1,122 @@
+import hashlib
+import numpy as np
+import requests
+from io import BytesIO
+from PIL import Image
+from typing import Any, List, Optional, Tuple, Union
+import time
+from .base import BaseEncoder
+
+
+class HashEncoder(BaseEncoder):
+    """
+    不依赖模型权重的确定性替身编码器，用于基准测试和离线环境。
+    图像缩放为 image_size × image_size 的像素向量后乘以固定的随机投影矩阵，
+    文本按词做特征哈希后同样投影到 dimension 维；图文融合方式与 HFClipEncoder 相同（相加后归一化）。
+    相同的输入总是得到相同的向量，相似的图片得到相近的向量。
+    可以用 batch_latency_ms / item_latency_ms 模拟真实模型的推理耗时。
+    """
+    def __init__(
+        self,
+        dimension: int = 512,
+        image_size: int = 16,
+        text_buckets: int = 4096,
+        batch_latency_ms: float = 0.0,
+        item_latency_ms: float = 0.0,
+        seed: int = 0
+    ):
+        """
+        :param dimension: 输出向量维度，需与向量存储的 dimension 一致。
+        :param image_size: 图像缩放后的边长。
+        :param text_buckets: 文本特征哈希的桶数。
+        :param batch_latency_ms: 每次推理调用的固定耗时（毫秒）。
+        :param item_latency_ms: 每条数据额外的推理耗时（毫秒）。
+        :param seed: 投影矩阵的随机种子。
+        """
+        self.dimension = dimension
+        self.image_size = image_size
+        self.text_buckets = text_buckets
+        self.batch_latency_ms = batch_latency_ms
+        self.item_latency_ms = item_latency_ms
+        rng = np.random.default_rng(seed)
+        scale = 1.0 / np.sqrt(dimension)
+        self._image_projection = (rng.standard_normal((image_size * image_size * 3, dimension)) * scale).astype('float32')
+        self._text_projection = (rng.standard_normal((text_buckets, dimension)) * scale).astype('float32')
+
+    def _simulate_latency(self, count: int):
+        delay = self.batch_latency_ms + self.item_latency_ms * count
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+    def _load_image(self, image: Union[str, Image.Image]) -> Image.Image:
+        if isinstance(image, Image.Image):
+            return image.convert("RGB")
+        if image.startswith("http://") or image.startswith("https://"):
+            response = requests.get(image)
+            response.raise_for_status()
+            return Image.open(BytesIO(response.content)).convert("RGB")
+        return Image.open(image).convert("RGB")
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        return matrix / np.maximum(np.linalg.norm(matrix, axis=-1, keepdims=True), 1e-12)
+
+    def preprocess_image(self, image: Image.Image) -> np.ndarray:
+        pixels = np.asarray(image.convert("RGB").resize((self.image_size, self.image_size)), dtype='float32')
+        # 去掉均值，使向量反映图像内容而不是整体亮度
+        pixels = pixels.reshape(-1) / 255.0
+        return pixels - pixels.mean()
+
+    def _text_features(self, texts: List[str]) -> np.ndarray:
+        counts = np.zeros((len(texts), self.text_buckets), dtype='float32')
+        for row, text in enumerate(texts):
+            for token in text.lower().split():
+                bucket = int.from_bytes(hashlib.md5(token.encode('utf-8')).digest()[:4], 'little') % self.text_buckets
+                counts[row, bucket] += 1.0
+        return self._normalize(counts @ self._text_projection)
+
+    def _image_features(self, pixels: List[np.ndarray]) -> np.ndarray:
+        return self._normalize(np.stack(pixels) @ self._image_projection)
+
+    def encode_separate(
+        self,
+        image: Optional[Union[str, Image.Image]] = None,
+        text: Optional[str] = None
+    ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        image_features = None
+        text_features = None
+        if isinstance(image, Image.Image) or image:
+            image_features = self._image_features([self.preprocess_image(self._load_image(image))])[0]
+        if text and text.strip():
+            text_features = self._text_features([text])[0]
+        self._simulate_latency(1)
+        return image_features, text_features
+
+    def encode(self, image: Optional[Union[str, Image.Image]] = None, text: Optional[str] = None) -> np.ndarray:
+        if image is None and not (text and text.strip()):
+            raise ValueError("必须提供图片或非空的文本进行编码。")
+        image_features, text_features = self.encode_separate(image=image, text=text)
+        if image_features is not None and text_features is not None:
+            return self._normalize(image_features + text_features)
+        return image_features if image_features is not None else text_features
+
+    def encode_texts(self, texts: List[str]) -> np.ndarray:
+        self._simulate_latency(len(texts))
+        return self._text_features(texts)
+
+    def encode_batch(self, images: List[Optional[Any]], texts: List[Optional[str]]) -> np.ndarray:
+        image_positions = [i for i, image in enumerate(images) if image is not None]
+        text_positions = [i for i, text in enumerate(texts) if text and text.strip()]
+        missing = set(range(len(images))) - set(image_positions) - set(text_positions)
+        if missing:
+            raise ValueError("必须提供图片或非空的文本进行编码。")
+
+        features = np.zeros((len(images), self.dimension), dtype='float32')
+        if image_positions:
+            pixels = [images[i] if isinstance(images[i], np.ndarray) else self.preprocess_image(self._load_image(images[i])) for i in image_positions]
+            features[image_positions] = self._image_features(pixels)
+        if text_positions:
+            features[text_positions] += self._text_features([texts[i] for i in text_positions])
+        self._simulate_latency(len(images))
+        # 与 encode 相同：图文向量相加后重新归一化（只有一种模态时归一化不改变结果）
+        return self._normalize(features).astype('float32')
@@ -4,7 +4,7 @@ from PIL import Image
 import requests
 from io import BytesIO
 import numpy as np
-from typing import Optional
+from typing import Any, List, Optional, Tuple, Union
 from .base import BaseEncoder
 
 class HFClipEncoder(BaseEncoder):
@@ -13,39 +13,87 @@ class HFClipEncoder(BaseEncoder):
         self.model, self.preprocess = clip.load_from_name(model_name, device=self.device)
         self.model.eval()
 
-    def _load_image(self, image_path: str) -> Image.Image:
+    def _load_image(self, image_path: Union[str, Image.Image]) -> Image.Image:
+        if isinstance(image_path, Image.Image):
+            return image_path.convert("RGB")
         if image_path.startswith("http://") or image_path.startswith("https://"):
             response = requests.get(image_path)
             response.raise_for_status()
             return Image.open(BytesIO(response.content)).convert("RGB")
         return Image.open(image_path).convert("RGB")
 
-    def encode(self, image: Optional[str] = None, text: Optional[str] = None) -> np.ndarray:
-        if image is None and not (text and text.strip()):
-            raise ValueError("必须提供图片或非空的文本进行编码。")
-
+    def encode_separate(
+        self,
+        image: Optional[Union[str, Image.Image]] = None,
+        text: Optional[str] = None
+    ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
         image_features = None
         text_features = None
 
         with torch.no_grad():
-            if image:
+            if isinstance(image, Image.Image) or image:
                 pil_image = self._load_image(image)
                 image_features = self.model.encode_image(self.preprocess(pil_image).unsqueeze(0).to(self.device))
                 image_features /= image_features.norm(dim=-1, keepdim=True)
+                image_features = image_features.cpu().numpy().flatten()
 
             if text and text.strip():
                 tokens = clip.tokenize(text).to(self.device)
                 text_features = self.model.encode_text(tokens)
                 text_features /= text_features.norm(dim=-1, keepdim=True)
+                text_features = text_features.cpu().numpy().flatten()
 
-            if image_features is not None and text_features is not None:
-                # 通过向量加法进行特征融合, 并重新归一化
-                fused_features = image_features + text_features
-                fused_features /= fused_features.norm(dim=-1, keepdim=True)
-                return fused_features.cpu().numpy().flatten()
-            elif image_features is not None:
-                return image_features.cpu().numpy().flatten()
-            elif text_features is not None:
-                return text_features.cpu().numpy().flatten()
+        return image_features, text_features
+
+    def encode(self, image: Optional[Union[str, Image.Image]] = None, text: Optional[str] = None) -> np.ndarray:
+        if image is None and not (text and text.strip()):
+            raise ValueError("必须提供图片或非空的文本进行编码。")
+
+        image_features, text_features = self.encode_separate(image=image, text=text)
+
+        if image_features is not None and text_features is not None:
+            # 通过向量加法进行特征融合, 并重新归一化
+            fused_features = image_features + text_features
+            return fused_features / np.linalg.norm(fused_features)
+        elif image_features is not None:
+            return image_features
+        elif text_features is not None:
+            return text_features
         
-        return np.array([]) 
\ No newline at end of file
+        return np.array([])
+
+    def encode_texts(self, texts: List[str]) -> np.ndarray:
+        with torch.no_grad():
+            tokens = clip.tokenize(texts).to(self.device)
+            text_features = self.model.encode_text(tokens)
+            text_features /= text_features.norm(dim=-1, keepdim=True)
+        return text_features.cpu().numpy()
+
+    def preprocess_image(self, image: Image.Image) -> torch.Tensor:
+        return self.preprocess(image.convert("RGB"))
+
+    def encode_batch(self, images: List[Optional[Any]], texts: List[Optional[str]]) -> np.ndarray:
+        image_positions = [i for i, image in enumerate(images) if image is not None]
+        text_positions = [i for i, text in enumerate(texts) if text and text.strip()]
+        missing = set(range(len(images))) - set(image_positions) - set(text_positions)
+        if missing:
+            raise ValueError("必须提供图片或非空的文本进行编码。")
+
+        with torch.no_grad():
+            features = None
+            if image_positions:
+                pixels = torch.stack([images[i] for i in image_positions]).to(self.device)
+                image_features = self.model.encode_image(pixels)
+                image_features /= image_features.norm(dim=-1, keepdim=True)
+                features = torch.zeros((len(images), image_features.shape[1]), dtype=image_features.dtype, device=self.device)
+                features[image_positions] = image_features
+            if text_positions:
+                tokens = clip.tokenize([texts[i] for i in text_positions]).to(self.device)
+                text_features = self.model.encode_text(tokens)
+                text_features /= text_features.norm(dim=-1, keepdim=True)
+                if features is None:
+                    features = torch.zeros((len(images), text_features.shape[1]), dtype=text_features.dtype, device=self.device)
+                features[text_positions] += text_features
+            # 与 encode 相同：图文向量相加后重新归一化（只有一种模态时归一化不改变结果）
+            features /= features.norm(dim=-1, keepdim=True)
+        return features.cpu().numpy().astype('float32')
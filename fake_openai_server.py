@@ -0,0 +1,218 @@
+"""
+本地的 OpenAI 兼容假服务，用于在离线环境下测试和压测 LLM 相关链路（容错层、流式输出、批量并发等）。
+
+只实现 /v1/chat/completions（含 stream=True 的 SSE 输出）和 /v1/models，
+响应内容根据提示中的任务类型（重排序 / 回答 / 合并模式 / 流式回答）构造成合法的格式。
+延迟、长尾延迟和错误率均可配置。
+
+使用示例:
+    python fake_openai_server.py --port 8001 --latency-ms 300 --tail-prob 0.05 --tail-latency-ms 3000
+然后在 config.yaml 中将 llm.type 设为 custom，base_url 指向 http://127.0.0.1:8001/v1，api_key 任意。
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+
+from prompts import RECOMMENDED_INDEX_MARKER
+from token_utils import count_tokens
+
+
+class FakeLLMBehavior:
+    """假服务的延迟与故障模型。"""
+    def __init__(
+        self,
+        latency_ms: float = 200.0,
+        jitter_ms: float = 50.0,
+        tail_prob: float = 0.0,
+        tail_latency_ms: float = 2000.0,
+        error_rate: float = 0.0,
+        token_delay_ms: float = 10.0,
+        seed: Optional[int] = None
+    ):
+        """
+        :param latency_ms: 基础响应延迟（毫秒）。
+        :param jitter_ms: 在基础延迟上叠加的均匀随机抖动上限（毫秒）。
+        :param tail_prob: 出现长尾延迟的概率。
+        :param tail_latency_ms: 长尾请求额外增加的延迟（毫秒）。
+        :param error_rate: 返回 500 错误的概率。
+        :param token_delay_ms: 流式输出时相邻片段之间的间隔（毫秒）。
+        :param seed: 随机种子，便于复现。
+        """
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tail_prob = tail_prob
+        self.tail_latency_ms = tail_latency_ms
+        self.error_rate = error_rate
+        self.token_delay_ms = token_delay_ms
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.request_count = 0
+
+    def sample(self) -> Tuple[float, bool]:
+        """返回本次请求的 (延迟秒数, 是否失败)。"""
+        with self._lock:
+            self.request_count += 1
+            latency = self.latency_ms + self._random.uniform(0, self.jitter_ms)
+            if self._random.random() < self.tail_prob:
+                latency += self.tail_latency_ms
+            failed = self._random.random() < self.error_rate
+        return latency / 1000.0, failed
+
+
+def _fake_content(prompt: str, json_mode: bool) -> str:
+    """根据提示的任务类型构造一个格式合法的回答。"""
+    candidate_count = len(re.findall(r'^(?:Product|Candidate) \d+:', prompt, re.MULTILINE))
+    indices = list(range(candidate_count))
+    recommended = 0 if candidate_count else None
+    if json_mode:
+        if "reranked_indices" in prompt and "answer_text" in prompt:
+            return json.dumps({"reranked_indices": indices, "recommended_index": recommended,
+                               "answer_text": "（测试回答）第一个商品最符合您的需求。"}, ensure_ascii=False)
+        if "reranked_indices" in prompt:
+            return json.dumps({"reranked_indices": indices})
+        if "answer_text" in prompt:
+            return json.dumps({"recommended_index": recommended,
+                               "answer_text": "（测试回答）第一个商品最符合您的需求。"}, ensure_ascii=False)
+        if "`desc`" in prompt:
+            category = re.search(r'^Suggested Category: (.*)$', prompt, re.MULTILINE)
+            return json.dumps({"category": category.group(1) if category else None,
+                               "desc": "（测试描述）与相似样本属于同一类内容。"}, ensure_ascii=False)
+        return json.dumps({"text": "（测试回答）"}, ensure_ascii=False)
+    text = "（测试回答）根据检索到的商品信息，第一个商品最符合您的需求。"
+    if RECOMMENDED_INDEX_MARKER in prompt:
+        text += f"\n{RECOMMENDED_INDEX_MARKER} {recommended if recommended is not None else 'null'}"
+    return text
+
+
+def make_handler(behavior: FakeLLMBehavior):
+    class FakeOpenAIHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            # 压测时请求量很大，关闭默认的访问日志
+            pass
+
+        def _send_json(self, status: int, payload: Dict[str, Any]):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self._send_json(200, {"object": "list", "data": [{"id": "fake-model", "object": "model"}]})
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            prompt = "\n".join(str(m.get("content", "")) for m in request.get("messages", []))
+            json_mode = (request.get("response_format") or {}).get("type") == "json_object"
+            model = request.get("model", "fake-model")
+
+            latency, failed = behavior.sample()
+            time.sleep(latency)
+            if failed:
+                self._send_json(500, {"error": {"message": "injected failure", "type": "server_error"}})
+                return
+
+            content = _fake_content(prompt, json_mode)
+            completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+            usage = {"prompt_tokens": count_tokens(prompt), "completion_tokens": count_tokens(content)}
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+            if request.get("stream"):
+                self._stream(completion_id, model, content)
+                return
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": usage,
+            })
+
+        def _stream(self, completion_id: str, model: str, content: str):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            pieces = [content[i:i + 4] for i in range(0, len(content), 4)]
+            for i, piece in enumerate(pieces):
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": piece},
+                                 "finish_reason": "stop" if i == len(pieces) - 1 else None}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                time.sleep(behavior.token_delay_ms / 1000.0)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+    return FakeOpenAIHandler
+
+
+def start_fake_openai_server(host: str = "127.0.0.1", port: int = 0, **behavior_options) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    在后台线程中启动假服务。
+    :param port: 监听端口，为 0 时自动选择空闲端口。
+    :param behavior_options: 传给 FakeLLMBehavior 的延迟与故障参数。
+    :return: (server, base_url)，使用完毕后调用 server.shutdown()。
+    """
+    behavior = FakeLLMBehavior(**behavior_options)
+    server = ThreadingHTTPServer((host, port), make_handler(behavior))
+    server.daemon_threads = True
+    server.behavior = behavior
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容假服务")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=8001, help="监听端口")
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="基础响应延迟（毫秒）")
+    parser.add_argument("--jitter-ms", type=float, default=50.0, help="随机抖动上限（毫秒）")
+    parser.add_argument("--tail-prob", type=float, default=0.0, help="长尾延迟出现的概率")
+    parser.add_argument("--tail-latency-ms", type=float, default=2000.0, help="长尾请求额外延迟（毫秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 错误的概率")
+    parser.add_argument("--token-delay-ms", type=float, default=10.0, help="流式片段间隔（毫秒）")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子")
+    args = parser.parse_args()
+
+    behavior = FakeLLMBehavior(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        tail_prob=args.tail_prob,
+        tail_latency_ms=args.tail_latency_ms,
+        error_rate=args.error_rate,
+        token_delay_ms=args.token_delay_ms,
+        seed=args.seed
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(behavior))
+    print(f"假 OpenAI 服务已启动: http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
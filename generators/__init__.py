@@ -1,5 +1,7 @@
-from .base import BaseGenerator
-from .openai_generator import OpenAIGenerator
+from .base import BaseGenerator, AsyncBaseGenerator
+from .openai_generator import OpenAIGenerator, LLM_ERROR_PREFIX
+from .async_openai_generator import AsyncOpenAIGenerator
+from .resilient_generator import ResilientGenerator, CircuitBreaker, CircuitOpenError
 from typing import Dict, Any
 
 def create_generator(config: Dict[str, Any]) -> BaseGenerator:
@@ -17,6 +19,13 @@ def create_generator(config: Dict[str, Any]) -> BaseGenerator:
         # 确保 'model' 存在
         if 'model' not in llm_config:
              raise ValueError(f"LLM 配置 '{gen_type}' 中缺少 'model'。")
+
+        # 启用容错层时，由 ResilientGenerator 负责超时、重试与对冲，关闭 SDK 自带的重试
+        resilience_config = config.get("resilience", {})
+        if resilience_config.get("enabled", False):
+            resilience_options = {k: v for k, v in resilience_config.items() if k != "enabled"}
+            inner = OpenAIGenerator(**llm_config, max_retries=0, raise_errors=True)
+            return ResilientGenerator(inner, **resilience_options)
              
         return OpenAIGenerator(**llm_config)
         
@@ -25,4 +34,22 @@ def create_generator(config: Dict[str, Any]) -> BaseGenerator:
     #     return SomeOtherLLMGenerator(...)
         
     else:
-        raise ValueError(f"不支持的生成器类型: '{gen_type}'") 
\ No newline at end of file
+        raise ValueError(f"不支持的生成器类型: '{gen_type}'")
+
+def create_async_generator(config: Dict[str, Any]) -> AsyncBaseGenerator:
+    """
+    根据配置创建异步生成器实例的工厂函数，配置格式与 create_generator 相同。
+    """
+    gen_type = config.get("type")
+
+    if gen_type == "openai" or gen_type == "azure" or gen_type == "custom":
+        llm_config = dict(config.get(gen_type, {}))
+        llm_config['api_type'] = gen_type
+
+        if 'model' not in llm_config:
+             raise ValueError(f"LLM 配置 '{gen_type}' 中缺少 'model'。")
+
+        return AsyncOpenAIGenerator(**llm_config)
+
+    else:
+        raise ValueError(f"不支持的异步生成器类型: '{gen_type}'")
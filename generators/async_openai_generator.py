@@ -0,0 +1,43 @@
+from .base import AsyncBaseGenerator
+from .openai_generator import create_openai_client, build_messages, LLM_ERROR_PREFIX
+from token_utils import count_tokens
+import telemetry
+
+
+class AsyncOpenAIGenerator(AsyncBaseGenerator):
+    """
+    基于 AsyncOpenAI / AsyncAzureOpenAI 的异步生成器实现。
+    多个请求的 LLM 调用可以在同一个事件循环中并发等待。
+    """
+    def __init__(self, model: str, api_type: str = 'openai', api_key: str = None, base_url: str = None, endpoint: str = None, api_version: str = None):
+        self.client = create_openai_client(api_type, api_key, base_url, endpoint, api_version, use_async=True)
+        self.model = model
+
+    async def agenerate(self, prompt: str, **kwargs) -> str:
+        """
+        异步调用 Chat Completions API 生成文本。
+        设置了 rate_limiter 时，会先按预估的 token 数等待配额。
+        """
+        kwargs.pop('api_type', None)
+
+        estimated_tokens = count_tokens(prompt, self.model) + kwargs.get('max_tokens', 0)
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire(estimated_tokens)
+
+        try:
+            response = await self.client.chat.completions.create(
+                model=self.model,
+                messages=build_messages(prompt),
+                **kwargs
+            )
+            telemetry.record_llm_usage(response.usage, self.model)
+            if self.rate_limiter is not None and response.usage is not None:
+                self.rate_limiter.reconcile(estimated_tokens, response.usage.total_tokens)
+            return response.choices[0].message.content.strip()
+        except Exception as e:
+            error_message = f"{LLM_ERROR_PREFIX}: {e}"
+            print(error_message)
+            return error_message
+
+    async def aclose(self):
+        await self.client.close()
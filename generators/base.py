@@ -1,4 +1,8 @@
 from abc import ABC, abstractmethod
+from typing import Iterator, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .rate_limit import AsyncRateLimiter
 
 class BaseGenerator(ABC):
     """
@@ -12,4 +16,36 @@ class BaseGenerator(ABC):
         :param kwargs: 其他特定于模型的参数，如 temperature, max_tokens 等。
         :return: LLM 生成的文本字符串。
         """
-        pass 
\ No newline at end of file
+        pass
+
+    def generate_stream(self, prompt: str, **kwargs) -> Iterator[str]:
+        """
+        以流式方式生成文本，逐段产出 token。
+        默认实现退化为一次性调用 generate，子类可覆盖以获得真正的流式输出。
+        :param prompt: 输入给模型的完整提示。
+        :param kwargs: 其他特定于模型的参数。
+        :return: 逐段产出文本片段的迭代器。
+        """
+        yield self.generate(prompt, **kwargs)
+
+
+class AsyncBaseGenerator(ABC):
+    """
+    异步生成器模型（LLM）的抽象基类，用于在多个请求之间并发地等待 LLM 响应。
+    """
+    # 可选的限流器（见 generators.rate_limit.AsyncRateLimiter），由批处理调用方设置
+    rate_limiter: Optional["AsyncRateLimiter"] = None
+
+    @abstractmethod
+    async def agenerate(self, prompt: str, **kwargs) -> str:
+        """
+        根据给定的提示异步生成文本。
+        :param prompt: 输入给模型的完整提示。
+        :param kwargs: 其他特定于模型的参数，如 temperature, max_tokens 等。
+        :return: LLM 生成的文本字符串。
+        """
+        pass
+
+    async def aclose(self):
+        """释放底层的异步客户端资源。对于某些实现可能是空操作。"""
+        pass
@@ -1,33 +1,87 @@
 import os
-from openai import OpenAI, AzureOpenAI
+from typing import Iterator
+from openai import OpenAI, AzureOpenAI, AsyncOpenAI, AsyncAzureOpenAI
 from .base import BaseGenerator
+import telemetry
+
+def create_openai_client(
+    api_type: str = 'openai',
+    api_key: str = None,
+    base_url: str = None,
+    endpoint: str = None,
+    api_version: str = None,
+    use_async: bool = False,
+    max_retries: int = None
+):
+    """
+    根据 api_type 创建 OpenAI / Azure OpenAI / 自定义兼容接口的客户端。
+    :param use_async: 为 True 时创建 AsyncOpenAI / AsyncAzureOpenAI 客户端。
+    :param max_retries: SDK 内置的重试次数，为 None 时使用 SDK 默认值。
+    """
+    # 仅在显式指定时覆盖 SDK 的默认重试次数
+    extra_options = {} if max_retries is None else {"max_retries": max_retries}
+    if api_type == 'azure':
+        if not all([endpoint, api_version]):
+            raise ValueError("对于 Azure OpenAI，必须提供 endpoint 和 api_version。")
+        client_cls = AsyncAzureOpenAI if use_async else AzureOpenAI
+        return client_cls(
+            api_key=api_key or os.environ.get("AZURE_OPENAI_KEY"),
+            azure_endpoint=endpoint or os.environ.get("AZURE_OPENAI_ENDPOINT"),
+            api_version=api_version,
+            **extra_options
+        )
+    client_cls = AsyncOpenAI if use_async else OpenAI
+    if api_type == 'custom':
+        if not base_url or not api_key:
+            raise ValueError("必须为自定义API类型提供 Base URL 和 API Key。")
+        return client_cls(
+            api_key=api_key,
+            base_url=base_url,
+            **extra_options
+        )
+    # 默认为 'openai'
+    return client_cls(
+        api_key=api_key or os.environ.get("OPENAI_API_KEY"),
+        base_url=base_url or os.environ.get("OPENAI_BASE_URL"),
+        **extra_options
+    )
+
+
+# generate 在调用失败时返回以此开头的错误信息，调用方可据此避免缓存错误结果
+LLM_ERROR_PREFIX = "调用大模型 API 时出错"
+
+SYSTEM_PROMPT = "你是一个智能的多模态助手。请根据用户提供的上下文信息来回答问题。"
+
+
+def build_messages(prompt: str):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
 
 class OpenAIGenerator(BaseGenerator):
     """
     使用 OpenAI 或 Azure OpenAI API 的生成器实现。
     """
-    def __init__(self, model: str, api_type: str = 'openai', api_key: str = None, base_url: str = None, endpoint: str = None, api_version: str = None):
-        if api_type == 'azure':
-            if not all([endpoint, api_version]):
-                raise ValueError("对于 Azure OpenAI，必须提供 endpoint 和 api_version。")
-            self.client = AzureOpenAI(
-                api_key=api_key or os.environ.get("AZURE_OPENAI_KEY"),
-                azure_endpoint=endpoint or os.environ.get("AZURE_OPENAI_ENDPOINT"),
-                api_version=api_version
-            )
-        elif api_type == 'custom':
-            if not base_url or not api_key:
-                raise ValueError("必须为自定义API类型提供 Base URL 和 API Key。")
-            self.client = OpenAI(
-                api_key=api_key,
-                base_url=base_url,
-            )
-        else: # 默认为 'openai'
-            self.client = OpenAI(
-                api_key=api_key or os.environ.get("OPENAI_API_KEY"),
-                base_url=base_url or os.environ.get("OPENAI_BASE_URL"),
-            )
+    def __init__(
+        self,
+        model: str,
+        api_type: str = 'openai',
+        api_key: str = None,
+        base_url: str = None,
+        endpoint: str = None,
+        api_version: str = None,
+        max_retries: int = None,
+        raise_errors: bool = False
+    ):
+        """
+        :param max_retries: SDK 内置的重试次数，由外层 ResilientGenerator 负责重试时应设为 0。
+        :param raise_errors: 为 True 时调用失败直接抛出异常，而不是返回错误信息字符串。
+        """
+        self.client = create_openai_client(api_type, api_key, base_url, endpoint, api_version, max_retries=max_retries)
         self.model = model
+        self.raise_errors = raise_errors
 
     def generate(self, prompt: str, **kwargs) -> str:
         """
@@ -39,14 +93,42 @@ class OpenAIGenerator(BaseGenerator):
         try:
             response = self.client.chat.completions.create(
                 model=self.model,
-                messages=[
-                    {"role": "system", "content": "你是一个智能的多模态助手。请根据用户提供的上下文信息来回答问题。"},
-                    {"role": "user", "content": prompt}
-                ],
+                messages=build_messages(prompt),
                 **kwargs
             )
+            telemetry.record_llm_usage(response.usage, self.model)
             return response.choices[0].message.content.strip()
         except Exception as e:
-            error_message = f"调用大模型 API 时出错: {e}"
+            if self.raise_errors:
+                raise
+            error_message = f"{LLM_ERROR_PREFIX}: {e}"
+            print(error_message)
+            return error_message
+
+    def generate_stream(self, prompt: str, **kwargs) -> Iterator[str]:
+        """
+        以 stream=True 调用 Chat Completions API，逐段产出生成的文本。
+        """
+        kwargs.pop('api_type', None)
+        kwargs.pop('stream', None)
+
+        try:
+            stream = self.client.chat.completions.create(
+                model=self.model,
+                messages=build_messages(prompt),
+                stream=True,
+                **kwargs
+            )
+            for chunk in stream:
+                # Azure 在流的开头可能返回不含 choices 的内容过滤结果
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        except Exception as e:
+            if self.raise_errors:
+                raise
+            error_message = f"{LLM_ERROR_PREFIX}: {e}"
             print(error_message)
-            return error_message 
\ No newline at end of file
+            yield error_message
@@ -0,0 +1,67 @@
+import asyncio
+import time
+from typing import Optional
+
+
+class AsyncRateLimiter:
+    """
+    基于令牌桶的异步限流器，同时限制每分钟请求数（RPM）和每分钟 token 数（TPM）。
+    两个桶都按时间线性回填，容量为各自的每分钟配额。
+    """
+    def __init__(self, requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None):
+        """
+        :param requests_per_minute: 每分钟允许的最大请求数，为 None 时不限制。
+        :param tokens_per_minute: 每分钟允许的最大 token 数，为 None 时不限制。
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_allowance = float(requests_per_minute or 0)
+        self._token_allowance = float(tokens_per_minute or 0)
+        self._last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute:
+            self._request_allowance = min(
+                float(self.requests_per_minute),
+                self._request_allowance + elapsed * self.requests_per_minute / 60.0
+            )
+        if self.tokens_per_minute:
+            self._token_allowance = min(
+                float(self.tokens_per_minute),
+                self._token_allowance + elapsed * self.tokens_per_minute / 60.0
+            )
+
+    def _wait_time(self, tokens: int) -> float:
+        """返回满足本次请求还需等待的秒数。"""
+        wait = 0.0
+        if self.requests_per_minute and self._request_allowance < 1:
+            wait = max(wait, (1 - self._request_allowance) * 60.0 / self.requests_per_minute)
+        if self.tokens_per_minute:
+            # 单次请求超过整桶容量时，按整桶计算，避免永远等待
+            needed = min(tokens, self.tokens_per_minute)
+            if self._token_allowance < needed:
+                wait = max(wait, (needed - self._token_allowance) * 60.0 / self.tokens_per_minute)
+        return wait
+
+    async def acquire(self, tokens: int = 0):
+        """等待直到可以发出一个预计消耗 tokens 个 token 的请求。"""
+        async with self._lock:
+            while True:
+                self._refill()
+                wait = self._wait_time(tokens)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            if self.requests_per_minute:
+                self._request_allowance -= 1
+            if self.tokens_per_minute:
+                self._token_allowance -= min(tokens, self.tokens_per_minute)
+
+    def reconcile(self, estimated_tokens: int, actual_tokens: int):
+        """请求完成后，用实际消耗的 token 数修正预估值。"""
+        if self.tokens_per_minute:
+            self._token_allowance -= actual_tokens - estimated_tokens
@@ -0,0 +1,293 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Iterator, List, Optional, Tuple, Type
+
+import telemetry
+from .base import BaseGenerator
+from .openai_generator import LLM_ERROR_PREFIX
+
+
+def _default_retryable_errors() -> Tuple[Type[BaseException], ...]:
+    """默认可重试的异常：超时、连接错误、限流和服务端 5xx 错误。"""
+    errors: List[Type[BaseException]] = [TimeoutError, ConnectionError]
+    try:
+        import openai
+        errors += [openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError]
+    except (ImportError, AttributeError):
+        pass
+    return tuple(errors)
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断器处于打开状态时拒绝请求。"""
+    pass
+
+
+class CircuitBreaker:
+    """
+    简单的熔断器：连续失败达到阈值后打开，在 reset_timeout 秒内直接拒绝请求；
+    之后进入半开状态放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def acquire(self) -> Tuple[bool, bool]:
+        """
+        :return: (是否放行, 是否为半开状态下的探测请求)。探测请求结束时必须调用 record_success、
+            record_failure 或 release_probe 之一，否则熔断器会一直拒绝后续请求。
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True, False
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._probe_in_flight:
+                return False, False
+            # 半开状态：只放行一个探测请求
+            self._probe_in_flight = True
+            return True, True
+
+    def allow_request(self) -> bool:
+        return self.acquire()[0]
+
+    def release_probe(self):
+        """探测请求没有得到可判断的结果（例如不可重试的错误、调用方放弃了流式输出）时，
+        保持半开状态并允许下一个请求继续探测。"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive_failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._probe_in_flight or self._consecutive_failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+
+class ResilientGenerator(BaseGenerator):
+    """
+    位于 BaseGenerator 之前的容错层，提供：
+    - 单次调用的总截止时间（deadline）；
+    - 对可重试错误的带抖动指数退避重试；
+    - 熔断器，在上游持续故障时快速失败（一次调用的全部重试只计一次失败）；
+    - 对冲请求：首个请求在历史 p95 延迟内未返回时，再发出一个相同请求，取先返回者。
+
+    被包装的生成器需要在失败时抛出异常（例如 OpenAIGenerator(raise_errors=True)）。
+    """
+    def __init__(
+        self,
+        inner: BaseGenerator,
+        timeout: float = 30.0,
+        max_retries: int = 2,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        hedge: bool = True,
+        hedge_quantile: float = 0.95,
+        hedge_min_samples: int = 20,
+        hedge_min_delay: float = 0.2,
+        breaker_failure_threshold: int = 5,
+        breaker_reset_timeout: float = 30.0,
+        max_workers: int = 16,
+        raise_errors: bool = False,
+        retryable_errors: Optional[Tuple[Type[BaseException], ...]] = None
+    ):
+        """
+        :param inner: 被包装的生成器，失败时应抛出异常。
+        :param timeout: 单次 generate 调用（包括所有重试与对冲）的总截止时间（秒）。
+        :param max_retries: 可重试错误的最大重试次数。
+        :param backoff_base: 指数退避的基础等待时间（秒）。
+        :param backoff_max: 单次退避的最大等待时间（秒）。
+        :param hedge: 是否启用对冲请求。
+        :param hedge_quantile: 触发对冲请求的历史延迟分位数。
+        :param hedge_min_samples: 积累到多少个延迟样本后才启用对冲。
+        :param hedge_min_delay: 对冲等待时间的下限（秒）。
+        :param breaker_failure_threshold: 熔断器打开所需的连续失败次数。
+        :param breaker_reset_timeout: 熔断器打开后进入半开状态前的等待时间（秒）。
+        :param max_workers: 执行上游请求的线程数。
+        :param raise_errors: 为 True 时最终失败抛出异常，否则与 OpenAIGenerator 一样返回错误信息字符串。
+        :param retryable_errors: 视为可重试的异常类型，默认见 _default_retryable_errors。
+        """
+        self.inner = inner
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        self.raise_errors = raise_errors
+        self.retryable_errors = retryable_errors or _default_retryable_errors()
+        self.breaker = CircuitBreaker(breaker_failure_threshold, breaker_reset_timeout)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        self._latencies: deque = deque(maxlen=500)
+        self._latency_lock = threading.Lock()
+        self.hedged_requests = 0
+
+    def _record_latency(self, latency: float):
+        with self._latency_lock:
+            self._latencies.append(latency)
+
+    def hedge_delay(self) -> Optional[float]:
+        """根据历史延迟的分位数计算对冲等待时间，样本不足时返回 None。"""
+        with self._latency_lock:
+            if not self.hedge or len(self._latencies) < self.hedge_min_samples:
+                return None
+            samples = sorted(self._latencies)
+        position = min(len(samples) - 1, int(self.hedge_quantile * len(samples)))
+        return max(self.hedge_min_delay, samples[position])
+
+    def _timed_call(self, prompt: str, kwargs: dict) -> str:
+        start = time.monotonic()
+        result = self.inner.generate(prompt, **kwargs)
+        self._record_latency(time.monotonic() - start)
+        return result
+
+    def _attempt(self, prompt: str, kwargs: dict, deadline: float) -> str:
+        """执行一次（可能带对冲的）调用，在截止时间前返回第一个成功结果。"""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("LLM 调用超过截止时间。")
+        # 让上游请求自身也遵守剩余时间，避免被放弃的请求长时间占用线程
+        call_kwargs = dict(kwargs, timeout=remaining)
+        futures: List[Future] = [self._executor.submit(self._timed_call, prompt, call_kwargs)]
+
+        hedge_delay = self.hedge_delay()
+        if hedge_delay is not None and hedge_delay < remaining:
+            done, _ = wait(futures, timeout=hedge_delay, return_when=FIRST_COMPLETED)
+            if not done:
+                with self._latency_lock:
+                    self.hedged_requests += 1
+                call_kwargs = dict(kwargs, timeout=max(0.001, deadline - time.monotonic()))
+                futures.append(self._executor.submit(self._timed_call, prompt, call_kwargs))
+
+        last_error: Optional[BaseException] = None
+        pending = set(futures)
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                error = future.exception()
+                if error is None:
+                    return future.result()
+                last_error = error
+        if last_error is not None and not pending:
+            raise last_error
+        raise TimeoutError("LLM 调用超过截止时间。")
+
+    def _backoff(self, attempt: int) -> float:
+        """带完全抖动的指数退避时间。"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def generate(self, prompt: str, **kwargs) -> str:
+        deadline = time.monotonic() + self.timeout
+        last_error: Optional[BaseException] = None
+        # 最后一次失败是否为可重试错误；一次调用（含全部重试）只计一次熔断失败
+        failed = False
+        for attempt in range(self.max_retries + 1):
+            allowed, probe = self.breaker.acquire()
+            if not allowed:
+                last_error = CircuitOpenError("LLM 服务熔断中，暂时拒绝请求。")
+                break
+            settled = False
+            try:
+                result = self._attempt(prompt, kwargs, deadline)
+                self.breaker.record_success()
+                settled = True
+                return result
+            except self.retryable_errors as e:
+                # 探测请求的失败留给循环结束后的 record_failure 处理，熔断器随即重新打开
+                settled = True
+                last_error, failed = e, True
+                wait_time = self._backoff(attempt)
+                if probe or attempt == self.max_retries or time.monotonic() + wait_time >= deadline:
+                    break
+                print(f"LLM 调用失败（第 {attempt + 1} 次）: {e}，{wait_time:.2f} 秒后重试。")
+                time.sleep(wait_time)
+            except Exception as e:
+                # 不可重试的错误（如参数错误、鉴权失败）不计入熔断
+                last_error, failed = e, False
+                break
+            finally:
+                if probe and not settled:
+                    self.breaker.release_probe()
+
+        if failed:
+            self.breaker.record_failure()
+        if self.raise_errors:
+            raise last_error
+        error_message = f"{LLM_ERROR_PREFIX}: {last_error}"
+        print(error_message)
+        return error_message
+
+    def generate_stream(self, prompt: str, **kwargs) -> Iterator[str]:
+        """
+        流式调用只在产出第一个片段之前重试；一旦开始输出，后续错误不再重试。
+        """
+        deadline = time.monotonic() + self.timeout
+        last_error: Optional[BaseException] = None
+        failed = False
+        for attempt in range(self.max_retries + 1):
+            allowed, probe = self.breaker.acquire()
+            if not allowed:
+                last_error = CircuitOpenError("LLM 服务熔断中，暂时拒绝请求。")
+                break
+            started = False
+            settled = False
+            try:
+                start = time.monotonic()
+                call_kwargs = dict(kwargs, timeout=max(0.001, deadline - start))
+                for token in self.inner.generate_stream(prompt, **call_kwargs):
+                    if not started:
+                        started = True
+                        # 首 token 延迟只作为指标，不参与非流式请求的对冲等待时间
+                        telemetry.observe("stage_seconds", time.monotonic() - start, stage="llm_first_token")
+                    yield token
+                self.breaker.record_success()
+                settled = True
+                return
+            except self.retryable_errors as e:
+                settled = True
+                last_error, failed = e, True
+                wait_time = self._backoff(attempt)
+                if probe or started or attempt == self.max_retries or time.monotonic() + wait_time >= deadline:
+                    break
+                time.sleep(wait_time)
+            except Exception as e:
+                last_error, failed = e, False
+                break
+            finally:
+                # 包括调用方中途放弃迭代（GeneratorExit）的情况
+                if probe and not settled:
+                    self.breaker.release_probe()
+
+        if failed:
+            self.breaker.record_failure()
+        if self.raise_errors:
+            raise last_error
+        error_message = f"{LLM_ERROR_PREFIX}: {last_error}"
+        print(error_message)
+        yield error_message
@@ -1,59 +1,69 @@
-from datasets import load_dataset
-from pymilvus import MilvusClient
-import numpy as np
-import os
-from PIL import Image
 import json
-from magiclens.magiclens import MagicLensEmbeddding
-from cfg import Config
-from milvus import default_server
-from pymilvus import utility, connections, Collection, FieldSchema, CollectionSchema, DataType
+import os
+from typing import Optional
 
-from retrieve import Retriever
+import yaml
+from tqdm import tqdm
 
-encoder = Retriever()
+from amazon_reviews import iter_products, read_categories
+from cfg import Config
+from encoders import create_encoder
+from ingest_pipeline import IngestPipeline
+from stores import create_vector_store
 
 
-def insert_data():
+def insert_data(config_path: Optional[str] = None, source_dir: Optional[str] = None):
+    """
+    将已下载的 Amazon-Reviews-2023 商品图片编码后写入向量存储。
+    编码器与向量存储由配置文件决定（与 index_data.py 相同），图片从本地 download_path 读取，
+    解码、批量编码与批量写入由摄取流水线并行完成。
+    """
     config = Config()
-    image_folder = f"{config.download_path}" + "/{}"
-    client = MilvusClient(uri=config.milvus_uri)
-    client.create_collection(
-        collection_name=config.collection_name,
-        overwrite=True,
-        auto_id=True,
-        dimension=768,
-        enable_dynamic_field=True,
+    config_path = config_path or config.config_path
+    source_dir = source_dir or config.source_dir
+    with open(config_path, 'r', encoding='utf-8') as f:
+        app_config = yaml.safe_load(f)
+
+    encoder = create_encoder(app_config['encoder'])
+    vector_store = create_vector_store(app_config['vector_store'])
+    vector_store.delete_collection()
+
+    def records():
+        for product in iter_products(read_categories(), config.imgs_per_category, source_dir):
+            image_path = os.path.join(config.download_path, os.path.basename(product['image_url']))
+            # 未下载成功的图片直接跳过，与旧版脚本一致
+            if os.path.exists(image_path):
+                yield {
+                    'url': image_path,
+                    'category': product['category'],
+                    'description': product['meta'].get('title') or '',
+                    'name': product['name'],
+                    'spec': json.dumps(product['meta'], ensure_ascii=False, default=str),
+                }
+
+    # 与旧版一致，只用图片编码（不融合文本）
+    pipeline = IngestPipeline.from_config(
+        encoder,
+        vector_store,
+        app_config.get('indexing', {}).get('pipeline', {}),
+        text_field=None
     )
-    count = 0
-    with open("categories.txt") as fw:
-        lines = fw.readlines()
-        for line in lines:
-            l = line.strip()
-            meta_dataset = load_dataset(
-                "McAuley-Lab/Amazon-Reviews-2023", f"raw_meta_{l}", split="full"
-            )
-            for i in range(config.imgs_per_category):
-                if len(meta_dataset[i]["images"]["large"]) > 0:
-                    print(count)
-                    count = count + 1
-                    img_name = meta_dataset[i]["images"]["large"][0]
-                    name = os.path.basename(img_name)
-                    if os.path.exists(image_folder.format(name)) is True:
-                        feat = encoder.encode_query(image_folder.format(name), "")
-                        spec = json.dumps(meta_dataset[i])
-                        res = client.insert(
-                            collection_name=config.collection_name,
-                            data={
-                                "vector": np.array(feat.flatten()),
-                                "spec": spec,
-                                "name": f"{l}_{i}",
-                            },
-                        )
-
-
-insert_data()
-
-class Milvus:
-    def __init__(self, host='127.0.0.1', port='19530', collection_name='images'):
-        # ... existing code ...
+    with tqdm(desc="索引商品图片", unit="张") as progress:
+        stats = pipeline.run(
+            records(),
+            on_error=lambda seq, record, error: print(f"编码失败: {record['url']}，错误: {error}"),
+            progress_callback=lambda s: progress.update(s.completed - progress.n)
+        )
+    vector_store.build_index()
+    print(f"✅ 索引完成！共写入 {stats.written} 个商品，失败 {stats.failed} 个。")
+    print(f"各阶段吞吐量: {stats.format()}")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="将已下载的 Amazon-Reviews-2023 商品图片写入向量存储")
+    parser.add_argument("--config_path", type=str, default=None, help="配置文件的路径，默认使用 cfg.Config.config_path")
+    parser.add_argument("--source_dir", type=str, default=None, help="本地 raw_meta_<类别>.jsonl/.parquet 所在目录，默认使用 cfg.Config.source_dir")
+    args = parser.parse_args()
+
+    insert_data(config_path=args.config_path, source_dir=args.source_dir)
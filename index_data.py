@@ -1,54 +1,173 @@
 import yaml
-import pandas as pd
 import os
-import sys
+import re
 from tqdm import tqdm
 
 from encoders import create_encoder
 from stores import create_vector_store
-from utils import get_config, get_image_from_url_or_path
+from data_sources import iter_record_batches, estimate_row_count, DEFAULT_CHUNK_SIZE, INDEX_COLUMNS
+from checkpoint import IndexingCheckpoint, FailedRowLog
+from ingest_pipeline import IngestPipeline
+from thumbnails import ThumbnailCache
+from shards import parse_partition, shard_paths, write_shard_done, clear_shard_done
+from category_classifier import build_and_save_centroids
+import telemetry
 
-def main(config_path="configs/config.yaml", data_path="dataset/your_data.xlsx"):
+def main(config_path="configs/config.yaml", data_path="dataset/your_data.xlsx", batch_size=None, chunk_size=DEFAULT_CHUNK_SIZE, resume=False,
+         partition=None, shard_dir=None, rebuild_category=None):
     print("1. 加载配置...")
     with open(config_path, 'r', encoding='utf-8') as f:
         config = yaml.safe_load(f)
+    indexing_config = dict(config.get('indexing', {}))
+    checkpoint_every = indexing_config.get('checkpoint_every', 5000)
+
+    shard = None
+    if partition is not None:
+        # 分区构建：只编码行号对 N 取模等于 i 的数据，写入共享目录中自包含的 Faiss 分片
+        shard = parse_partition(partition)
+        shard_dir = shard_dir or indexing_config.get('shard_dir', 'faiss_data/shards')
+        paths = shard_paths(shard_dir, *shard)
+        indexing_config['checkpoint_path'] = paths['checkpoint_path']
+        indexing_config['failed_rows_path'] = paths['failed_rows_path']
+        store_config = {
+            'type': 'faiss',
+            'faiss': {
+                'index_path': paths['index_path'],
+                'metadata_path': paths['metadata_path'],
+                'dimension': config['vector_store'].get(config['vector_store'].get('type'), {}).get('dimension', 512),
+            },
+        }
+        print(f"分区构建模式：分片 {shard[0]}/{shard[1]}，输出到 {shard_dir}")
+    else:
+        store_config = config['vector_store']
         
     print("2. 初始化后端组件...")
+    telemetry.configure(config.get('telemetry'))
     encoder = create_encoder(config['encoder'])
-    vector_store = create_vector_store(config['vector_store'])
+    vector_store = create_vector_store(store_config)
+    if resume and not vector_store.supports_truncate:
+        # 无法丢弃上次检查点之后已写入的数据，续传会产生重复条目（Milvus 的自增主键不保证写入顺序）
+        print(f"错误：{type(vector_store).__name__} 不支持截断，无法使用 --resume。请去掉 --resume 重新建立索引。")
+        return
+
+    rebuild_partition = None
+    if rebuild_category is not None:
+        # 只重建一个类别分区：清空该分区后只索引属于它的行，其他分区保持不变
+        if shard is not None or not hasattr(vector_store, 'drop_partition'):
+            print("错误：--rebuild_category 需要按类别分区的向量存储（vector_store.type: faiss_partitioned），且不能与 --partition 同时使用。")
+            return
+        rebuild_partition = vector_store.partition_for(rebuild_category)
+        suffix = ".rebuild-" + re.sub(r'[^0-9A-Za-z_.-]+', '_', rebuild_partition)
+        for key, default in (('checkpoint_path', 'faiss_data/index_checkpoint.json'), ('failed_rows_path', 'faiss_data/failed_rows.jsonl')):
+            root, ext = os.path.splitext(indexing_config.get(key, default))
+            indexing_config[key] = root + suffix + ext
+        print(f"分区重建模式：只重建分区 '{rebuild_partition}'")
     
-    print(f"3. 加载数据源: {data_path}...")
+    print(f"3. 打开数据源: {data_path}...")
     if not os.path.exists(data_path):
         print(f"错误：数据文件不存在于 {data_path}")
         return
-        
-    if data_path.endswith('.csv'):
-        df = pd.read_csv(data_path)
-    elif data_path.endswith(('.xls', '.xlsx')):
-        df = pd.read_excel(data_path)
+    checkpoint = IndexingCheckpoint(indexing_config.get('checkpoint_path', 'faiss_data/index_checkpoint.json'))
+    state = checkpoint.load(data_path) if resume else None
+    if state is not None and state.get('completed'):
+        print("✅ 该数据源已在上次运行中完成索引，无需续传。")
+        return
+
+    if state is None:
+        if resume:
+            print("未找到可用的检查点，将从头开始索引。")
+        if rebuild_partition is not None:
+            print(f"4. 清空分区 '{rebuild_partition}'...")
+            vector_store.drop_partition(rebuild_partition)
+        else:
+            print("4. 清理旧索引...")
+            if shard is not None:
+                # 先撤销完成标记再清空分片，中途失败时合并不会读到空的或不完整的分片
+                clear_shard_done(shard_dir, *shard)
+            vector_store.delete_collection()
+        rows_consumed = 0
     else:
-        raise ValueError("不支持的数据文件格式。请使用 CSV 或 Excel 文件。")
+        rows_consumed = state['rows_consumed']
+        print(f"4. 从检查点恢复：已处理 {rows_consumed} 行，索引中应有 {state['vectors_indexed']} 条向量...")
+        # 丢弃上次检查点之后写入、但游标尚未确认的数据，避免重复
+        current_count = vector_store.count()
+        if state['vectors_indexed'] is not None and current_count is not None and current_count > state['vectors_indexed']:
+            vector_store.truncate(state['vectors_indexed'])
+    failed_log = FailedRowLog(
+        indexing_config.get('failed_rows_path', 'faiss_data/failed_rows.jsonl'),
+        keep_entries=state['failed_rows'] if state else 0
+    )
+    # 数据按块流式读取，内存占用与文件大小无关
+    record_batches = iter_record_batches(data_path, chunk_size=chunk_size, start_row=rows_consumed, columns=INDEX_COLUMNS)
+
+    def save_checkpoint(rows_consumed, completed=False):
+        vector_store.checkpoint()
+        failed_log.flush()
+        checkpoint.save(data_path, rows_consumed, vector_store.count(), failed_log.count, completed=completed)
 
-    print("4. 清理旧索引...")
-    vector_store.delete_collection()
+    def iter_records():
+        for records in record_batches:
+            yield from records
+
+    # 下载、解码、编码与写入分阶段并行执行；写入严格按数据源顺序进行，已完成行数可直接作为检查点游标
+    pipeline_config = dict(indexing_config.get('pipeline', {}))
+    if batch_size is not None:
+        pipeline_config['encode_batch_size'] = batch_size
+    pipeline = IngestPipeline.from_config(
+        encoder,
+        vector_store,
+        pipeline_config,
+        metadata_fn=lambda row: {'url': row['url'], 'category': row.get('category', ''), 'description': row.get('desc', '')},
+        # 配置了缩略图缓存时在索引阶段一并生成，问答页面展示参考图片时无需再下载原图
+        thumbnail_cache=ThumbnailCache.from_config(config['thumbnails']) if config.get('thumbnails') else None
+    )
+    start_row = rows_consumed
+    last_checkpoint = [start_row]
+
+    def on_written(completed):
+        # 在写入线程中执行，此时前 completed 行都已写入向量存储
+        if start_row + completed - last_checkpoint[0] >= checkpoint_every:
+            save_checkpoint(start_row + completed)
+            last_checkpoint[0] = start_row + completed
     
+    record_filter = None
+    if shard is not None:
+        record_filter = lambda seq, row: (start_row + seq) % shard[1] == shard[0]
+    elif rebuild_partition is not None:
+        record_filter = lambda seq, row: vector_store.partition_for(row.get('category')) == rebuild_partition
+
     print("5. 开始数据索引流程...")
-    items_to_index = [{'path': row['url'], 'category': row.get('category', ''), 'description': row.get('desc', '')} 
-                      for _, row in df.iterrows() if pd.notna(row['url'])]
-    
-    batch_size = 16
-    for i in tqdm(range(0, len(items_to_index), batch_size), desc="索引批处理"):
-        batch_items = items_to_index[i:i+batch_size]
-        
-        # 注意：这里的示例分别对每个项目进行编码，在实际应用中，批量编码会更高效
-        vectors = [encoder.encode(image=item['path'], text=item.get('description', '')) for item in batch_items]
-        metadata = [{'url': item['path'], 'category': item.get('category', ''), 'description': item.get('description', '')} for item in batch_items]
-        
-        vector_store.add(vectors=vectors, metadata=metadata)
+    with tqdm(total=estimate_row_count(data_path), initial=start_row, desc="索引进度", unit="行") as progress:
+        def report(stats):
+            progress.update(start_row + stats.completed - progress.n)
+            progress.set_postfix_str(f"失败 {failed_log.count} | {stats.format()}")
+
+        stats = pipeline.run(
+            iter_records(),
+            # 单条数据失败（例如图片链接失效）只记录到重试文件，不中断索引
+            on_error=lambda seq, row, error: failed_log.write(start_row + seq, row, error),
+            on_written=on_written,
+            progress_callback=report,
+            record_filter=record_filter
+        )
     
     print("6. 构建最终索引...")
     vector_store.build_index()
-    print(f"✅ 索引完成！共处理 {len(items_to_index)} 个项目。")
+    if shard is None:
+        # 分片的类别质心在合并或注册之后用 category_classifier.py 统一计算
+        build_and_save_centroids(vector_store, config.get('classification'))
+    save_checkpoint(start_row + stats.completed, completed=True)
+    failed_log.close()
+    if shard is not None:
+        write_shard_done(shard_dir, shard[0], shard[1], data_path, vector_store.count(), vector_store.dimension, failed_log.count)
+    print(f"✅ 索引完成！本次处理 {stats.written} 个项目。")
+    print(f"各阶段吞吐量: {stats.format()}")
+    if telemetry.enabled():
+        print(f"各阶段耗时: {telemetry.format_stage_summary()}")
+    telemetry.shutdown()
+    if failed_log.count:
+        print(f"⚠️ 共有 {failed_log.count} 行处理失败，已写入 {failed_log.path}，修复后可将该文件作为 --data_path 重新索引。")
+    return stats
 
 if __name__ == "__main__":
     # 您可以通过命令行参数覆盖默认值，或者在这里直接修改
@@ -57,6 +176,14 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="多模态数据索引脚本")
     parser.add_argument("--config_path", type=str, default="configs/config.yaml", help="配置文件的路径")
     parser.add_argument("--data_path", type=str, default="dataset/template.xlsx", help="待索引数据文件的路径")
+    parser.add_argument("--batch_size", type=int, default=None, help="每次模型推理的批大小，默认使用配置 indexing.pipeline.encode_batch_size")
+    parser.add_argument("--chunk_size", type=int, default=DEFAULT_CHUNK_SIZE, help="每次从数据文件读取的行数")
+    parser.add_argument("--resume", action="store_true", help="从上次的检查点继续索引，而不是清空后重建（仅支持 Faiss 存储）")
+    parser.add_argument("--partition", type=str, default=None, help="分区构建，格式为 i/N：只编码行号对 N 取模等于 i 的数据并写出一个分片")
+    parser.add_argument("--shard_dir", type=str, default=None, help="分片输出目录（多台机器共享），默认使用配置 indexing.shard_dir")
+    parser.add_argument("--rebuild_category", type=str, default=None,
+                        help="只重建该类别所属的分区（例如 risk/prohibited），其余分区不变；需要 faiss_partitioned 存储")
     args = parser.parse_args()
     
-    main(config_path=args.config_path, data_path=args.data_path) 
\ No newline at end of file
+    main(config_path=args.config_path, data_path=args.data_path, batch_size=args.batch_size, chunk_size=args.chunk_size, resume=args.resume,
+         partition=args.partition, shard_dir=args.shard_dir, rebuild_category=args.rebuild_category) 
\ No newline at end of file
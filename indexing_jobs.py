@@ -0,0 +1,325 @@
+"""
+后台索引任务。
+
+任务在独立的工作进程中运行摄取流水线，写入暂存索引，完成后再一次性替换正式索引，
+因此构建期间检索仍然使用原有索引，页面刷新或关闭也不会中断任务。
+任务状态（进度、速度、预计剩余时间、失败数）保存在 jobs_dir 下的 JSON 文件中，供 UI 或命令行轮询；
+取消通过写入取消标记文件实现，工作进程停止读取新数据、等待已在处理中的数据完成后丢弃暂存索引。
+
+命令行用法：
+    python indexing_jobs.py submit --data_path dataset/data.parquet
+    python indexing_jobs.py list
+    python indexing_jobs.py cancel <job_id>
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+import traceback
+import uuid
+from typing import Any, Dict, Iterator, List, Mapping, Optional
+
+from checkpoint import atomic_write_json
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+ACTIVE_STATES = (JOB_QUEUED, JOB_RUNNING)
+
+# 写入任务文件的配置段；不包含 llm 段，避免把 API 密钥写到磁盘上
+JOB_CONFIG_SECTIONS = ('encoder', 'vector_store', 'indexing', 'thumbnails', 'telemetry', 'classification')
+# 任务状态中保留的最近错误条数
+MAX_RECENT_ERRORS = 20
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    """
+    进程是否仍在运行。已退出但尚未被父进程回收的僵尸进程对 os.kill(pid, 0) 仍然可见，
+    因此在 Linux 上还要检查 /proc/<pid>/stat 中的进程状态。
+    """
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    try:
+        with open(f"/proc/{pid}/stat", 'r', encoding='utf-8') as f:
+            # 格式为 "pid (comm) state ..."，comm 中可能含有空格和括号
+            state = f.read().rsplit(')', 1)[1].split()[0]
+    except (OSError, IndexError):
+        return True
+    return state not in ('Z', 'X')
+
+
+class IndexingJobManager:
+    """
+    提交、查询和取消后台索引任务。同一时刻只允许一个活动任务（它们会写入同一个暂存索引）。
+    """
+    def __init__(self, jobs_dir: str = "faiss_data/jobs"):
+        self.jobs_dir = jobs_dir
+        os.makedirs(jobs_dir, exist_ok=True)
+        # 本进程启动的工作进程，通过 poll 判断是否退出（同时回收僵尸进程）；其他进程启动的任务只能按进程号判断
+        self._processes: Dict[str, subprocess.Popen] = {}
+
+    def _job_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _cancel_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.cancel")
+
+    def _pid_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.pid")
+
+    def submit(self, app_config: Dict[str, Any], source: Dict[str, Any], total_rows: Optional[int] = None) -> str:
+        """
+        提交一个索引任务并启动工作进程。
+        :param app_config: 完整的应用配置，只有 JOB_CONFIG_SECTIONS 中的段会写入任务文件。
+        :param source: 数据源，{'db_path': 标注库路径} 或 {'data_path': 数据文件路径}。
+        :param total_rows: 数据总行数，用于计算进度和预计剩余时间。
+        :return: 任务 ID。
+        """
+        active = self.active()
+        if active is not None:
+            raise RuntimeError(f"已有正在运行的索引任务 {active['id']}，请等待其完成或先取消。")
+        job_id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        job = {
+            'id': job_id,
+            'status': JOB_QUEUED,
+            'source': source,
+            'config': {key: app_config[key] for key in JOB_CONFIG_SECTIONS if key in app_config},
+            'created_at': time.time(),
+            'total_rows': total_rows,
+            'completed': 0,
+            'written': 0,
+            'failed': 0,
+            'rows_per_second': 0.0,
+            'eta_seconds': None,
+            'recent_errors': [],
+            'error': None,
+        }
+        job_path = self._job_path(job_id)
+        atomic_write_json(job_path, job)
+        # 新会话中启动，与 UI 进程的生命周期无关
+        log = open(os.path.join(self.jobs_dir, f"{job_id}.log"), 'ab')
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), 'run', job_path],
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            cwd=os.getcwd(),
+            start_new_session=True
+        )
+        log.close()
+        self._processes[job_id] = process
+        # 进程号单独保存，任务文件只由工作进程写入，避免并发覆盖
+        with open(self._pid_path(job_id), 'w', encoding='utf-8') as f:
+            f.write(str(process.pid))
+        return job_id
+
+    def _update(self, job_id: str, **fields):
+        job = self.get(job_id, check_alive=False)
+        job.update(fields)
+        job.pop('pid', None)
+        job.pop('cancel_requested', None)
+        atomic_write_json(self._job_path(job_id), job)
+
+    def get(self, job_id: str, check_alive: bool = True) -> Optional[Dict[str, Any]]:
+        """返回任务状态；工作进程已退出但任务仍处于活动状态时将其标记为失败。"""
+        try:
+            with open(self._job_path(job_id), 'r', encoding='utf-8') as f:
+                job = json.load(f)
+        except FileNotFoundError:
+            return None
+        try:
+            with open(self._pid_path(job_id), 'r', encoding='utf-8') as f:
+                job['pid'] = int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            job['pid'] = None
+        if check_alive and job['status'] in ACTIVE_STATES and job['pid'] and not self._worker_alive(job_id, job['pid']):
+            # 工作进程可能在读取任务文件之后才写入最终状态并退出，重新读取一次
+            with open(self._job_path(job_id), 'r', encoding='utf-8') as f:
+                job.update(json.load(f))
+        if check_alive and job['status'] in ACTIVE_STATES and job['pid'] and not self._worker_alive(job_id, job['pid']):
+            job.update(status=JOB_FAILED, error="工作进程意外退出，详见任务日志。", finished_at=time.time())
+            atomic_write_json(self._job_path(job_id), {k: v for k, v in job.items() if k != 'pid'})
+        job['cancel_requested'] = os.path.exists(self._cancel_path(job_id))
+        return job
+
+    def _worker_alive(self, job_id: str, pid: int) -> bool:
+        process = self._processes.get(job_id)
+        if process is not None and process.pid == pid:
+            return process.poll() is None
+        return _pid_alive(pid)
+
+    def list(self) -> List[Dict[str, Any]]:
+        """按提交时间倒序返回所有任务。"""
+        jobs = []
+        for name in os.listdir(self.jobs_dir):
+            if name.endswith('.json'):
+                job = self.get(name[:-len('.json')])
+                if job is not None:
+                    jobs.append(job)
+        return sorted(jobs, key=lambda job: job['created_at'], reverse=True)
+
+    def active(self) -> Optional[Dict[str, Any]]:
+        """当前正在排队或运行的任务，没有时返回 None。"""
+        for job in self.list():
+            if job['status'] in ACTIVE_STATES:
+                return job
+        return None
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        jobs = self.list()
+        return jobs[0] if jobs else None
+
+    def cancel(self, job_id: str):
+        """请求取消任务，工作进程会在处理完已读取的数据后停止并丢弃暂存索引。"""
+        with open(self._cancel_path(job_id), 'w', encoding='utf-8') as f:
+            f.write(str(time.time()))
+
+
+def format_job(job: Mapping[str, Any]) -> str:
+    """任务进度的单行摘要。"""
+    total = job.get('total_rows')
+    progress = f"{job['completed']}/{total}" if total else f"{job['completed']}"
+    text = f"[{job['status']}] 已处理 {progress} 行，写入 {job['written']}，失败 {job['failed']}，{job['rows_per_second']:.1f} 行/秒"
+    if job.get('eta_seconds') is not None and job['status'] == JOB_RUNNING:
+        text += f"，预计剩余 {int(job['eta_seconds'])} 秒"
+    return text
+
+
+def _iter_source(source: Dict[str, Any]) -> Iterator[List[Mapping[str, Any]]]:
+    if source.get('db_path'):
+        from annotation_store import AnnotationStore
+        return AnnotationStore(source['db_path']).iter_batches()
+    from data_sources import iter_record_batches
+    return iter_record_batches(source['data_path'])
+
+
+def run_job(job_path: str):
+    """在工作进程中执行一个任务（由 IndexingJobManager.submit 启动）。"""
+    from encoders import create_encoder
+    from ingest_pipeline import IngestPipeline
+    from stores import create_vector_store, staging_vector_store_config
+    from thumbnails import ThumbnailCache
+    from category_classifier import CategoryCentroids
+    import telemetry
+
+    manager = IndexingJobManager(os.path.dirname(job_path))
+    job_id = os.path.basename(job_path)[:-len('.json')]
+    job = manager.get(job_id, check_alive=False)
+    config = job['config']
+    cancel_path = manager._cancel_path(job_id)
+    started_at = time.time()
+    manager._update(job_id, status=JOB_RUNNING, started_at=started_at)
+    try:
+        telemetry.configure(config.get('telemetry'))
+        encoder = create_encoder(config['encoder'])
+        store_config = config['vector_store']
+        staging_config = staging_vector_store_config(store_config)
+        # 清理上次未完成任务留下的暂存数据后重新创建
+        create_vector_store(staging_config).delete_collection()
+        staging_store = create_vector_store(staging_config)
+
+        pipeline = IngestPipeline.from_config(
+            encoder,
+            staging_store,
+            config.get('indexing', {}).get('pipeline', {}),
+            thumbnail_cache=ThumbnailCache.from_config(config['thumbnails']) if config.get('thumbnails') else None
+        )
+        recent_errors = []
+        cancelled = [False]
+
+        def records():
+            for batch in _iter_source(job['source']):
+                if os.path.exists(cancel_path):
+                    cancelled[0] = True
+                    return
+                yield from batch
+
+        def on_error(seq, record, error):
+            recent_errors.append(f"第 {seq + 1} 行: {error}")
+            del recent_errors[:-MAX_RECENT_ERRORS]
+
+        def report(stats):
+            elapsed = max(time.time() - started_at, 1e-6)
+            rate = stats.completed / elapsed
+            total = job['total_rows']
+            manager._update(
+                job_id,
+                completed=stats.completed,
+                written=stats.written,
+                failed=stats.failed,
+                rows_per_second=rate,
+                eta_seconds=(total - stats.completed) / rate if total and rate > 0 else None,
+                stages=stats.format(),
+                recent_errors=list(recent_errors)
+            )
+
+        stats = pipeline.run(records(), on_error=on_error, progress_callback=report, report_interval=1.0)
+        report(stats)
+        if cancelled[0]:
+            staging_store.delete_collection()
+            manager._update(job_id, status=JOB_CANCELLED, finished_at=time.time())
+            print(f"任务 {job_id} 已取消。")
+            return
+
+        staging_store.build_index()
+        # 质心在暂存索引上计算，索引提交之后再替换质心文件
+        classification_config = config.get('classification') or {}
+        centroids = None
+        if classification_config.get('centroids_path'):
+            centroids = CategoryCentroids.from_vector_store(staging_store, classification_config.get('category_field', 'category'))
+        staging_store.promote(store_config[store_config['type']])
+        if centroids is not None:
+            centroids.save(classification_config['centroids_path'])
+        manager._update(job_id, status=JOB_SUCCEEDED, finished_at=time.time(), eta_seconds=0)
+        print(f"任务 {job_id} 完成: {stats.format()}")
+    except Exception as e:
+        traceback.print_exc()
+        manager._update(job_id, status=JOB_FAILED, error=str(e), finished_at=time.time())
+    finally:
+        telemetry.shutdown()
+
+
+if __name__ == "__main__":
+    import argparse
+    import yaml
+
+    parser = argparse.ArgumentParser(description="后台索引任务")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="执行任务（由任务管理器调用）")
+    run_parser.add_argument("job_path", type=str)
+    submit_parser = subparsers.add_parser("submit", help="提交一个索引任务并立即返回")
+    submit_parser.add_argument("--data_path", type=str, required=True, help="数据文件路径")
+    submit_parser.add_argument("--config_path", type=str, default="configs/config.yaml", help="配置文件路径")
+    list_parser = subparsers.add_parser("list", help="列出所有任务")
+    list_parser.add_argument("--jobs_dir", type=str, default=None)
+    cancel_parser = subparsers.add_parser("cancel", help="取消任务")
+    cancel_parser.add_argument("job_id", type=str)
+    cancel_parser.add_argument("--jobs_dir", type=str, default=None)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run_job(args.job_path)
+    else:
+        config_path = getattr(args, 'config_path', "configs/config.yaml")
+        with open(config_path, 'r', encoding='utf-8') as f:
+            app_config = yaml.safe_load(f)
+        jobs_dir = getattr(args, 'jobs_dir', None) or app_config.get('indexing', {}).get('jobs_dir', "faiss_data/jobs")
+        manager = IndexingJobManager(jobs_dir)
+        if args.command == "submit":
+            from data_sources import estimate_row_count
+            job_id = manager.submit(app_config, {'data_path': args.data_path}, total_rows=estimate_row_count(args.data_path))
+            print(f"已提交任务 {job_id}")
+        elif args.command == "list":
+            for job in manager.list():
+                print(f"{job['id']}  {format_job(job)}")
+        elif args.command == "cancel":
+            manager.cancel(args.job_id)
+            print(f"已请求取消任务 {args.job_id}")
@@ -0,0 +1,418 @@
+"""
+分阶段、带背压的数据摄取流水线。
+
+    数据源 -> [fetch 线程池] -> [decode 线程池] -> [encode 批处理] -> [writer] -> 向量存储
+
+各阶段之间通过有界队列连接，并行执行：网络 I/O、图片解码和模型推理相互重叠，
+整体吞吐量取决于最慢的阶段，而不是各阶段耗时之和。
+writer 按数据源顺序写入（乱序到达的结果在重排缓冲区中等待），
+因此“已完成行数”始终对应数据源的一个前缀，可以直接作为检查点游标。
+"""
+import io
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+
+import telemetry
+from encoders import BaseEncoder
+from thumbnails import ThumbnailCache
+
+_SENTINEL = object()
+
+
+class _Item:
+    __slots__ = ('seq', 'record', 'payload', 'vector', 'error', 'skip')
+
+    def __init__(self, seq: int, record: Dict[str, Any], skip: bool):
+        self.seq = seq
+        self.record = record
+        self.payload: Any = None
+        self.vector: Optional[np.ndarray] = None
+        self.error: Optional[BaseException] = None
+        self.skip = skip
+
+
+class StageStats:
+    """单个阶段的计数与忙碌时间。"""
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.processed = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, count: int, busy_seconds: float, errors: int = 0):
+        with self._lock:
+            self.processed += count
+            self.errors += errors
+            self.busy_seconds += busy_seconds
+        # 每次调用对应一条记录（fetch / decode）或一批记录（encode / write）
+        telemetry.observe("stage_seconds", busy_seconds, stage=f"ingest_{self.name}")
+
+
+class IngestStats:
+    """流水线运行时的统计信息：各阶段吞吐量、利用率以及队列深度。"""
+    def __init__(self):
+        self.stages: Dict[str, StageStats] = {}
+        self.queues: Dict[str, queue.Queue] = {}
+        self.max_queue_depth: Dict[str, int] = {}
+        self.started_at = time.monotonic()
+        # 按数据源顺序已处理完（写入、失败或跳过）的条数
+        self.completed = 0
+        self.written = 0
+        self.failed = 0
+
+    def sample_queues(self):
+        for name, q in self.queues.items():
+            self.max_queue_depth[name] = max(self.max_queue_depth.get(name, 0), q.qsize())
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        返回统计快照。utilization 为阶段忙碌时间占（运行时间 × 线程数）的比例，
+        最接近 1 的阶段即为瓶颈。
+        """
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        return {
+            'elapsed': elapsed,
+            'completed': self.completed,
+            'written': self.written,
+            'failed': self.failed,
+            'stages': {
+                name: {
+                    'workers': stage.workers,
+                    'processed': stage.processed,
+                    'errors': stage.errors,
+                    'throughput': stage.processed / elapsed,
+                    'utilization': stage.busy_seconds / (elapsed * stage.workers),
+                }
+                for name, stage in self.stages.items()
+            },
+            'queues': {
+                name: {'depth': q.qsize(), 'max_depth': self.max_queue_depth.get(name, 0), 'capacity': q.maxsize}
+                for name, q in self.queues.items()
+            },
+        }
+
+    def format(self) -> str:
+        """单行的可读摘要，便于在进度条或日志中展示。"""
+        snapshot = self.snapshot()
+        stages = " | ".join(
+            f"{name} {s['throughput']:.1f}/s ×{s['workers']} {s['utilization']:.0%}"
+            for name, s in snapshot['stages'].items()
+        )
+        queues = " ".join(f"{name}:{q['depth']}/{q['capacity']}" for name, q in snapshot['queues'].items())
+        return f"{stages} | 队列 {queues}"
+
+
+def default_metadata(record: Dict[str, Any]) -> Dict[str, Any]:
+    return dict(record)
+
+
+class IngestPipeline:
+    """
+    将记录流经 fetch -> decode -> encode -> write 四个阶段写入向量存储。
+    单条记录在任一阶段失败时不会中断流水线，而是通过 on_error 回调报告；
+    写入目标（sink）出错则视为致命错误，流水线停止并在 run 中重新抛出。
+    """
+    def __init__(
+        self,
+        encoder: BaseEncoder,
+        sink: Any,
+        fetch_workers: int = 16,
+        decode_workers: int = 4,
+        encode_workers: int = 1,
+        encode_batch_size: int = 32,
+        write_batch_size: int = 256,
+        queue_size: int = 256,
+        fetch_timeout: float = 10.0,
+        batch_linger: float = 0.05,
+        image_field: str = 'url',
+        text_field: Optional[str] = 'desc',
+        metadata_fn: Callable[[Dict[str, Any]], Dict[str, Any]] = default_metadata,
+        thumbnail_cache: Optional[ThumbnailCache] = None
+    ):
+        """
+        :param encoder: 编码器，使用其 preprocess_image / encode_batch。
+        :param sink: 写入目标，需提供 add(vectors, metadata) 方法（例如 BaseVectorStore）。只在 writer 线程中调用。
+        :param fetch_workers: 下载图片的线程数（I/O 密集，可以远大于 CPU 核数）。
+        :param decode_workers: 解码与预处理图片的线程数。
+        :param encode_workers: 执行模型推理的线程数，GPU 推理通常为 1。
+        :param encode_batch_size: 每次推理的最大批大小。
+        :param write_batch_size: 每次写入 sink 的最大条数。
+        :param queue_size: 各阶段之间队列的容量，队列满时上游阻塞（背压）。
+        :param fetch_timeout: 单张图片下载的超时时间（秒）。
+        :param batch_linger: 凑批时等待更多输入的最长时间（秒）。
+        :param image_field: 记录中图片路径/URL 的字段名，为空的记录会被跳过。
+        :param text_field: 记录中与图片一起编码的文本字段名，为 None 时只编码图片。
+        :param metadata_fn: 将记录转换为写入 sink 的元数据。
+        :param thumbnail_cache: 提供时在解码阶段顺便生成 UI 展示用的缩略图，失败不影响编码。
+        """
+        self.encoder = encoder
+        self.sink = sink
+        self.fetch_workers = fetch_workers
+        self.decode_workers = decode_workers
+        self.encode_workers = encode_workers
+        self.encode_batch_size = encode_batch_size
+        self.write_batch_size = write_batch_size
+        self.queue_size = queue_size
+        self.fetch_timeout = fetch_timeout
+        self.batch_linger = batch_linger
+        self.image_field = image_field
+        self.text_field = text_field
+        self.metadata_fn = metadata_fn
+        self.thumbnail_cache = thumbnail_cache
+        self._local = threading.local()
+
+    @classmethod
+    def from_config(cls, encoder: BaseEncoder, sink: Any, config: Optional[Dict[str, Any]] = None, **kwargs) -> "IngestPipeline":
+        """根据配置（indexing.pipeline 段）创建流水线，kwargs 覆盖配置中的同名项。"""
+        options = dict(config or {})
+        options.update(kwargs)
+        return cls(encoder, sink, **options)
+
+    # --- 各阶段的处理函数 ---
+
+    def _session(self) -> requests.Session:
+        # 每个下载线程复用自己的连接池
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', HTTPAdapter(pool_maxsize=4))
+            session.mount('https://', HTTPAdapter(pool_maxsize=4))
+            self._local.session = session
+        return session
+
+    def _fetch(self, item: _Item):
+        source = str(item.record[self.image_field])
+        if source.startswith(('http://', 'https://')):
+            response = self._session().get(source, timeout=self.fetch_timeout)
+            response.raise_for_status()
+            item.payload = response.content
+        else:
+            with open(source, 'rb') as f:
+                item.payload = f.read()
+
+    def _decode(self, item: _Item):
+        image = Image.open(io.BytesIO(item.payload)).convert('RGB')
+        if self.thumbnail_cache is not None:
+            try:
+                self.thumbnail_cache.put(str(item.record[self.image_field]), item.payload, image)
+            except Exception as e:
+                print(f"生成缩略图失败: {item.record[self.image_field]}，错误: {e}")
+        item.payload = self.encoder.preprocess_image(image)
+
+    def _text(self, item: _Item) -> Optional[str]:
+        if self.text_field is None:
+            return None
+        text = item.record.get(self.text_field)
+        return str(text) if text is not None and str(text).strip() else None
+
+    def _encode(self, items: List[_Item]):
+        try:
+            vectors = self.encoder.encode_batch([item.payload for item in items], [self._text(item) for item in items])
+            for item, vector in zip(items, vectors):
+                item.vector = vector
+        except Exception:
+            # 整批失败时逐条重试，只让真正出错的条目失败
+            for item in items:
+                try:
+                    item.vector = self.encoder.encode_batch([item.payload], [self._text(item)])[0]
+                except Exception as e:
+                    item.error = e
+        for item in items:
+            # 解码后的图片已不再需要，尽早释放内存
+            item.payload = None
+
+    # --- 运行 ---
+
+    def _start_pool(self, name: str, workers: int, fn: Callable[[_Item], None], inbox: queue.Queue, outbox: queue.Queue,
+                    downstream_sentinels: int, stats: IngestStats, abort: threading.Event) -> List[threading.Thread]:
+        stage = stats.stages[name] = StageStats(name, workers)
+        remaining = [workers]
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                item = inbox.get()
+                if item is _SENTINEL:
+                    break
+                if item.error is None and not item.skip and not abort.is_set():
+                    start = time.monotonic()
+                    try:
+                        fn(item)
+                    except Exception as e:
+                        item.error = e
+                    stage.record(1, time.monotonic() - start, errors=int(item.error is not None))
+                outbox.put(item)
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                for _ in range(downstream_sentinels):
+                    outbox.put(_SENTINEL)
+
+        threads = [threading.Thread(target=worker, name=f"ingest-{name}-{i}", daemon=True) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def run(
+        self,
+        records: Iterable[Dict[str, Any]],
+        on_error: Optional[Callable[[int, Dict[str, Any], BaseException], None]] = None,
+        on_written: Optional[Callable[[int], None]] = None,
+        progress_callback: Optional[Callable[[IngestStats], None]] = None,
+        report_interval: float = 0.5,
+        record_filter: Optional[Callable[[int, Dict[str, Any]], bool]] = None
+    ) -> IngestStats:
+        """
+        运行流水线直到 records 耗尽。
+        :param records: 记录的可迭代对象，按需惰性读取。
+        :param on_error: 单条记录失败时以 (序号, 记录, 异常) 调用，在 writer 线程中按数据源顺序执行。
+        :param on_written: 每次写入 sink 后以已完成条数调用，在 writer 线程中执行，
+            此时前这些条记录都已写入 sink，可用于保存检查点。
+        :param progress_callback: 在调用 run 的线程中每隔 report_interval 秒调用一次，可安全地更新 UI。
+        :param record_filter: 以 (序号, 记录) 调用，返回 False 的记录被跳过，但仍计入已完成条数，
+            因此已完成条数始终与数据源行号对齐。
+        :return: 最终的统计信息。
+        """
+        stats = IngestStats()
+        fetch_q: queue.Queue = queue.Queue(self.queue_size)
+        decode_q: queue.Queue = queue.Queue(self.queue_size)
+        encode_q: queue.Queue = queue.Queue(self.queue_size)
+        write_q: queue.Queue = queue.Queue(self.queue_size)
+        stats.queues = {'fetch': fetch_q, 'decode': decode_q, 'encode': encode_q, 'write': write_q}
+        abort = threading.Event()
+        fatal: List[BaseException] = []
+        # 限制在途条数，从而限制 writer 重排缓冲区的大小；必须大于一次写入的批大小，否则会死锁
+        in_flight = threading.Semaphore(4 * self.queue_size + self.write_batch_size + self.encode_batch_size * self.encode_workers)
+
+        def feed():
+            try:
+                for seq, record in enumerate(records):
+                    while not in_flight.acquire(timeout=0.1):
+                        if abort.is_set():
+                            return
+                    if abort.is_set():
+                        return
+                    skip = not record.get(self.image_field) or (record_filter is not None and not record_filter(seq, record))
+                    fetch_q.put(_Item(seq, record, skip=skip))
+            except Exception as e:
+                fatal.append(e)
+                abort.set()
+            finally:
+                for _ in range(self.fetch_workers):
+                    fetch_q.put(_SENTINEL)
+
+        def encode_worker():
+            stage = stats.stages['encode']
+            finished = False
+            while not finished:
+                item = encode_q.get()
+                if item is _SENTINEL:
+                    break
+                batch = [item]
+                while len(batch) < self.encode_batch_size:
+                    try:
+                        item = encode_q.get(timeout=self.batch_linger)
+                    except queue.Empty:
+                        break
+                    if item is _SENTINEL:
+                        finished = True
+                        break
+                    batch.append(item)
+                ready = [item for item in batch if item.error is None and not item.skip]
+                if ready and not abort.is_set():
+                    start = time.monotonic()
+                    self._encode(ready)
+                    stage.record(len(ready), time.monotonic() - start, errors=sum(item.error is not None for item in ready))
+                    telemetry.observe("batch_size", len(ready), stage="ingest_encode")
+                for item in batch:
+                    write_q.put(item)
+
+        def write():
+            stage = stats.stages['write']
+            reorder: Dict[int, _Item] = {}
+            next_seq = 0
+            pending = 0
+            vectors: List[np.ndarray] = []
+            metadata: List[Dict[str, Any]] = []
+
+            def flush():
+                nonlocal pending, vectors, metadata
+                if vectors and not abort.is_set():
+                    start = time.monotonic()
+                    try:
+                        self.sink.add(vectors=vectors, metadata=metadata)
+                        stats.written += len(vectors)
+                        stage.record(len(vectors), time.monotonic() - start)
+                        telemetry.observe("batch_size", len(vectors), stage="ingest_write")
+                    except Exception as e:
+                        fatal.append(e)
+                        abort.set()
+                if not abort.is_set():
+                    stats.completed += pending
+                    if on_written is not None:
+                        on_written(stats.completed)
+                for _ in range(pending):
+                    in_flight.release()
+                pending, vectors, metadata = 0, [], []
+
+            while True:
+                item = write_q.get()
+                if item is _SENTINEL:
+                    break
+                reorder[item.seq] = item
+                while next_seq in reorder:
+                    item = reorder.pop(next_seq)
+                    next_seq += 1
+                    pending += 1
+                    if item.error is not None:
+                        stats.failed += 1
+                        if on_error is not None and not abort.is_set():
+                            on_error(item.seq, item.record, item.error)
+                    elif not item.skip:
+                        vectors.append(item.vector)
+                        metadata.append(self.metadata_fn(item.record))
+                    if pending >= self.write_batch_size:
+                        flush()
+            flush()
+
+        stats.stages['write'] = StageStats('write', 1)
+        stats.stages['encode'] = StageStats('encode', self.encode_workers)
+        threads = [threading.Thread(target=feed, name="ingest-source", daemon=True)]
+        threads += self._start_pool('fetch', self.fetch_workers, self._fetch, fetch_q, decode_q, self.decode_workers, stats, abort)
+        threads += self._start_pool('decode', self.decode_workers, self._decode, decode_q, encode_q, self.encode_workers, stats, abort)
+        # 为了展示顺序与数据流向一致，重新排列阶段
+        stats.stages = {name: stats.stages[name] for name in ['fetch', 'decode', 'encode', 'write']}
+        encode_threads = [threading.Thread(target=encode_worker, name=f"ingest-encode-{i}", daemon=True) for i in range(self.encode_workers)]
+        writer = threading.Thread(target=write, name="ingest-write", daemon=True)
+        for thread in [threads[0]] + encode_threads + [writer]:
+            thread.start()
+
+        def close_encode():
+            for thread in encode_threads:
+                thread.join()
+            write_q.put(_SENTINEL)
+        threading.Thread(target=close_encode, name="ingest-encode-closer", daemon=True).start()
+
+        try:
+            while writer.is_alive():
+                writer.join(timeout=report_interval)
+                stats.sample_queues()
+                if progress_callback is not None:
+                    progress_callback(stats)
+        except BaseException:
+            # 例如 KeyboardInterrupt：通知各阶段尽快结束，已写入 sink 的数据保持不变
+            abort.set()
+            raise
+        if fatal:
+            raise fatal[0]
+        return stats
@@ -0,0 +1,103 @@
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from generators import create_async_generator, AsyncBaseGenerator
+from generators.rate_limit import AsyncRateLimiter
+from reranker import GenerativeAssistant
+
+AnswerResult = Tuple[str, Optional[int], List[Dict[str, Any]]]
+
+
+async def answer_batch_async(
+    assistant: GenerativeAssistant,
+    queries: List[Dict[str, Any]],
+    generator: AsyncBaseGenerator,
+    semaphore: asyncio.Semaphore
+) -> List[AnswerResult]:
+    """
+    并发地为多个查询运行 LLM 阶段（重排序 + 最终回答）。
+
+    :param assistant: 生成式助理实例。
+    :param queries: 查询列表，每项包含 GenerativeAssistant.answer 的参数：
+                    instruction, candidates, 以及可选的 query_image, query_text。
+    :param generator: 绑定于当前事件循环的异步生成器（限流器设置在生成器上）。
+    :param semaphore: 限制同时进行中的查询数。
+    :return: 与 queries 顺序一致的 (answer_text, recommended_index, candidates) 列表。
+    """
+    async def run_one(query: Dict[str, Any]) -> AnswerResult:
+        async with semaphore:
+            try:
+                return await assistant.aanswer(
+                    instruction=query["instruction"],
+                    candidates=query["candidates"],
+                    query_image=query.get("query_image"),
+                    query_text=query.get("query_text"),
+                    generator=generator
+                )
+            except Exception as e:
+                # 单个查询失败不影响整批结果
+                print(f"批量回答中的查询失败: {e}")
+                return f"处理您的请求时遇到了错误: {e}", None, query["candidates"]
+
+    return await asyncio.gather(*(run_one(query) for query in queries))
+
+
+class BatchAnswerer:
+    """
+    批量问答器：在后台线程中维持一个长期运行的事件循环，以及绑定于该循环的异步客户端、限流器和并发上限。
+    多次调用（例如 HTTP 服务的各个请求、批量查询的各个写入批次）共享同一份 RPM/TPM 配额与并发上限，
+    且不使用助理自身的异步生成器，可以在多个线程中同时调用 answer。
+    """
+    def __init__(self, assistant: GenerativeAssistant, batch_config: Optional[Dict[str, Any]] = None):
+        """
+        :param assistant: 生成式助理实例。
+        :param batch_config: 对应 config.yaml 中的 llm.batch 配置段。
+        """
+        batch_config = batch_config or {}
+        self.assistant = assistant
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        self.generator = create_async_generator(assistant.llm_config)
+        requests_per_minute = batch_config.get("requests_per_minute")
+        tokens_per_minute = batch_config.get("tokens_per_minute")
+        if requests_per_minute or tokens_per_minute:
+            self.generator.rate_limiter = AsyncRateLimiter(requests_per_minute, tokens_per_minute)
+        self._semaphore = asyncio.Semaphore(batch_config.get("max_concurrency", 8))
+
+    def submit(self, queries: List[Dict[str, Any]]) -> "concurrent.futures.Future[List[AnswerResult]]":
+        """把一批查询交给后台事件循环并发回答，立即返回 Future，调用方稍后再取结果。"""
+        return asyncio.run_coroutine_threadsafe(
+            answer_batch_async(self.assistant, queries, self.generator, self._semaphore), self._loop
+        )
+
+    def answer(self, queries: List[Dict[str, Any]]) -> List[AnswerResult]:
+        """在后台事件循环中并发回答一批查询，阻塞直到全部完成。"""
+        if not queries:
+            return []
+        return self.submit(queries).result()
+
+    def close(self):
+        """关闭异步客户端并停止后台事件循环。"""
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self.generator.aclose(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
+
+
+def answer_batch(
+    assistant: GenerativeAssistant,
+    queries: List[Dict[str, Any]],
+    batch_config: Optional[Dict[str, Any]] = None
+) -> List[AnswerResult]:
+    """
+    一次性批量回答的同步入口，供脚本使用：每次调用使用自己的事件循环、异步客户端与限流器，结束后关闭。
+    需要跨多次调用共享限流配额时（例如服务或长时间运行的批处理任务）请使用 BatchAnswerer。
+    :param batch_config: 对应 config.yaml 中的 llm.batch 配置段。
+    """
+    answerer = BatchAnswerer(assistant, batch_config)
+    try:
+        return answerer.answer(queries)
+    finally:
+        answerer.close()
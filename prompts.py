@@ -1,11 +1,119 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Union
 
-def create_prompt_template(
-    instruction: str, 
-    candidates: List[Dict[str, Any]], 
-    query_image: Optional[str] = None, 
-    query_text: Optional[str] = None
+from token_utils import count_tokens, truncate_to_tokens
+
+# 默认写入提示的候选字段，按优先级从高到低排列。
+# 超出 token 预算时，优先截断排在后面的字段。
+DEFAULT_PROMPT_FIELDS = ['category', 'desc', 'description']
+# 不设置预算时，单个字段值最多保留的 token 数
+DEFAULT_MAX_FIELD_TOKENS = 160
+# 重排序提示中每个候选项只保留简短文本
+DEFAULT_RERANK_FIELD_TOKENS = 40
+# 压缩过程中单个字段值最少保留的 token 数，低于该值时改为丢弃排在最后的候选项
+MIN_FIELD_TOKENS = 16
+
+# 流式回答中用于标记推荐索引的结束行前缀
+RECOMMENDED_INDEX_MARKER = "RECOMMENDED_INDEX:"
+
+
+def _build_user_query_section(
+    instruction: str,
+    query_image: Optional[str] = None,
+    query_text: Optional[str] = None,
+    max_text_tokens: Optional[int] = None,
+    model: Optional[str] = None
 ) -> str:
+    """构建用户查询部分，设置 max_text_tokens 时截断过长的查询文本和指令。"""
+    if max_text_tokens is not None:
+        query_text = truncate_to_tokens(query_text, max_text_tokens, model) if query_text else query_text
+        instruction = truncate_to_tokens(instruction, max_text_tokens, model)
+    user_query_section = "--- User Query ---\n"
+    if query_text:
+        user_query_section += f"Query Text: \"{query_text}\"\n"
+    if query_image:
+        user_query_section += f"Query Image: (User provided an image for reference)\n"
+    user_query_section += f"User's specific instruction is: \"{instruction}\"\n"
+    return user_query_section
+
+
+def _render_candidates(
+    header: str,
+    label: str,
+    candidates: List[Dict[str, Any]],
+    fields: List[str],
+    field_caps: Dict[str, int],
+    model: Optional[str] = None
+) -> str:
+    context_section = header
+    if not candidates:
+        context_section += "No relevant products found.\n" if label == "Product" else "No candidates found.\n"
+        return context_section
+    for i, item in enumerate(candidates):
+        context_section += f"{label} {i}:\n"
+        for key in fields:
+            value = item.get(key)
+            if value is None or (isinstance(value, float) and value != value) or str(value).strip() == "":
+                continue
+            value = truncate_to_tokens(str(value).strip(), field_caps[key], model)
+            context_section += f"  - {key.capitalize()}: {value}\n"
+    return context_section
+
+
+def _build_candidates_section(
+    header: str,
+    label: str,
+    candidates: List[Dict[str, Any]],
+    fields: List[str],
+    max_field_tokens: int,
+    token_budget: Optional[int] = None,
+    model: Optional[str] = None
+) -> str:
+    """
+    构建候选项部分，只保留 fields 中的字段，每个字段值最多 max_field_tokens 个 token。
+    设置 token_budget 时，按字段优先级从低到高逐步减半截断长度，
+    仍超出预算则从排名最后的候选项开始丢弃（至少保留一个候选项）。
+    """
+    field_caps = {key: max_field_tokens for key in fields}
+    while True:
+        section = _render_candidates(header, label, candidates, fields, field_caps, model)
+        if token_budget is None or count_tokens(section, model) <= token_budget:
+            return section
+        # 优先压缩优先级最低、且仍可继续截断的字段
+        shrinkable = [key for key in reversed(fields) if field_caps[key] > MIN_FIELD_TOKENS]
+        if shrinkable:
+            key = shrinkable[0]
+            field_caps[key] = max(MIN_FIELD_TOKENS, field_caps[key] // 2)
+        elif len(candidates) > 1:
+            candidates = candidates[:-1]
+        else:
+            return section
+
+
+def _finalize(prompt: str, return_token_count: bool, model: Optional[str]) -> Union[str, Tuple[str, int]]:
+    if return_token_count:
+        return prompt, count_tokens(prompt, model)
+    return prompt
+
+
+def _context_budget(token_budget: Optional[int], *fixed_sections: str, model: Optional[str] = None) -> Optional[int]:
+    """从总预算中扣除固定部分（查询与任务指令）后，剩余给候选项的 token 数。"""
+    if token_budget is None:
+        return None
+    used = sum(count_tokens(section, model) for section in fixed_sections)
+    return max(0, token_budget - used)
+
+
+def create_prompt_template(
+    instruction: str,
+    candidates: List[Dict[str, Any]],
+    query_image: Optional[str] = None,
+    query_text: Optional[str] = None,
+    token_budget: Optional[int] = None,
+    fields: Optional[List[str]] = None,
+    max_field_tokens: int = DEFAULT_MAX_FIELD_TOKENS,
+    model: Optional[str] = None,
+    return_token_count: bool = False
+) -> Union[str, Tuple[str, int]]:
     """
     根据用户输入和检索到的候选结果，创建一个结构化的提示。
 
@@ -13,29 +121,21 @@ def create_prompt_template(
     :param candidates: 从向量存储中检索到的候选项目列表。
     :param query_image: 用户上传的查询图片URL或路径（可选）。
     :param query_text: 用户的文本查询（可选）。
+    :param token_budget: 整个提示的 token 上限（可选），超出时按字段优先级截断候选内容。
+    :param fields: 写入提示的候选字段，按优先级排列，默认为 DEFAULT_PROMPT_FIELDS。
+    :param max_field_tokens: 单个字段值最多保留的 token 数。
+    :param model: 用于本地 token 计数的模型名（可选）。
+    :param return_token_count: 为 True 时返回 (提示, token 数)。
     :return: 格式化后的字符串提示。
     """
-    
+
     # 1. 构建用户查询部分
-    user_query_section = "--- User Query ---\n"
-    if query_text:
-        user_query_section += f"Query Text: \"{query_text}\"\n"
-    if query_image:
-        user_query_section += f"Query Image: (User provided an image for reference)\n"
-    user_query_section += f"User's specific instruction is: \"{instruction}\"\n"
+    user_query_section = _build_user_query_section(
+        instruction, query_image, query_text,
+        max_text_tokens=max_field_tokens if token_budget is not None else None, model=model
+    )
 
-    # 2. 构建检索到的上下文部分
-    context_section = "--- Retrieved Relevant Products ---\n"
-    if not candidates:
-        context_section += "No relevant products found.\n"
-    else:
-        for i, item in enumerate(candidates):
-            context_section += f"Product {i}:\n"
-            for key, value in item.items():
-                if key not in ['id', 'distance', 'is_annotated']: # 过滤掉内部元数据
-                    context_section += f"  - {key.capitalize()}: {value}\n"
-
-    # 3. 构建最终指令
+    # 2. 构建最终指令
     final_instruction = (
         "--- Task Instruction ---\n"
         "You are a professional shopping assistant. Your task is to answer the user's query based ONLY on the【Retrieved Relevant Products】.\n"
@@ -47,40 +147,39 @@ def create_prompt_template(
         "5. Your `answer_text` MUST be based strictly on the provided product information. DO NOT use external knowledge.\n"
         "Your JSON response is:"
     )
-    
-    return f"{user_query_section}\n{context_section}\n{final_instruction}"
+
+    # 3. 构建检索到的上下文部分
+    context_section = _build_candidates_section(
+        "--- Retrieved Relevant Products ---\n", "Product", candidates,
+        fields or DEFAULT_PROMPT_FIELDS, max_field_tokens,
+        token_budget=_context_budget(token_budget, user_query_section, final_instruction, model=model),
+        model=model
+    )
+
+    return _finalize(f"{user_query_section}\n{context_section}\n{final_instruction}", return_token_count, model)
 
 def create_rerank_prompt(
     instruction: str,
     candidates: List[Dict[str, Any]],
     query_image: Optional[str] = None,
-    query_text: Optional[str] = None
-) -> str:
+    query_text: Optional[str] = None,
+    token_budget: Optional[int] = None,
+    fields: Optional[List[str]] = None,
+    max_field_tokens: int = DEFAULT_RERANK_FIELD_TOKENS,
+    model: Optional[str] = None,
+    return_token_count: bool = False
+) -> Union[str, Tuple[str, int]]:
     """
     创建一个用于重排序的结构化提示，要求LLM返回JSON。
+    每个候选项只保留序号和简短文本，参数含义同 create_prompt_template。
     """
     # 1. 构建用户查询部分
-    user_query_section = "--- User Query ---\n"
-    if query_text:
-        user_query_section += f"Query Text: \"{query_text}\"\n"
-    if query_image:
-        user_query_section += f"Query Image: (User provided an image for reference)\n"
-    user_query_section += f"User's specific instruction is: \"{instruction}\"\n"
+    user_query_section = _build_user_query_section(
+        instruction, query_image, query_text,
+        max_text_tokens=DEFAULT_MAX_FIELD_TOKENS if token_budget is not None else None, model=model
+    )
 
-    # 2. 构建待排序的候选商品部分
-    context_section = "--- Retrieved Candidates for Reranking ---\n"
-    if not candidates:
-        context_section += "No candidates found.\n"
-    else:
-        for i, item in enumerate(candidates):
-            context_section += f"Candidate {i}:\n"
-            # 动态地将所有字段都包含进来，除了可能的内部元数据
-            for key, value in item.items():
-                # 假设 'id' 和 'distance' 是向量数据库的元数据，我们通常不需要让LLM看到
-                if key not in ['id', 'distance']: 
-                     context_section += f"  - {key.capitalize()}: {value}\n"
-
-    # 3. 构建最终指令
+    # 2. 构建最终指令
     final_instruction = (
         "--- Task Instruction ---\n"
         "You are an expert relevance judge. Your task is to evaluate the relevance of each candidate product to the user's query.\n"
@@ -90,5 +189,144 @@ def create_rerank_prompt(
         "For example, if you think Candidate 2 is most relevant, followed by Candidate 0, your response should be: {\"reranked_indices\": [2, 0, ...]}\n"
         "Your JSON response is:"
     )
-    
-    return f"{user_query_section}\n{context_section}\n{final_instruction}" 
\ No newline at end of file
+
+    # 3. 构建待排序的候选商品部分
+    context_section = _build_candidates_section(
+        "--- Retrieved Candidates for Reranking ---\n", "Candidate", candidates,
+        fields or DEFAULT_PROMPT_FIELDS, max_field_tokens,
+        token_budget=_context_budget(token_budget, user_query_section, final_instruction, model=model),
+        model=model
+    )
+
+    return _finalize(f"{user_query_section}\n{context_section}\n{final_instruction}", return_token_count, model)
+
+
+def create_stream_prompt_template(
+    instruction: str,
+    candidates: List[Dict[str, Any]],
+    query_image: Optional[str] = None,
+    query_text: Optional[str] = None,
+    token_budget: Optional[int] = None,
+    fields: Optional[List[str]] = None,
+    max_field_tokens: int = DEFAULT_MAX_FIELD_TOKENS,
+    model: Optional[str] = None,
+    return_token_count: bool = False
+) -> Union[str, Tuple[str, int]]:
+    """
+    创建用于流式回答的提示。
+    与 create_prompt_template 不同，这里要求模型直接输出自然语言答案，
+    并在最后单独一行给出推荐索引，以便答案可以边生成边展示。
+    """
+    # 1. 构建用户查询部分
+    user_query_section = _build_user_query_section(
+        instruction, query_image, query_text,
+        max_text_tokens=max_field_tokens if token_budget is not None else None, model=model
+    )
+
+    # 2. 构建最终指令
+    final_instruction = (
+        "--- Task Instruction ---\n"
+        "You are a professional shopping assistant. Your task is to answer the user's query based ONLY on the【Retrieved Relevant Products】.\n"
+        "**CRITICAL RULES:**\n"
+        "1. Answer in helpful, natural language. Explain WHY the product you recommend is a good match, citing its details. If no product is a good match, honestly explain why.\n"
+        "2. Your answer MUST be based strictly on the provided product information. DO NOT use external knowledge.\n"
+        "3. Do NOT answer in JSON.\n"
+        f"4. After the answer, output one final line of the form `{RECOMMENDED_INDEX_MARKER} <n>`, where <n> is the integer index "
+        "of the product you are primarily recommending, or `null` if no single product is a good fit. Output nothing after this line.\n"
+        "Your answer is:"
+    )
+
+    # 3. 构建检索到的上下文部分
+    context_section = _build_candidates_section(
+        "--- Retrieved Relevant Products ---\n", "Product", candidates,
+        fields or DEFAULT_PROMPT_FIELDS, max_field_tokens,
+        token_budget=_context_budget(token_budget, user_query_section, final_instruction, model=model),
+        model=model
+    )
+
+    return _finalize(f"{user_query_section}\n{context_section}\n{final_instruction}", return_token_count, model)
+
+
+def create_fused_prompt(
+    instruction: str,
+    candidates: List[Dict[str, Any]],
+    query_image: Optional[str] = None,
+    query_text: Optional[str] = None,
+    token_budget: Optional[int] = None,
+    fields: Optional[List[str]] = None,
+    max_field_tokens: int = DEFAULT_MAX_FIELD_TOKENS,
+    model: Optional[str] = None,
+    return_token_count: bool = False
+) -> Union[str, Tuple[str, int]]:
+    """
+    创建重排序与回答合并为一次调用的提示，要求LLM在同一个JSON中同时返回
+    reranked_indices、recommended_index 和 answer_text。参数含义同 create_prompt_template。
+    """
+    # 1. 构建用户查询部分
+    user_query_section = _build_user_query_section(
+        instruction, query_image, query_text,
+        max_text_tokens=max_field_tokens if token_budget is not None else None, model=model
+    )
+
+    # 2. 构建最终指令
+    final_instruction = (
+        "--- Task Instruction ---\n"
+        "You are a professional shopping assistant and an expert relevance judge. Complete BOTH steps below based ONLY on the【Retrieved Relevant Products】.\n"
+        "Step 1: Evaluate the relevance of each product to the user's query and sort the products from most relevant to least relevant. "
+        "Omit products that are clearly irrelevant.\n"
+        "Step 2: Answer the user's query using the most relevant products.\n"
+        "**CRITICAL RULES:**\n"
+        "1. Your response MUST be a single JSON object with exactly three keys: `reranked_indices`, `recommended_index` and `answer_text`.\n"
+        "2. `reranked_indices`: A list of integers, the original indices of the products sorted from most to least relevant.\n"
+        "3. `recommended_index`: The original integer index of the product you are primarily recommending. If no single product is a good fit, use `null`.\n"
+        "4. `answer_text`: A helpful, natural language text for the user. Explain WHY the product is a good match, citing its details. If no product is a good match, honestly explain why.\n"
+        "5. Your `answer_text` MUST be based strictly on the provided product information. DO NOT use external knowledge.\n"
+        "For example: {\"reranked_indices\": [2, 0], \"recommended_index\": 2, \"answer_text\": \"...\"}\n"
+        "Your JSON response is:"
+    )
+
+    # 3. 构建检索到的上下文部分
+    context_section = _build_candidates_section(
+        "--- Retrieved Relevant Products ---\n", "Product", candidates,
+        fields or DEFAULT_PROMPT_FIELDS, max_field_tokens,
+        token_budget=_context_budget(token_budget, user_query_section, final_instruction, model=model),
+        model=model
+    )
+
+    return _finalize(f"{user_query_section}\n{context_section}\n{final_instruction}", return_token_count, model)
+
+
+def create_annotation_prompt(
+    suggested_category: Optional[str],
+    examples: List[Dict[str, Any]],
+    existing_desc: Optional[str] = None,
+    max_field_tokens: int = DEFAULT_MAX_FIELD_TOKENS,
+    model: Optional[str] = None
+) -> str:
+    """
+    创建用于自动标注的提示：根据与待标注图片最相似的已标注样本，起草一条描述。
+    :param suggested_category: 通过近邻投票得到的建议类别（可能为空）。
+    :param examples: 最相似的已标注样本，按相似度降序排列。
+    :param existing_desc: 待标注数据已有的描述（可选）。
+    """
+    context_section = _build_candidates_section(
+        "--- Most Similar Annotated Examples ---\n", "Example", examples,
+        ['category', 'desc', 'description'], max_field_tokens, model=model
+    )
+    task_section = "--- Item To Annotate ---\n"
+    task_section += f"Suggested Category: {suggested_category or 'unknown'}\n"
+    if existing_desc:
+        task_section += f"Existing Description: {truncate_to_tokens(existing_desc, max_field_tokens, model)}\n"
+
+    final_instruction = (
+        "--- Task Instruction ---\n"
+        "You are a content-moderation annotator. The item to annotate is an image that looks most similar to the examples above.\n"
+        "Draft a description for the item in the SAME language, style and level of detail as the example descriptions, "
+        "stating what the item probably is and the applicable platform rule for the suggested category.\n"
+        "**CRITICAL RULES:**\n"
+        "1. Your response MUST be a JSON object with two keys: `category` and `desc`.\n"
+        "2. `category`: Keep the suggested category unless the examples clearly indicate another one; never invent a new category format.\n"
+        "3. `desc`: The drafted description. It will be reviewed by a human, so be concise and do not claim certainty you do not have.\n"
+        "Your JSON response is:"
+    )
+    return f"{context_section}\n{task_section}\n{final_instruction}"
@@ -0,0 +1,157 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+
+import telemetry
+
+
+class QueryResultCache:
+    """
+    问答流水线（编码 → 检索 → 重排 → 生成）的端到端结果缓存。
+
+    - 缓存键由查询图片字节的哈希、归一化后的文本以及索引版本号组成；
+    - 索引版本号变化（add / build_index）后，旧条目全部失效；
+    - 同一时刻完全相同的请求只会计算一次，其余请求等待并共享结果；
+    - 支持 TTL 过期和按条目数的 LRU 淘汰。
+    """
+    def __init__(self, max_entries: int = 1024, ttl_seconds: Optional[float] = 600.0):
+        """
+        :param max_entries: 最多缓存的条目数，超出后淘汰最久未使用的条目。
+        :param ttl_seconds: 条目的存活时间（秒），为 None 或 0 时不过期。
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._index_version: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def normalize_text(text: Optional[str]) -> str:
+        """去除首尾及重复空白并统一大小写，使仅有格式差异的问题命中同一条目。"""
+        if not text:
+            return ""
+        return " ".join(text.split()).casefold()
+
+    @classmethod
+    def make_key(cls, image_bytes: Optional[bytes], text: Optional[str], index_version: int) -> str:
+        """根据查询图片字节、文本和索引版本号生成缓存键。"""
+        image_digest = hashlib.sha256(image_bytes).hexdigest() if image_bytes else "-"
+        text_digest = hashlib.sha256(cls.normalize_text(text).encode("utf-8")).hexdigest()
+        return f"v{index_version}:{image_digest}:{text_digest}"
+
+    def _is_expired(self, entry: Dict[str, Any], now: float) -> bool:
+        return bool(self.ttl_seconds) and now - entry["created_at"] > self.ttl_seconds
+
+    def _check_version(self, index_version: int):
+        """索引版本变化时清空所有已完成的条目（调用方需持有锁）。"""
+        if self._index_version is not None and index_version != self._index_version:
+            self._entries.clear()
+        self._index_version = index_version
+
+    def _put(self, key: str, value: Any):
+        """写入条目并按 LRU 淘汰超出容量的部分（调用方需持有锁）。"""
+        self._entries[key] = {"value": value, "created_at": time.monotonic()}
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_or_compute(
+        self,
+        image_bytes: Optional[bytes],
+        text: Optional[str],
+        index_version: int,
+        compute_fn: Callable[[], Any],
+        should_cache: Optional[Callable[[Any], bool]] = None
+    ) -> Any:
+        """
+        命中缓存时直接返回结果；否则调用 compute_fn 计算并写入缓存。
+        如果相同的请求正在计算中，则等待其结果而不重复计算。
+        :param should_cache: 判断计算结果是否写入缓存，例如不缓存 LLM 调用失败时的错误信息；
+            不写入的结果仍会返回给正在等待的相同请求。
+        """
+        key = self.make_key(image_bytes, text, index_version)
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(index_version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._is_expired(entry, now):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    telemetry.record_cache("query", hit=True)
+                    return entry["value"]
+                del self._entries[key]
+
+            future = self._inflight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self._inflight[key] = future
+                self.misses += 1
+            else:
+                self.coalesced += 1
+            # 合并到进行中计算的请求同样没有触发计算，计为命中
+            telemetry.record_cache("query", hit=not is_owner)
+
+        if not is_owner:
+            return future.result()
+
+        try:
+            value = compute_fn()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._inflight.pop(key, None)
+            # 计算期间索引可能已更新，此时结果不再写入缓存
+            if index_version == self._index_version and (should_cache is None or should_cache(value)):
+                self._put(key, value)
+        future.set_result(value)
+        return value
+
+    def lookup(self, image_bytes: Optional[bytes], text: Optional[str], index_version: int) -> Optional[Any]:
+        """只查询不计算，未命中时返回 None。供无法合并计算的流式请求使用。"""
+        key = self.make_key(image_bytes, text, index_version)
+        with self._lock:
+            self._check_version(index_version)
+            entry = self._entries.get(key)
+            if entry is None or self._is_expired(entry, time.monotonic()):
+                self.misses += 1
+                telemetry.record_cache("query", hit=False)
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            telemetry.record_cache("query", hit=True)
+            return entry["value"]
+
+    def store(self, image_bytes: Optional[bytes], text: Optional[str], index_version: int, value: Any):
+        """直接写入一条计算结果。"""
+        key = self.make_key(image_bytes, text, index_version)
+        with self._lock:
+            self._check_version(index_version)
+            self._put(key, value)
+
+    def clear(self):
+        """清空所有已缓存的条目。"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """返回缓存命中情况的统计信息。"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+            }
@@ -0,0 +1,149 @@
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from encoders import BaseEncoder
+from stores import BaseVectorStore, StaleIndexError
+
+# 元数据中标识一条数据（DataFrame 行索引）的默认字段
+ROW_ID_FIELD = 'row_id'
+
+# 单条数据的同步状态
+STATUS_PENDING = 'pending'
+STATUS_SYNCING = 'syncing'
+STATUS_SYNCED = 'synced'
+STATUS_FAILED = 'failed'
+
+
+class ReencodeWorker:
+    """
+    后台增量重编码：接收被修改过的数据，在后台线程中重新编码并按 row_id upsert 到正在服务的向量存储，
+    使标注平台中的修改在几秒内即可被检索到，而无需重建整个索引。
+    同一条数据在同步前被多次修改时只编码最新的版本。
+    """
+    def __init__(
+        self,
+        encoder: BaseEncoder,
+        vector_store: BaseVectorStore,
+        key_field: str = ROW_ID_FIELD,
+        batch_size: int = 16,
+        persist: bool = True,
+        metadata_fn: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None
+    ):
+        """
+        :param encoder: 编码器。
+        :param vector_store: 正在服务的向量存储，需要支持 upsert。
+        :param key_field: 元数据中唯一标识一条数据的字段。
+        :param batch_size: 每次 upsert 的最大条数。
+        :param persist: 每处理完一轮修改后是否调用 vector_store.checkpoint() 持久化。
+        :param metadata_fn: 将记录转换为写入存储的元数据，默认原样写入。
+        """
+        self.encoder = encoder
+        self.vector_store = vector_store
+        self.key_field = key_field
+        self.batch_size = batch_size
+        self.persist = persist
+        self.metadata_fn = metadata_fn or dict
+        self._pending: Dict[Any, Dict[str, Any]] = {}
+        self._status: Dict[Any, Dict[str, Any]] = {}
+        # 已写入内存中的索引、尚未持久化的记录；索引被后台任务替换时据此重新提交
+        self._unsaved: Dict[Any, Dict[str, Any]] = {}
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="reencode-worker", daemon=True)
+        self._thread.start()
+
+    def submit(self, row_id: Any, record: Dict[str, Any]):
+        """提交一条被修改的数据，等待后台同步。"""
+        record = dict(record)
+        record[self.key_field] = row_id
+        with self._condition:
+            self._pending[row_id] = record
+            self._status[row_id] = {'status': STATUS_PENDING, 'error': None, 'updated_at': time.time()}
+            self._condition.notify()
+
+    def status(self, row_id: Any) -> Optional[Dict[str, Any]]:
+        """返回某条数据的同步状态，从未提交过时返回 None。"""
+        with self._condition:
+            status = self._status.get(row_id)
+            return dict(status) if status else None
+
+    def status_counts(self) -> Dict[str, int]:
+        """各同步状态的数据条数。"""
+        counts = {STATUS_PENDING: 0, STATUS_SYNCING: 0, STATUS_SYNCED: 0, STATUS_FAILED: 0}
+        with self._condition:
+            for status in self._status.values():
+                counts[status['status']] += 1
+        return counts
+
+    def reset(self):
+        """清空待同步的数据和状态，例如在全量重建索引之后。"""
+        with self._condition:
+            self._pending.clear()
+            self._status.clear()
+            self._unsaved.clear()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _set_status(self, row_ids: List[Any], status: str, error: Optional[str] = None):
+        now = time.time()
+        with self._condition:
+            for row_id in row_ids:
+                # 处理期间被再次修改的数据保持 pending，等待下一轮
+                if row_id in self._pending:
+                    continue
+                self._status[row_id] = {'status': status, 'error': error, 'updated_at': now}
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        with self._condition:
+            while not self._pending and not self._stopped:
+                self._condition.wait()
+            batch = []
+            for row_id in list(self._pending)[:self.batch_size]:
+                batch.append(self._pending.pop(row_id))
+                self._status[row_id] = {'status': STATUS_SYNCING, 'error': None, 'updated_at': time.time()}
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            vectors, metadata = [], []
+            for record in batch:
+                row_id = record[self.key_field]
+                try:
+                    vectors.append(self.encoder.encode(image=record.get('url') or None, text=record.get('desc', '')))
+                    metadata.append(self.metadata_fn(record))
+                except Exception as e:
+                    self._set_status([row_id], STATUS_FAILED, f"编码失败: {e}")
+            try:
+                self.vector_store.upsert(vectors=vectors, metadata=metadata, key_field=self.key_field)
+                with self._condition:
+                    drained = not self._pending
+                    if self.persist:
+                        self._unsaved.update((record[self.key_field], record) for record in batch)
+                if self.persist and drained:
+                    # 一轮修改全部写入后再持久化，避免频繁保存整个索引
+                    self.vector_store.checkpoint()
+                    with self._condition:
+                        self._unsaved.clear()
+            except StaleIndexError as e:
+                # 后台索引任务已提交新索引：改用新索引，并把尚未持久化的修改重新编码写入（按键更新是幂等的）
+                print(f"{e} 正在重新加载索引并重新同步未保存的修改。")
+                self.vector_store.reload()
+                with self._condition:
+                    for row_id, record in self._unsaved.items():
+                        self._pending.setdefault(row_id, record)
+                        self._status[row_id] = {'status': STATUS_PENDING, 'error': None, 'updated_at': time.time()}
+                    self._unsaved.clear()
+                continue
+            except Exception as e:
+                self._set_status([item[self.key_field] for item in metadata], STATUS_FAILED, f"写入索引失败: {e}")
+                print(f"增量更新索引失败: {e}")
+                continue
+            self._set_status([item[self.key_field] for item in metadata], STATUS_SYNCED)
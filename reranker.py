@@ -1,17 +1,124 @@
+import asyncio
 import json
 import re
-from generators import create_generator, BaseGenerator
-from prompts import create_prompt_template, create_rerank_prompt
-from typing import List, Dict, Any, Tuple, Optional
+import time
+from generators import create_generator, create_async_generator, BaseGenerator, AsyncBaseGenerator, LLM_ERROR_PREFIX
+from rerankers import BaseReranker
+from semantic_cache import SemanticAnswerCache
+from stores import BaseVectorStore
+from prompts import (
+    create_prompt_template,
+    create_rerank_prompt,
+    create_stream_prompt_template,
+    create_fused_prompt,
+    RECOMMENDED_INDEX_MARKER,
+)
+from typing import List, Dict, Any, Tuple, Optional, Iterable, Iterator, Callable
+import numpy as np
+
+import telemetry
+
+
+def is_cacheable_answer(result: Tuple[str, Optional[int], List[Dict[str, Any]]]) -> bool:
+    """(answer_text, recommended_index, candidates) 是否可以写入缓存：LLM 调用失败时返回的错误信息不缓存。"""
+    return not result[0].startswith(LLM_ERROR_PREFIX)
+
+
+class StreamingAnswer:
+    """
+    流式回答的结果对象。
+    迭代它会逐段产出可直接展示的答案文本（不含末尾的推荐索引行）；
+    迭代结束后可通过 answer_text / recommended_index / candidates 读取完整结果；
+    failed 为 True 表示生成中途出错（答案不完整，末尾是错误信息），这样的结果不应被缓存。
+    """
+    def __init__(
+        self,
+        tokens: Iterable[str],
+        candidates: List[Dict[str, Any]],
+        on_complete: Optional[Callable[["StreamingAnswer"], None]] = None
+    ):
+        """
+        :param tokens: 生成器产出的文本片段。
+        :param candidates: 用于生成答案的候选项。
+        :param on_complete: 流结束后调用的回调，例如写入语义缓存。
+        """
+        self._tokens = tokens
+        self._on_complete = on_complete
+        self.candidates = candidates
+        self.answer_text = ""
+        self.recommended_index: Optional[int] = None
+        self.finished = False
+        self.failed = False
+
+    @staticmethod
+    def _held_back_length(text: str) -> int:
+        """返回文本末尾可能是推荐索引标记前缀的字符数，这部分需要暂不输出。"""
+        for size in range(min(len(text), len(RECOMMENDED_INDEX_MARKER) - 1), 0, -1):
+            if RECOMMENDED_INDEX_MARKER.startswith(text[-size:]):
+                return size
+        return 0
+
+    def __iter__(self) -> Iterator[str]:
+        if self.finished:
+            yield self.answer_text
+            return
+
+        text = ""
+        emitted = 0
+        marker_pos = -1
+        for token in self._tokens:
+            if token.startswith(LLM_ERROR_PREFIX):
+                self.failed = True
+            text += token
+            if marker_pos == -1:
+                marker_pos = text.find(RECOMMENDED_INDEX_MARKER, max(0, emitted - len(RECOMMENDED_INDEX_MARKER)))
+            if marker_pos != -1:
+                safe_end = marker_pos
+            else:
+                safe_end = len(text) - self._held_back_length(text)
+            if safe_end > emitted:
+                yield text[emitted:safe_end]
+                emitted = safe_end
+
+        if marker_pos == -1:
+            # 模型没有输出推荐索引行，剩余内容全部作为答案
+            if len(text) > emitted:
+                yield text[emitted:]
+            self.answer_text = text.strip()
+        else:
+            self.answer_text = text[:marker_pos].strip()
+            index_match = re.search(r'-?\d+', text[marker_pos + len(RECOMMENDED_INDEX_MARKER):])
+            if index_match:
+                recommended_index = int(index_match.group(0))
+                if 0 <= recommended_index < len(self.candidates):
+                    self.recommended_index = recommended_index
+        self.finished = True
+        if self._on_complete is not None:
+            self._on_complete(self)
+
 
 class GenerativeAssistant:
     """
     生成式助理，负责整合上下文并调用LLM生成最终答案。
     """
-    def __init__(self, llm_config: Dict[str, Any]):
+    NO_CANDIDATES_MESSAGE = "抱歉，根据您的描述，我没有在知识库中找到相关的商品。"
+    NO_RELEVANT_MESSAGE = "虽然找到了一些相似的商品，但经过进一步筛选，它们似乎不完全符合您的具体要求。"
+
+    def __init__(
+        self,
+        llm_config: Dict[str, Any],
+        reranker: Optional[BaseReranker] = None,
+        fallback_to_llm: bool = True,
+        semantic_cache: Optional[SemanticAnswerCache] = None,
+        vector_store: Optional[BaseVectorStore] = None
+    ):
         """
         初始化助理。
         :param llm_config: 用于创建生成器实例的配置字典。
+        :param reranker: 可选的本地重排序器，设置后优先使用它代替 LLM 重排。
+        :param fallback_to_llm: 本地重排序器无法处理时，是否回退到 LLM 重排。
+        :param semantic_cache: 可选的语义缓存，命中时直接复用已有回答而不调用 LLM。
+        :param vector_store: 候选项所在的向量存储，用于读取索引版本号，使语义缓存在索引变化后失效。
         """
         # 这里我们直接使用 create_generator，它会处理 OpenAI 和 Azure 的情况
         self.generator: BaseGenerator = create_generator(llm_config)
@@ -19,28 +126,120 @@ class GenerativeAssistant:
         # 存储原始配置，以备将来需要传递 temperature 等参数
         self.llm_config = llm_config
         self.rerank_top_k = 3 # 定义在重排后，取前K个结果用于最终生成
+        self._async_generator: Optional[AsyncBaseGenerator] = None
+        self.reranker = reranker
+        self.fallback_to_llm = fallback_to_llm
+        self.semantic_cache = semantic_cache
+        self.vector_store = vector_store
+        # 提示词的 token 预算与字段配置，见 config.yaml 中的 llm.prompt
+        self.prompt_config: Dict[str, Any] = llm_config.get("prompt", {})
+        self.model_name: Optional[str] = llm_config.get(llm_config.get("type"), {}).get("model")
+        # 需要LLM重排序时，是否将重排序与回答合并为一次LLM调用
+        self.fused_mode: bool = llm_config.get("fused_rerank_answer", False)
 
-    def _rerank(
+    def _build_prompt(
         self,
+        builder: Callable[..., Any],
         instruction: str,
         candidates: List[Dict[str, Any]],
         query_image: Optional[str] = None,
         query_text: Optional[str] = None
-    ) -> List[Dict[str, Any]]:
-        """使用LLM对候选结果进行重排序。"""
+    ) -> str:
+        """按 prompt 配置的 token 预算构建提示，并报告实际使用的 token 数。"""
+        is_rerank = builder is create_rerank_prompt
+        # 合并模式的提示同时包含重排序与回答，使用回答的预算
+        budget_key = "rerank_token_budget" if is_rerank else "token_budget"
+        field_tokens_key = "rerank_field_tokens" if is_rerank else "max_field_tokens"
+        options = {
+            "token_budget": self.prompt_config.get(budget_key),
+            "fields": self.prompt_config.get("fields"),
+            "model": self.model_name,
+            "return_token_count": True,
+        }
+        if field_tokens_key in self.prompt_config:
+            options["max_field_tokens"] = self.prompt_config[field_tokens_key]
+        prompt, token_count = builder(instruction, candidates, query_image, query_text, **options)
+        print(f"提示词 ({builder.__name__}) 共 {token_count} 个 token。")
+        return prompt
+
+    @staticmethod
+    def _candidate_ids(candidates: List[Dict[str, Any]]) -> List[Any]:
+        """取候选项在向量存储中的 id，缺失时退化为 url。"""
+        return [item.get('id', item.get('url')) for item in candidates]
+
+    def _index_version(self) -> Optional[int]:
+        return self.vector_store.index_version if self.vector_store is not None else None
+
+    def _lookup_semantic_cache(
+        self,
+        query_vector: Optional[np.ndarray],
+        candidates: List[Dict[str, Any]],
+        index_version: Optional[int] = None
+    ) -> Optional[Tuple[str, Optional[int], List[Dict[str, Any]]]]:
+        if self.semantic_cache is None or query_vector is None:
+            return None
+        cached = self.semantic_cache.lookup(query_vector, self._candidate_ids(candidates), index_version)
+        telemetry.record_cache("semantic", hit=cached is not None)
+        if cached is not None:
+            print("语义缓存命中，跳过 LLM 调用。")
+        return cached
+
+    def _store_semantic_cache(
+        self,
+        query_vector: Optional[np.ndarray],
+        candidates: List[Dict[str, Any]],
+        result: Tuple[str, Optional[int], List[Dict[str, Any]]],
+        index_version: Optional[int] = None
+    ):
+        if self.semantic_cache is None or query_vector is None:
+            return
+        # 不缓存调用失败时返回的错误信息
+        if is_cacheable_answer(result):
+            self.semantic_cache.store(query_vector, self._candidate_ids(candidates), result, index_version)
+
+    @property
+    def async_generator(self) -> AsyncBaseGenerator:
+        """按需创建的异步生成器，供 aanswer 等异步路径使用。"""
+        if self._async_generator is None:
+            self._async_generator = create_async_generator(self.llm_config)
+        return self._async_generator
+
+    async def aclose_async_generator(self):
+        """关闭异步生成器。异步客户端绑定于事件循环，在事件循环结束前调用。"""
+        if self._async_generator is not None:
+            await self._async_generator.aclose()
+            self._async_generator = None
+
+    def _rerank_without_llm(
+        self,
+        instruction: str,
+        candidates: List[Dict[str, Any]],
+        query_image: Optional[str] = None,
+        query_text: Optional[str] = None,
+        query_vector: Optional[np.ndarray] = None
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        尝试不调用 LLM 完成重排序：优先使用本地重排序器，其次根据 distance 排序。
+        两者都不可用时返回 None，表示需要 LLM 重排。
+        """
+        if self.reranker is not None:
+            reranked_candidates = self.reranker.rerank(instruction, candidates, query_image, query_text, query_vector)
+            if reranked_candidates is not None:
+                return reranked_candidates
+            if not self.fallback_to_llm:
+                print("本地重排序不可用且未启用 LLM 回退，将使用原始顺序。")
+                return candidates
+
         # 如果候选项包含distance字段，则我们优先根据distance进行排序
         if candidates and 'distance' in candidates[0]:
             print("检测到距离信息，将根据距离排序并跳过LLM重排。")
             # 距离越小越好，所以升序排序
             return sorted(candidates, key=lambda x: x['distance'])
+        return None
 
-        print(f"开始对 {len(candidates)} 个候选结果进行重排序...")
-        rerank_prompt = create_rerank_prompt(instruction, candidates, query_image, query_text)
-        
+    def _parse_rerank_response(self, response_json_str: str, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """解析重排序的LLM响应，失败时回退到原始顺序。"""
         try:
-            # 强制LLM使用JSON模式
-            response_json_str = self.generator.generate(rerank_prompt, response_format={"type": "json_object"})
-            
             # 从LLM的返回结果中稳健地提取JSON对象
             # 某些模型可能会在JSON前后添加额外的文本(例如 '```json\n{...}\n```')
             json_match = re.search(r'\{.*\}', response_json_str, re.DOTALL)
@@ -65,37 +264,64 @@ class GenerativeAssistant:
             print(f"Rerank过程中发生错误: {e}。将使用原始顺序。")
             return candidates # 发生错误时，回退到原始列表
 
-    def answer(
+    def _rerank(
         self,
         instruction: str,
         candidates: List[Dict[str, Any]],
         query_image: Optional[str] = None,
-        query_text: Optional[str] = None
-    ) -> Tuple[str, Optional[int], List[Dict[str, Any]]]:
-        if not candidates:
-            return "抱歉，根据您的描述，我没有在知识库中找到相关的商品。", None, []
+        query_text: Optional[str] = None,
+        query_vector: Optional[np.ndarray] = None
+    ) -> List[Dict[str, Any]]:
+        """对候选结果进行重排序，本地重排序不可用时使用LLM。"""
+        sorted_candidates = self._rerank_without_llm(instruction, candidates, query_image, query_text, query_vector)
+        if sorted_candidates is not None:
+            return sorted_candidates
+        return self._rerank_with_llm(instruction, candidates, query_image, query_text)
 
-        # 1. 重排序候选项
-        reranked_candidates = self._rerank(instruction, candidates, query_image, query_text)
+    def _rerank_with_llm(
+        self,
+        instruction: str,
+        candidates: List[Dict[str, Any]],
+        query_image: Optional[str] = None,
+        query_text: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """调用LLM对候选结果重排序，出错时回退到原始顺序。"""
+        print(f"开始对 {len(candidates)} 个候选结果进行重排序...")
+        rerank_prompt = self._build_prompt(create_rerank_prompt, instruction, candidates, query_image, query_text)
         
-        if not reranked_candidates:
-             return "虽然找到了一些相似的商品，但经过进一步筛选，它们似乎不完全符合您的具体要求。", None, candidates
+        try:
+            # 强制LLM使用JSON模式
+            response_json_str = self.generator.generate(rerank_prompt, response_format={"type": "json_object"})
+        except Exception as e:
+            print(f"Rerank过程中发生错误: {e}。将使用原始顺序。")
+            return candidates
+        return self._parse_rerank_response(response_json_str, candidates)
 
-        # 2. 选取Top-K个结果用于最终生成
-        final_candidates = reranked_candidates[:self.rerank_top_k]
+    async def _arerank_with_llm(
+        self,
+        instruction: str,
+        candidates: List[Dict[str, Any]],
+        query_image: Optional[str] = None,
+        query_text: Optional[str] = None,
+        generator: Optional[AsyncBaseGenerator] = None
+    ) -> List[Dict[str, Any]]:
+        """_rerank_with_llm 的异步版本。"""
+        print(f"开始对 {len(candidates)} 个候选结果进行重排序...")
+        rerank_prompt = self._build_prompt(create_rerank_prompt, instruction, candidates, query_image, query_text)
 
-        # 3. 创建最终答案的提示
-        prompt = create_prompt_template(
-            instruction=instruction,
-            candidates=final_candidates,
-            query_image=query_image,
-            query_text=query_text
-        )
+        try:
+            response_json_str = await (generator or self.async_generator).agenerate(rerank_prompt, response_format={"type": "json_object"})
+        except Exception as e:
+            print(f"Rerank过程中发生错误: {e}。将使用原始顺序。")
+            return candidates
+        return self._parse_rerank_response(response_json_str, candidates)
 
-        # 4. 调用生成器获取JSON格式的回答
-        response_json_str = self.generator.generate(prompt, response_format={"type": "json_object"})
-        
-        # 5. 解析JSON
+    def _parse_answer_response(
+        self,
+        response_json_str: str,
+        final_candidates: List[Dict[str, Any]]
+    ) -> Tuple[str, Optional[int], List[Dict[str, Any]]]:
+        """解析最终回答的JSON响应，返回 (answer_text, recommended_index, final_candidates)。"""
         try:
             json_match = re.search(r'\{.*\}', response_json_str, re.DOTALL)
             if not json_match:
@@ -120,3 +346,230 @@ class GenerativeAssistant:
         except Exception as e:
             print(f"解析最终答案时发生错误: {e}")
             return "处理您的请求时遇到了预期之外的错误。", None, final_candidates
+
+    def _parse_fused_response(
+        self,
+        response_json_str: str,
+        candidates: List[Dict[str, Any]]
+    ) -> Optional[Tuple[str, Optional[int], List[Dict[str, Any]]]]:
+        """
+        解析合并模式的JSON响应。reranked_indices 与 recommended_index 均为原始候选序号，
+        这里将其转换为最终候选列表及其中的推荐位置。响应格式不合法时返回 None。
+        """
+        try:
+            json_match = re.search(r'\{.*\}', response_json_str, re.DOTALL)
+            if not json_match:
+                return None
+            response_data = json.loads(json_match.group(0))
+        except (json.JSONDecodeError, TypeError):
+            return None
+        if not isinstance(response_data, dict):
+            return None
+
+        reranked_indices = response_data.get("reranked_indices")
+        answer_text = response_data.get("answer_text")
+        if not isinstance(reranked_indices, list) or not isinstance(answer_text, str) or not answer_text.strip():
+            return None
+
+        seen = set()
+        ordered_indices = []
+        for i in reranked_indices:
+            if isinstance(i, int) and not isinstance(i, bool) and 0 <= i < len(candidates) and i not in seen:
+                seen.add(i)
+                ordered_indices.append(i)
+        final_indices = ordered_indices[:self.rerank_top_k]
+
+        recommended_index = response_data.get("recommended_index")
+        if isinstance(recommended_index, int) and not isinstance(recommended_index, bool) and 0 <= recommended_index < len(candidates):
+            # 推荐项必须出现在最终候选中
+            if recommended_index not in final_indices:
+                final_indices.append(recommended_index)
+            recommended_position = final_indices.index(recommended_index)
+        else:
+            recommended_position = None
+
+        if not final_indices:
+            return answer_text, None, candidates
+        return answer_text, recommended_position, [candidates[i] for i in final_indices]
+
+    def _answer_fused(
+        self,
+        instruction: str,
+        candidates: List[Dict[str, Any]],
+        query_image: Optional[str] = None,
+        query_text: Optional[str] = None
+    ) -> Optional[Tuple[str, Optional[int], List[Dict[str, Any]]]]:
+        """以一次LLM调用同时完成重排序与回答；输出不合法时返回 None，由调用方回退到两次调用。"""
+        print(f"合并模式：一次调用完成 {len(candidates)} 个候选结果的重排序与回答...")
+        prompt = self._build_prompt(create_fused_prompt, instruction, candidates, query_image, query_text)
+        response_json_str = self.generator.generate(prompt, response_format={"type": "json_object"})
+        result = self._parse_fused_response(response_json_str, candidates)
+        if result is None:
+            print(f"合并模式的响应格式不合法，回退到重排序+回答两次调用: {response_json_str[:200]}")
+        return result
+
+    async def _aanswer_fused(
+        self,
+        instruction: str,
+        candidates: List[Dict[str, Any]],
+        query_image: Optional[str] = None,
+        query_text: Optional[str] = None,
+        generator: Optional[AsyncBaseGenerator] = None
+    ) -> Optional[Tuple[str, Optional[int], List[Dict[str, Any]]]]:
+        """_answer_fused 的异步版本。"""
+        prompt = self._build_prompt(create_fused_prompt, instruction, candidates, query_image, query_text)
+        response_json_str = await (generator or self.async_generator).agenerate(prompt, response_format={"type": "json_object"})
+        result = self._parse_fused_response(response_json_str, candidates)
+        if result is None:
+            print(f"合并模式的响应格式不合法，回退到重排序+回答两次调用: {response_json_str[:200]}")
+        return result
+
+    def answer(
+        self,
+        instruction: str,
+        candidates: List[Dict[str, Any]],
+        query_image: Optional[str] = None,
+        query_text: Optional[str] = None,
+        query_vector: Optional[np.ndarray] = None
+    ) -> Tuple[str, Optional[int], List[Dict[str, Any]]]:
+        """
+        :param query_vector: 查询的编码向量（可选），提供时启用语义缓存。
+        """
+        if not candidates:
+            return self.NO_CANDIDATES_MESSAGE, None, []
+
+        # 候选项是在该版本的索引上检索到的，写入缓存时沿用这个版本号
+        index_version = self._index_version()
+        cached = self._lookup_semantic_cache(query_vector, candidates, index_version)
+        if cached is not None:
+            return cached
+
+        # 1. 重排序候选项。合并模式下，若需要LLM重排序，则与回答合并为一次调用
+        with telemetry.span("rerank", candidates=len(candidates)):
+            reranked_candidates = self._rerank_without_llm(instruction, candidates, query_image, query_text, query_vector)
+        if reranked_candidates is None and self.fused_mode:
+            with telemetry.span("fused_generate", candidates=len(candidates)):
+                result = self._answer_fused(instruction, candidates, query_image, query_text)
+            if result is not None:
+                self._store_semantic_cache(query_vector, candidates, result, index_version)
+                return result
+        if reranked_candidates is None:
+            # 本地重排序的结果已经确定不可用，直接使用LLM重排序
+            with telemetry.span("rerank", candidates=len(candidates)):
+                reranked_candidates = self._rerank_with_llm(instruction, candidates, query_image, query_text)
+        
+        if not reranked_candidates:
+             return self.NO_RELEVANT_MESSAGE, None, candidates
+
+        # 2. 选取Top-K个结果用于最终生成
+        final_candidates = reranked_candidates[:self.rerank_top_k]
+
+        # 3. 创建最终答案的提示
+        prompt = self._build_prompt(create_prompt_template, instruction, final_candidates, query_image, query_text)
+
+        # 4. 调用生成器获取JSON格式的回答
+        with telemetry.span("generate", candidates=len(final_candidates)):
+            response_json_str = self.generator.generate(prompt, response_format={"type": "json_object"})
+        
+        # 5. 解析JSON
+        result = self._parse_answer_response(response_json_str, final_candidates)
+        self._store_semantic_cache(query_vector, candidates, result, index_version)
+        return result
+
+    async def aanswer(
+        self,
+        instruction: str,
+        candidates: List[Dict[str, Any]],
+        query_image: Optional[str] = None,
+        query_text: Optional[str] = None,
+        query_vector: Optional[np.ndarray] = None,
+        generator: Optional[AsyncBaseGenerator] = None
+    ) -> Tuple[str, Optional[int], List[Dict[str, Any]]]:
+        """
+        answer 的异步版本，重排序和最终生成均通过异步生成器完成。
+        :param generator: 使用的异步生成器，为 None 时使用助理自身的 async_generator。
+            异步客户端绑定于事件循环，在其他事件循环中并发调用时需要传入该循环自己的生成器。
+        """
+        if not candidates:
+            return self.NO_CANDIDATES_MESSAGE, None, []
+
+        # 候选项是在该版本的索引上检索到的，写入缓存时沿用这个版本号
+        index_version = self._index_version()
+        cached = self._lookup_semantic_cache(query_vector, candidates, index_version)
+        if cached is not None:
+            return cached
+
+        # 本地重排序需要模型推理，放到线程中执行以免阻塞事件循环
+        with telemetry.span("rerank", candidates=len(candidates)):
+            reranked_candidates = await asyncio.to_thread(
+                self._rerank_without_llm, instruction, candidates, query_image, query_text, query_vector
+            )
+        if reranked_candidates is None and self.fused_mode:
+            with telemetry.span("fused_generate", candidates=len(candidates)):
+                result = await self._aanswer_fused(instruction, candidates, query_image, query_text, generator)
+            if result is not None:
+                self._store_semantic_cache(query_vector, candidates, result, index_version)
+                return result
+        if reranked_candidates is None:
+            with telemetry.span("rerank", candidates=len(candidates)):
+                reranked_candidates = await self._arerank_with_llm(instruction, candidates, query_image, query_text, generator)
+        if not reranked_candidates:
+             return self.NO_RELEVANT_MESSAGE, None, candidates
+
+        final_candidates = reranked_candidates[:self.rerank_top_k]
+        prompt = self._build_prompt(create_prompt_template, instruction, final_candidates, query_image, query_text)
+        with telemetry.span("generate", candidates=len(final_candidates)):
+            response_json_str = await (generator or self.async_generator).agenerate(prompt, response_format={"type": "json_object"})
+        result = self._parse_answer_response(response_json_str, final_candidates)
+        self._store_semantic_cache(query_vector, candidates, result, index_version)
+        return result
+
+    def answer_stream(
+        self,
+        instruction: str,
+        candidates: List[Dict[str, Any]],
+        query_image: Optional[str] = None,
+        query_text: Optional[str] = None,
+        query_vector: Optional[np.ndarray] = None
+    ) -> StreamingAnswer:
+        """
+        流式回答模式。重排序仍然同步完成，最终答案以流式方式生成。
+        返回的 StreamingAnswer 在迭代结束后给出 recommended_index。
+        流式模式不使用合并模式（fused_rerank_answer）：合并调用输出的是包含重排序结果的 JSON，
+        无法边生成边展示，因此需要LLM重排序时仍先单独重排序，再流式生成答案。
+        """
+        if not candidates:
+            return StreamingAnswer([self.NO_CANDIDATES_MESSAGE], [])
+
+        # 候选项是在该版本的索引上检索到的，写入缓存时沿用这个版本号
+        index_version = self._index_version()
+        cached = self._lookup_semantic_cache(query_vector, candidates, index_version)
+        if cached is not None:
+            answer_text, recommended_index, final_candidates = cached
+            streaming_answer = StreamingAnswer([answer_text], final_candidates)
+            streaming_answer.recommended_index = recommended_index
+            return streaming_answer
+
+        with telemetry.span("rerank", candidates=len(candidates)):
+            reranked_candidates = self._rerank(instruction, candidates, query_image, query_text, query_vector)
+        if not reranked_candidates:
+            return StreamingAnswer([self.NO_RELEVANT_MESSAGE], candidates)
+
+        final_candidates = reranked_candidates[:self.rerank_top_k]
+        prompt = self._build_prompt(create_stream_prompt_template, instruction, final_candidates, query_image, query_text)
+
+        started_at = time.perf_counter()
+
+        def on_complete(streaming_answer: StreamingAnswer):
+            # 流式生成的耗时从创建请求到流结束，包含调用方逐段渲染的时间
+            telemetry.observe("stage_seconds", time.perf_counter() - started_at, stage="generate_stream")
+            if streaming_answer.failed:
+                return
+            self._store_semantic_cache(
+                query_vector,
+                candidates,
+                (streaming_answer.answer_text, streaming_answer.recommended_index, streaming_answer.candidates),
+                index_version
+            )
+
+        return StreamingAnswer(self.generator.generate_stream(prompt), final_candidates, on_complete=on_complete)
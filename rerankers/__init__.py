@@ -0,0 +1,22 @@
+from .base import BaseReranker
+from .local_reranker import LocalEmbeddingReranker
+from encoders import BaseEncoder
+from stores import BaseVectorStore
+from typing import Dict, Any, Optional
+
+def create_reranker(config: Dict[str, Any], encoder: BaseEncoder, vector_store: BaseVectorStore) -> Optional[BaseReranker]:
+    """
+    根据配置创建重排序器实例的工厂函数。
+    类型为 'llm' 时返回 None，表示由 GenerativeAssistant 使用 LLM 重排序。
+    """
+    reranker_type = config.get("type", "llm")
+
+    if reranker_type == "local":
+        local_config = config.get("local", {})
+        return LocalEmbeddingReranker(encoder=encoder, vector_store=vector_store, **local_config)
+
+    elif reranker_type == "llm":
+        return None
+
+    else:
+        raise ValueError(f"不支持的重排序器类型: '{reranker_type}'")
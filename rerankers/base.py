@@ -0,0 +1,29 @@
+from abc import ABC, abstractmethod
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+
+class BaseReranker(ABC):
+    """
+    重排序器的抽象基类，负责在最终生成前对检索到的候选结果重新排序。
+    """
+    @abstractmethod
+    def rerank(
+        self,
+        instruction: str,
+        candidates: List[Dict[str, Any]],
+        query_image: Optional[str] = None,
+        query_text: Optional[str] = None,
+        query_vector: Optional[np.ndarray] = None
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        对候选结果重新排序。
+        :param instruction: 用户的核心指令或问题。
+        :param candidates: 从向量存储中检索到的候选项目列表。
+        :param query_image: 用户上传的查询图片路径（可选）。
+        :param query_text: 用户的文本查询（可选）。
+        :param query_vector: 检索时已编码的查询向量（可选），提供时不再重新编码查询。
+        :return: 重排序后的候选列表；无法处理当前输入时返回 None，由调用方回退到 LLM 重排。
+        """
+        pass
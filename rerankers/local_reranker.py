@@ -0,0 +1,133 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from typing import List, Dict, Any, Optional
+
+from encoders import BaseEncoder
+from stores import BaseVectorStore
+from .base import BaseReranker
+
+
+class LocalEmbeddingReranker(BaseReranker):
+    """
+    基于本地向量相似度的重排序器，不需要调用 LLM。
+
+    对每个候选项分别计算：
+    - 向量相似度：候选项在索引中的向量与查询向量的余弦相似度。索引中存储的是图片与描述的融合向量
+      （见 encoders 的 encode），查询向量同样是融合向量，因此这一项衡量的是图文整体的相似度，
+      而不是单独的图片相似度；
+    - 文本相似度：候选项描述的文本向量与查询文本向量的余弦相似度，只反映描述文本的匹配程度；
+    按权重加和后，再叠加可选的类别先验分数，按总分降序排列。
+    查询向量优先使用调用方检索时已经算好的向量；候选描述的文本向量按描述内容缓存，
+    因此每次重排序最多只需编码一次查询文本。所有计算都在候选集合上以矩阵运算完成。
+    """
+    def __init__(
+        self,
+        encoder: BaseEncoder,
+        vector_store: BaseVectorStore,
+        vector_weight: float = 0.6,
+        text_weight: float = 0.4,
+        category_priors: Optional[Dict[str, float]] = None,
+        text_fields: Optional[List[str]] = None,
+        text_cache_size: int = 8192
+    ):
+        """
+        :param encoder: 用于编码查询与候选描述的编码器。
+        :param vector_store: 用于取回候选项已存储向量的向量存储。
+        :param vector_weight: 向量（图文融合）相似度的权重。
+        :param text_weight: 描述文本相似度的权重。
+        :param category_priors: 类别前缀到加分值的映射，例如 {"risk/prohibited": 0.05}，按最长前缀匹配。
+        :param text_fields: 读取候选项描述时依次尝试的字段名。
+        :param text_cache_size: 缓存的候选描述文本向量条数。
+        """
+        self.encoder = encoder
+        self.vector_store = vector_store
+        self.vector_weight = vector_weight
+        self.text_weight = text_weight
+        self.category_priors = category_priors or {}
+        self.text_fields = text_fields or ['desc', 'description']
+        self.text_cache_size = text_cache_size
+        self._text_vectors: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._text_lock = threading.Lock()
+
+    def _candidate_text(self, item: Dict[str, Any]) -> str:
+        for field in self.text_fields:
+            value = item.get(field)
+            if isinstance(value, str) and value.strip():
+                return value
+        return ""
+
+    def _category_prior(self, category: Any) -> float:
+        if not self.category_priors or not isinstance(category, str):
+            return 0.0
+        matches = [prefix for prefix in self.category_priors if category.startswith(prefix)]
+        if not matches:
+            return 0.0
+        return float(self.category_priors[max(matches, key=len)])
+
+    def _encode_texts_cached(self, texts: List[str]) -> np.ndarray:
+        """编码文本，已缓存的描述直接复用，只对未缓存的部分批量编码。"""
+        with self._text_lock:
+            cached = {text: self._text_vectors[text] for text in texts if text in self._text_vectors}
+            for text in cached:
+                self._text_vectors.move_to_end(text)
+        missing = list(dict.fromkeys(text for text in texts if text not in cached))
+        if missing:
+            encoded = np.asarray(self.encoder.encode_texts(missing), dtype='float32')
+            with self._text_lock:
+                for text, vector in zip(missing, encoded):
+                    cached[text] = self._text_vectors[text] = vector
+                while len(self._text_vectors) > self.text_cache_size:
+                    self._text_vectors.popitem(last=False)
+        return np.stack([cached[text] for text in texts])
+
+    def _text_similarities(self, candidates: List[Dict[str, Any]], query_text_vector: np.ndarray) -> np.ndarray:
+        """计算候选描述与查询文本的相似度，没有描述的候选项相似度为 0。"""
+        texts = [self._candidate_text(item) for item in candidates]
+        similarities = np.zeros(len(candidates), dtype='float32')
+        non_empty = [i for i, text in enumerate(texts) if text]
+        if non_empty:
+            text_matrix = self._encode_texts_cached([texts[i] for i in non_empty])
+            similarities[non_empty] = text_matrix @ query_text_vector.astype('float32')
+        return similarities
+
+    def rerank(
+        self,
+        instruction: str,
+        candidates: List[Dict[str, Any]],
+        query_image: Optional[str] = None,
+        query_text: Optional[str] = None,
+        query_vector: Optional[np.ndarray] = None
+    ) -> Optional[List[Dict[str, Any]]]:
+        if not candidates:
+            return []
+        if any('id' not in item for item in candidates):
+            print("候选结果缺少 'id'，无法取回向量，本地重排序跳过。")
+            return None
+
+        if query_vector is None:
+            if query_image is None and not query_text:
+                return None
+            query_vector = self.encoder.encode(image=query_image, text=query_text)
+        query_vector = np.asarray(query_vector, dtype='float32').ravel()
+        query_vector /= max(float(np.linalg.norm(query_vector)), 1e-12)
+        text_vector = self._encode_texts_cached([query_text])[0] if query_text else None
+
+        candidate_vectors = self.vector_store.get_vectors([item['id'] for item in candidates])
+        if candidate_vectors is None:
+            print("向量存储不支持取回向量，本地重排序跳过。")
+            return None
+        candidate_vectors = np.asarray(candidate_vectors, dtype='float32')
+        # 归一化后的点积即为余弦相似度
+        candidate_vectors /= np.maximum(np.linalg.norm(candidate_vectors, axis=1, keepdims=True), 1e-12)
+
+        scores = self.vector_weight * (candidate_vectors @ query_vector)
+        total_weight = self.vector_weight
+        if text_vector is not None:
+            scores += self.text_weight * self._text_similarities(candidates, text_vector)
+            total_weight += self.text_weight
+        scores /= total_weight
+        scores += np.array([self._category_prior(item.get('category')) for item in candidates], dtype='float32')
+
+        order = np.argsort(-scores, kind='stable')
+        return [candidates[i] for i in order]
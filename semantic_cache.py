@@ -0,0 +1,130 @@
+import hashlib
+import threading
+import time
+import numpy as np
+from typing import Any, Dict, Iterable, Optional
+
+
+class SemanticAnswerCache:
+    """
+    LLM 回答的语义缓存。
+
+    以查询向量（直接复用编码器输出）加候选集合 id 作为键：
+    只有候选集合完全相同、且查询向量的余弦相似度不低于阈值时才视为命中，
+    因此同一批检索结果上的同义改写问题可以复用已有回答。
+    候选 id 是向量在索引中的位置，重建或重新加载索引后会指向不同的条目，因此索引版本变化时清空缓存。
+    条目保存在一个固定容量的本地向量矩阵中，支持 TTL，容量满时覆盖最早写入的条目。
+    """
+    def __init__(self, similarity_threshold: float = 0.95, max_entries: int = 2048, ttl_seconds: Optional[float] = 3600.0):
+        """
+        :param similarity_threshold: 命中所需的最小余弦相似度。
+        :param max_entries: 最多缓存的条目数。
+        :param ttl_seconds: 条目的存活时间（秒），为 None 或 0 时不过期。
+        """
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._vectors: Optional[np.ndarray] = None
+        self._candidate_keys = np.zeros(max_entries, dtype='int64')
+        self._created_at = np.full(max_entries, -np.inf)
+        self._values: list = [None] * max_entries
+        self._next_slot = 0
+        self._lock = threading.Lock()
+        self._index_version: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def candidate_key(candidate_ids: Iterable[Any]) -> int:
+        """将候选 id 集合映射为一个与顺序无关的 64 位整数。"""
+        joined = "\x1f".join(sorted(str(i) for i in candidate_ids))
+        return int.from_bytes(hashlib.blake2b(joined.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype='float32').ravel()
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _check_version(self, index_version: Optional[int]) -> bool:
+        """
+        索引版本更新时清空所有条目（调用方需持有锁）。
+        :return: 版本号早于当前版本（基于已被替换的旧索引）时返回 False，此时不应读写缓存。
+        """
+        if index_version is None:
+            return True
+        if self._index_version is not None:
+            if index_version < self._index_version:
+                return False
+            if index_version > self._index_version:
+                self._created_at[:] = -np.inf
+                self._values = [None] * self.max_entries
+                self._next_slot = 0
+        self._index_version = index_version
+        return True
+
+    def lookup(self, query_vector: np.ndarray, candidate_ids: Iterable[Any], index_version: Optional[int] = None) -> Optional[Any]:
+        """
+        查找语义相近且候选集合相同的已缓存回答，未命中时返回 None。
+        :param index_version: 检索候选项时向量存储的索引版本号（单调递增），比上次更新时先清空缓存。
+        """
+        query = self._normalize(query_vector)
+        key = self.candidate_key(candidate_ids)
+        with self._lock:
+            if not self._check_version(index_version) or self._vectors is None or self._vectors.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None
+            valid = self._candidate_keys == key
+            if self.ttl_seconds:
+                valid &= self._created_at >= time.monotonic() - self.ttl_seconds
+            else:
+                valid &= np.isfinite(self._created_at)
+            slots = np.flatnonzero(valid)
+            if slots.size == 0:
+                self.misses += 1
+                return None
+            similarities = self._vectors[slots] @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self._values[slots[best]]
+
+    def store(self, query_vector: np.ndarray, candidate_ids: Iterable[Any], value: Any, index_version: Optional[int] = None):
+        """
+        写入一条回答，容量满时覆盖最早写入的条目。
+        :param index_version: 检索候选项时的索引版本号（单调递增），早于当前版本时不写入。
+        """
+        query = self._normalize(query_vector)
+        key = self.candidate_key(candidate_ids)
+        with self._lock:
+            if not self._check_version(index_version):
+                return
+            if self._vectors is None or self._vectors.shape[1] != query.shape[0]:
+                # 首次写入或向量维度变化（例如更换了编码器）时重新分配
+                self._vectors = np.zeros((self.max_entries, query.shape[0]), dtype='float32')
+                self._created_at[:] = -np.inf
+                self._values = [None] * self.max_entries
+                self._next_slot = 0
+            slot = self._next_slot
+            self._vectors[slot] = query
+            self._candidate_keys[slot] = key
+            self._created_at[slot] = time.monotonic()
+            self._values[slot] = value
+            self._next_slot = (slot + 1) % self.max_entries
+
+    def clear(self):
+        """清空所有已缓存的条目。"""
+        with self._lock:
+            self._created_at[:] = -np.inf
+            self._values = [None] * self.max_entries
+            self._next_slot = 0
+
+    def stats(self) -> Dict[str, int]:
+        """返回缓存命中情况的统计信息。"""
+        with self._lock:
+            return {
+                "entries": int(np.isfinite(self._created_at).sum()),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
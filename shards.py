@@ -0,0 +1,166 @@
+"""
+分布式分片构建与合并。
+
+每台机器运行 `python index_data.py --partition i/N --shard_dir <共享目录>`，只编码行号对 N 取模等于 i 的数据，
+并在共享目录中写出一个自包含的 Faiss 分片（索引 + 元数据 + 完成标记）。全部分片完成后：
+
+    python shards.py merge --shard_dir <共享目录>      # 合并为一个服务用的 Faiss 索引
+    python shards.py register --shard_dir <共享目录>   # 或生成分片清单，由 faiss_shards 存储直接加载
+"""
+import json
+import os
+from typing import Any, Dict, List, Tuple
+
+import faiss
+import yaml
+
+from checkpoint import atomic_write_json
+
+
+def parse_partition(spec: str) -> Tuple[int, int]:
+    """解析形如 "i/N" 的分区参数，返回 (i, N)，其中 0 <= i < N。"""
+    try:
+        index, count = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError(f"分区参数格式应为 i/N，例如 0/8，实际为: '{spec}'")
+    if count <= 0 or not 0 <= index < count:
+        raise ValueError(f"分区编号超出范围: '{spec}'，要求 0 <= i < N。")
+    return index, count
+
+
+def shard_paths(shard_dir: str, index: int, count: int) -> Dict[str, str]:
+    """返回第 index 个分片（共 count 个）的各个文件路径。"""
+    prefix = os.path.join(shard_dir, f"shard-{index:05d}-of-{count:05d}")
+    return {
+        'index_path': prefix + ".index",
+        'metadata_path': prefix + ".meta.json",
+        'checkpoint_path': prefix + ".checkpoint.json",
+        'failed_rows_path': prefix + ".failed.jsonl",
+        'done_path': prefix + ".done.json",
+    }
+
+
+def write_shard_done(shard_dir: str, index: int, count: int, data_path: str, vectors: int, dimension: int, failed_rows: int):
+    """分片构建完成后写入完成标记，合并时据此确认分片完整。"""
+    paths = shard_paths(shard_dir, index, count)
+    atomic_write_json(paths['done_path'], {
+        'shard': index,
+        'num_shards': count,
+        'data_path': os.path.abspath(data_path),
+        'vectors': vectors,
+        'dimension': dimension,
+        'failed_rows': failed_rows,
+        'index_path': os.path.basename(paths['index_path']),
+        'metadata_path': os.path.basename(paths['metadata_path']),
+    })
+
+
+def clear_shard_done(shard_dir: str, index: int, count: int):
+    """删除分片的完成标记。重建分片前调用，避免合并时把构建中的分片当作已完成。"""
+    done_path = shard_paths(shard_dir, index, count)['done_path']
+    if os.path.exists(done_path):
+        os.remove(done_path)
+
+
+def load_completed_shards(shard_dir: str) -> List[Dict[str, Any]]:
+    """
+    读取共享目录中所有分片的完成标记，按分片编号排序返回。
+    分片数不一致或有分片尚未完成时抛出异常，避免合并出不完整的索引。
+    """
+    manifests = []
+    for name in sorted(os.listdir(shard_dir)):
+        if name.endswith(".done.json"):
+            with open(os.path.join(shard_dir, name), 'r', encoding='utf-8') as f:
+                manifests.append(json.load(f))
+    if not manifests:
+        raise FileNotFoundError(f"{shard_dir} 中没有已完成的分片。")
+    counts = {m['num_shards'] for m in manifests}
+    if len(counts) != 1:
+        raise ValueError(f"{shard_dir} 中混有不同分片数的构建结果: {sorted(counts)}")
+    count = counts.pop()
+    missing = sorted(set(range(count)) - {m['shard'] for m in manifests})
+    if missing:
+        raise ValueError(f"共 {count} 个分片，以下分片尚未完成: {missing}")
+    dimensions = {m['dimension'] for m in manifests}
+    if len(dimensions) != 1:
+        raise ValueError(f"各分片的向量维度不一致: {sorted(dimensions)}")
+    return sorted(manifests, key=lambda m: m['shard'])
+
+
+def merge_shards(shard_dir: str, index_path: str, metadata_path: str) -> int:
+    """
+    将全部分片按编号顺序合并为一个 Faiss 索引。
+    IndexFlat 的 id 即向量在索引中的位置，merge_from 按顺序追加，元数据按相同顺序拼接，
+    因此每个分片的 id 自动以前面分片的向量总数为基准重新编号。
+    :return: 合并后的向量总数。
+    """
+    from stores.faiss_store import FaissVectorStore, current_faiss_paths
+
+    manifests = load_completed_shards(shard_dir)
+    store = FaissVectorStore(index_path=index_path, metadata_path=metadata_path, dimension=manifests[0]['dimension'])
+    store.delete_collection()
+    for manifest in manifests:
+        index_file, metadata_file = current_faiss_paths(
+            os.path.join(shard_dir, manifest['index_path']), os.path.join(shard_dir, manifest['metadata_path'])
+        )
+        shard_index = faiss.read_index(index_file)
+        with open(metadata_file, 'r', encoding='utf-8') as f:
+            shard_metadata = json.load(f)
+        if shard_index.ntotal != len(shard_metadata):
+            raise ValueError(f"分片 {manifest['shard']} 的向量数 ({shard_index.ntotal}) 与元数据条数 ({len(shard_metadata)}) 不一致。")
+        # merge_from 会把向量从分片索引中移走
+        store.index.merge_from(shard_index)
+        store.metadata.extend(shard_metadata)
+        print(f"已合并分片 {manifest['shard']}：{len(shard_metadata)} 条向量。")
+    store.build_index()
+    return store.index.ntotal
+
+
+def register_shards(shard_dir: str, manifest_path: str) -> int:
+    """
+    不合并数据，只生成分片清单，供 faiss_shards 类型的向量存储直接加载所有分片提供检索。
+    :return: 所有分片的向量总数。
+    """
+    manifests = load_completed_shards(shard_dir)
+    shard_dir = os.path.abspath(shard_dir)
+    atomic_write_json(manifest_path, {
+        'dimension': manifests[0]['dimension'],
+        'shards': [
+            {
+                'index_path': os.path.join(shard_dir, m['index_path']),
+                'metadata_path': os.path.join(shard_dir, m['metadata_path']),
+                'vectors': m['vectors'],
+            }
+            for m in manifests
+        ],
+    })
+    return sum(m['vectors'] for m in manifests)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="合并或注册分布式构建的 Faiss 分片")
+    parser.add_argument("command", choices=["merge", "register"], help="merge: 合并为单个索引; register: 生成分片清单")
+    parser.add_argument("--config_path", type=str, default="configs/config.yaml", help="配置文件的路径")
+    parser.add_argument("--shard_dir", type=str, default=None, help="分片所在的共享目录，默认使用配置 indexing.shard_dir")
+    parser.add_argument("--index_path", type=str, default=None, help="merge 的输出索引路径，默认使用配置 vector_store.faiss.index_path")
+    parser.add_argument("--metadata_path", type=str, default=None, help="merge 的输出元数据路径，默认使用配置 vector_store.faiss.metadata_path")
+    parser.add_argument("--manifest_path", type=str, default=None, help="register 的输出清单路径，默认使用配置 vector_store.faiss_shards.manifest_path")
+    args = parser.parse_args()
+
+    with open(args.config_path, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    shard_dir = args.shard_dir or config.get('indexing', {}).get('shard_dir', 'faiss_data/shards')
+
+    if args.command == "merge":
+        faiss_config = config['vector_store'].get('faiss', {})
+        total = merge_shards(
+            shard_dir,
+            args.index_path or faiss_config['index_path'],
+            args.metadata_path or faiss_config['metadata_path']
+        )
+        print(f"✅ 分片合并完成，共 {total} 条向量。")
+    else:
+        manifest_path = args.manifest_path or config['vector_store'].get('faiss_shards', {}).get('manifest_path', os.path.join(shard_dir, 'shards.json'))
+        total = register_shards(shard_dir, manifest_path)
+        print(f"✅ 分片清单已写入 {manifest_path}，共 {total} 条向量。将 vector_store.type 设为 faiss_shards 即可加载。")
@@ -1,6 +1,9 @@
-from .base import BaseVectorStore
+from .base import BaseVectorStore, StaleIndexError, similarity_from_distance
 from .faiss_store import FaissVectorStore
 from .milvus_store import MilvusVectorStore
+from .faiss_sharded_store import ShardedFaissVectorStore
+from .faiss_partitioned_store import PartitionedFaissVectorStore
+import copy
 from typing import Dict, Any
 
 def create_vector_store(config: Dict[str, Any]) -> BaseVectorStore:
@@ -15,9 +18,43 @@ def create_vector_store(config: Dict[str, Any]) -> BaseVectorStore:
             raise ValueError("Faiss 配置不完整，缺少 index_path, metadata_path, 或 dimension。")
         return FaissVectorStore(**faiss_config)
         
+    elif store_type == "faiss_shards":
+        shards_config = config.get("faiss_shards", {})
+        if not all(k in shards_config for k in ["manifest_path", "dimension"]):
+            raise ValueError("Faiss 分片配置不完整，缺少 manifest_path 或 dimension。")
+        return ShardedFaissVectorStore(**shards_config)
+
+    elif store_type == "faiss_partitioned":
+        partitioned_config = config.get("faiss_partitioned", {})
+        if not all(k in partitioned_config for k in ["root_dir", "dimension"]):
+            raise ValueError("Faiss 分区索引配置不完整，缺少 root_dir 或 dimension。")
+        return PartitionedFaissVectorStore(**partitioned_config)
+
     elif store_type == "milvus":
         milvus_config = config.get("milvus", {})
         return MilvusVectorStore(**milvus_config)
         
     else:
-        raise ValueError(f"不支持的向量存储类型: '{store_type}'") 
\ No newline at end of file
+        raise ValueError(f"不支持的向量存储类型: '{store_type}'") 
+
+
+def staging_vector_store_config(config: Dict[str, Any], suffix: str = "staging") -> Dict[str, Any]:
+    """
+    返回与 config 同类型、但写入暂存位置的向量存储配置。后台任务先在暂存索引上构建，
+    完成后再通过 promote 替换正式索引，构建期间检索仍使用原有索引。
+    """
+    store_type = config.get("type")
+    staging = copy.deepcopy(config)
+    if store_type == "faiss":
+        section = staging.setdefault("faiss", {})
+        section["index_path"] = f"{section['index_path']}.{suffix}"
+        section["metadata_path"] = f"{section['metadata_path']}.{suffix}"
+    elif store_type == "faiss_partitioned":
+        section = staging.setdefault("faiss_partitioned", {})
+        section["root_dir"] = f"{section['root_dir'].rstrip('/')}.{suffix}"
+    elif store_type == "milvus":
+        section = staging.setdefault("milvus", {})
+        section["collection_name"] = f"{section['collection_name']}_{suffix}"
+    else:
+        raise ValueError(f"向量存储类型 '{store_type}' 不支持暂存构建。")
+    return staging
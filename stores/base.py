@@ -1,11 +1,47 @@
+import os
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 import numpy as np
 
+
+class StaleIndexError(RuntimeError):
+    """磁盘上的索引已被其他进程替换（例如后台索引任务提交了新索引），内存中的旧索引不能再写回磁盘。"""
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    """文件的 (inode, 修改时间, 大小)，用于判断文件是否被其他进程替换；文件不存在时返回 None。"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def similarity_from_distance(distance: Optional[float]) -> Optional[float]:
+    """将检索结果中归一化向量之间的平方 L2 距离换算为余弦相似度，没有距离时返回 None。"""
+    if distance is None:
+        return None
+    return 1.0 - float(distance) / 2.0
+
+
 class BaseVectorStore(ABC):
     """
     所有向量存储实现的抽象基类。
     """
+    # 索引版本号，每次 add / build_index / delete_collection 后递增，用于使上层缓存失效。
+    _index_version: int = 0
+    # 是否实现了 truncate（按写入顺序丢弃末尾的向量）；index_data.py --resume 依赖它丢弃检查点之后写入的数据
+    supports_truncate: bool = False
+
+    @property
+    def index_version(self) -> int:
+        """当前索引的版本号。"""
+        return self._index_version
+
+    def _bump_version(self):
+        """在索引内容发生变化后调用，递增版本号。"""
+        self._index_version += 1
+
     @abstractmethod
     def add(self, vectors: List[np.ndarray], metadata: List[Dict[str, Any]], **kwargs):
         """
@@ -26,6 +62,70 @@ class BaseVectorStore(ABC):
         """
         pass
     
+    def search_batch(
+        self,
+        vectors: List[np.ndarray],
+        top_k: int,
+        output_fields: Optional[List[str]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        一次检索多个查询向量，返回与 vectors 顺序一致的结果列表，每个候选项附带 'distance'。
+        默认逐条调用 search；支持矩阵检索的存储应覆盖该方法，用一次调用完成整批检索。
+        """
+        return [self.search(vector=vector, top_k=top_k, output_fields=output_fields) for vector in vectors]
+
+    def get_vectors(self, ids: List[int]) -> Optional[np.ndarray]:
+        """
+        根据 search 结果中的 'id' 取回已存储的向量，返回形状为 (len(ids), dim) 的矩阵。
+        不支持取回向量的存储返回 None。
+        """
+        return None
+
+    def iter_vectors(self, batch_size: int = 4096) -> Iterator[Tuple[np.ndarray, List[Dict[str, Any]]]]:
+        """
+        按批遍历已存储的全部向量，每批产出 (向量矩阵, 元数据列表)，用于建立索引后的统计（例如类别质心）。
+        """
+        raise NotImplementedError(f"{type(self).__name__} 不支持遍历向量。")
+
+    def upsert(self, vectors: List[np.ndarray], metadata: List[Dict[str, Any]], key_field: str = 'row_id'):
+        """
+        按元数据中的 key_field 更新或插入向量：已存在相同键的条目被原地替换，不存在的被追加。
+        用于只重新编码被修改过的数据，而无需重建整个索引。
+        """
+        raise NotImplementedError(f"{type(self).__name__} 不支持按键更新。")
+
+    def count(self) -> Optional[int]:
+        """
+        返回已存储的向量数量，无法获取时返回 None。
+        """
+        return None
+
+    def checkpoint(self):
+        """
+        将目前已添加的数据持久化，使进程中断后可以从该状态恢复。对于写入即持久化的数据库可能是空操作。
+        """
+        pass
+
+    def truncate(self, count: int):
+        """
+        只保留最先添加的 count 条向量，用于从检查点恢复时丢弃检查点之后写入的数据。
+        实现了该方法的子类需要同时将 supports_truncate 设为 True。
+        """
+        raise NotImplementedError(f"{type(self).__name__} 不支持截断。")
+
+    def promote(self, target: Dict[str, Any]):
+        """
+        用当前索引整体替换 target 描述的正式索引，用于后台任务在暂存索引上构建完成后一次性提交。
+        :param target: 正式索引的配置段（与构造参数相同，例如 faiss 段或 milvus 段）。
+        """
+        raise NotImplementedError(f"{type(self).__name__} 不支持提交暂存索引。")
+
+    def reload(self):
+        """
+        重新加载持久化的索引，例如另一个进程提交了新的索引之后。
+        """
+        self._bump_version()
+
     @abstractmethod
     def delete_collection(self):
         """
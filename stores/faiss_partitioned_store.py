@@ -0,0 +1,435 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import faiss
+import numpy as np
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+from .base import BaseVectorStore, StaleIndexError, file_signature
+
+UNCATEGORIZED_PARTITION = '_uncategorized'
+
+
+class _Partition:
+    """一个类别子树的子索引：向量、元数据、全局 id 以及用于计算质心的向量和。"""
+    def __init__(self, name: str, dimension: int):
+        self.name = name
+        slug = re.sub(r'[^0-9A-Za-z_.-]+', '_', name)[:48]
+        self.slug = f"{slug}-{hashlib.md5(name.encode('utf-8')).hexdigest()[:8]}"
+        self.index = faiss.IndexFlatL2(dimension)
+        self.metadata: List[Dict[str, Any]] = []
+        self.ids = np.empty(0, dtype='int64')
+        self.vector_sum = np.zeros(dimension, dtype='float64')
+        # dirty: 向量或元数据有变化；ids_dirty: 只有全局 id 被重新编号
+        self.dirty = True
+        self.ids_dirty = True
+
+    def add(self, vectors: np.ndarray, metadata: List[Dict[str, Any]], ids: np.ndarray):
+        self.index.add(vectors)
+        self.metadata.extend(metadata)
+        self.ids = np.concatenate([self.ids, ids])
+        self.vector_sum += _normalize(vectors).sum(axis=0)
+        self.dirty = True
+
+    def remove(self, positions: np.ndarray):
+        """删除子索引中指定位置的向量，其余向量保持原有顺序。"""
+        if len(positions) == 0:
+            return
+        self.vector_sum -= _normalize(self.index.reconstruct_batch(positions)).sum(axis=0)
+        self.index.remove_ids(faiss.IDSelectorBatch(positions.astype('int64')))
+        keep = np.ones(len(self.metadata), dtype=bool)
+        keep[positions] = False
+        self.metadata = [item for item, kept in zip(self.metadata, keep) if kept]
+        self.ids = self.ids[keep]
+        self.dirty = True
+
+    def centroid(self) -> np.ndarray:
+        return (self.vector_sum / max(float(np.linalg.norm(self.vector_sum)), 1e-12)).astype('float32')
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+class PartitionedFaissVectorStore(BaseVectorStore):
+    """
+    按类别层级分区的 Faiss 存储：每个类别子树（类别路径的前 partition_depth 段，例如 risk/prohibited）
+    一个子索引，另有一个由各分区归一化质心组成的小索引用于路由。
+    检索时先用质心索引选出最相关的 nprobe 个分区，只在这些分区中检索后合并结果，
+    扫描量约为全部数据的 nprobe / 分区数。nprobe 不小于分区数时结果与平坦索引完全一致。
+    全局 id 按添加顺序连续编号，与 FaissVectorStore 的语义相同（支持 get_vectors、truncate 与检查点续传）；
+    drop_partition 之后其余向量的 id 会重新编号；upsert 改变了条目所属的分区时，条目移到新分区，id 不变。单个分区可以通过 index_data.py --rebuild_category 独立重建。
+
+    目录结构：<root_dir>/manifest.json 以及 <root_dir>/partitions/ 下每个分区的 .index / .meta.json / .ids.npy。
+    """
+    supports_truncate = True
+
+    def __init__(self, root_dir: str, dimension: int, partition_depth: int = 2, nprobe: int = 2, category_field: str = 'category', **kwargs):
+        """
+        :param root_dir: 存储目录。
+        :param dimension: 向量维度。
+        :param partition_depth: 取类别路径的前几段作为分区，例如 2 时 risk/prohibited/firearms 属于 risk/prohibited 分区。
+        :param nprobe: 每次检索访问的分区数。
+        :param category_field: 元数据中的类别字段。
+        """
+        self.root_dir = root_dir
+        self.dimension = dimension
+        self.partition_depth = partition_depth
+        self.nprobe = nprobe
+        self.category_field = category_field
+        self._lock = threading.RLock()
+        self._load()
+
+    @property
+    def _manifest_path(self) -> str:
+        return os.path.join(self.root_dir, "manifest.json")
+
+    def _partition_path(self, partition: _Partition, suffix: str) -> str:
+        return os.path.join(self.root_dir, "partitions", partition.slug + suffix)
+
+    def partition_for(self, category: Any) -> str:
+        """返回类别所属的分区名，没有类别的数据归入 _uncategorized。"""
+        category = str(category or '').strip().strip('/')
+        if not category:
+            return UNCATEGORIZED_PARTITION
+        return '/'.join(category.split('/')[:self.partition_depth])
+
+    def _load(self):
+        """加载分区清单与各分区，不存在时创建空的存储。"""
+        self.partitions: Dict[str, _Partition] = {}
+        self._removed_slugs: List[str] = []
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest['dimension'] != self.dimension:
+                raise ValueError(f"分区索引维度 ({manifest['dimension']}) 与配置 ({self.dimension}) 不符。")
+            if manifest.get('partition_depth', self.partition_depth) != self.partition_depth:
+                print(f"警告: 分区索引按 {manifest['partition_depth']} 段类别建立，与配置 ({self.partition_depth}) 不符，将沿用已有的分区方式。")
+                self.partition_depth = manifest['partition_depth']
+            for name in manifest['partitions']:
+                partition = _Partition(name, self.dimension)
+                partition.index = faiss.read_index(self._partition_path(partition, ".index"))
+                with open(self._partition_path(partition, ".meta.json"), 'r', encoding='utf-8') as f:
+                    partition.metadata = json.load(f)
+                partition.ids = np.load(self._partition_path(partition, ".ids.npy"))
+                if partition.index.ntotal:
+                    partition.vector_sum = _normalize(partition.index.reconstruct_n(0, partition.index.ntotal)).sum(axis=0).astype('float64')
+                partition.dirty = partition.ids_dirty = False
+                self.partitions[name] = partition
+        # 最近一次加载或保存时分区清单的签名，保存前据此判断存储目录是否已被替换
+        self._disk_signature = file_signature(self._manifest_path)
+        self._rebuild_locations()
+
+    def _rebuild_locations(self):
+        """根据各分区的全局 id 重建 id -> (分区槽位, 分区内位置) 的映射以及质心路由索引。"""
+        self._slots = [partition for partition in self.partitions.values() if partition.index.ntotal > 0]
+        self._count = max((int(p.ids.max()) + 1 for p in self._slots), default=0)
+        self._key_ids: Dict[str, Dict[Any, int]] = {}
+        # 进程在写检查点的中途被终止时，个别分区可能领先于其他分区，缺失的 id 标记为 -1，由 truncate 清理
+        self._locations = np.full((max(self._count, 1024), 2), -1, dtype='int64')
+        for slot, partition in enumerate(self._slots):
+            self._locations[partition.ids, 0] = slot
+            self._locations[partition.ids, 1] = np.arange(len(partition.ids))
+        self._rebuild_routing()
+
+    def _rebuild_routing(self):
+        self._routing = faiss.IndexFlatIP(self.dimension)
+        if self._slots:
+            self._routing.add(np.stack([partition.centroid() for partition in self._slots]))
+
+    def _append_locations(self, slot: int, positions: np.ndarray, ids: np.ndarray):
+        if ids[-1] >= len(self._locations):
+            # 容量翻倍，批量写入时均摊为常数开销
+            grown = np.full((max(2 * len(self._locations), int(ids[-1]) + 1), 2), -1, dtype='int64')
+            grown[:len(self._locations)] = self._locations
+            self._locations = grown
+        self._locations[ids, 0] = slot
+        self._locations[ids, 1] = positions
+
+    def _save(self, force: bool = False):
+        """
+        保存有变化的分区，最后写入分区清单。每个文件先写入临时文件再替换。
+        :param force: 为 False 时，如果存储目录在加载之后被其他进程替换（例如后台索引任务提交了新索引），
+            抛出 StaleIndexError 而不是把内存中的旧分区写进新目录；需要先调用 reload。
+        """
+        if not force and file_signature(self._manifest_path) != self._disk_signature:
+            raise StaleIndexError(f"{self.root_dir} 已被其他进程更新，请先重新加载索引。")
+        print(f"正在保存分区索引到 {self.root_dir}")
+        os.makedirs(os.path.join(self.root_dir, "partitions"), exist_ok=True)
+        for partition in self.partitions.values():
+            if partition.dirty:
+                faiss.write_index(partition.index, self._partition_path(partition, ".index.tmp"))
+                os.replace(self._partition_path(partition, ".index.tmp"), self._partition_path(partition, ".index"))
+                with open(self._partition_path(partition, ".meta.json.tmp"), 'w', encoding='utf-8') as f:
+                    json.dump(partition.metadata, f, ensure_ascii=False, indent=2)
+                os.replace(self._partition_path(partition, ".meta.json.tmp"), self._partition_path(partition, ".meta.json"))
+            if partition.dirty or partition.ids_dirty:
+                with open(self._partition_path(partition, ".ids.npy.tmp"), 'wb') as f:
+                    np.save(f, partition.ids)
+                os.replace(self._partition_path(partition, ".ids.npy.tmp"), self._partition_path(partition, ".ids.npy"))
+                partition.dirty = partition.ids_dirty = False
+        manifest = {
+            'dimension': self.dimension,
+            'partition_depth': self.partition_depth,
+            'count': self._count,
+            'partitions': {name: {'vectors': p.index.ntotal} for name, p in self.partitions.items()},
+        }
+        with open(self._manifest_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(self._manifest_path + ".tmp", self._manifest_path)
+        self._disk_signature = file_signature(self._manifest_path)
+        # 清单更新之后再删除已清空的分区文件（清空后又重新写入的分区除外）
+        live_slugs = {partition.slug for partition in self.partitions.values()}
+        for slug in set(self._removed_slugs) - live_slugs:
+            for suffix in (".index", ".meta.json", ".ids.npy"):
+                path = os.path.join(self.root_dir, "partitions", slug + suffix)
+                if os.path.exists(path):
+                    os.remove(path)
+        self._removed_slugs = []
+
+    def _add_to_partitions(self, vectors: np.ndarray, metadata: List[Dict[str, Any]], ids: np.ndarray):
+        """按类别把向量写入各分区并记录位置（调用方需持有锁，并在之后重建路由索引）。"""
+        names = [self.partition_for(item.get(self.category_field)) for item in metadata]
+        for name in dict.fromkeys(names):
+            rows = [i for i, n in enumerate(names) if n == name]
+            partition = self.partitions.get(name)
+            if partition is None:
+                partition = self.partitions[name] = _Partition(name, self.dimension)
+            if partition.index.ntotal == 0:
+                self._slots.append(partition)
+            start = partition.index.ntotal
+            partition.add(vectors[rows], [metadata[i] for i in rows], ids[rows])
+            self._append_locations(self._slots.index(partition), np.arange(start, partition.index.ntotal), ids[rows])
+        for key_field, key_ids in self._key_ids.items():
+            key_ids.update((item[key_field], int(i)) for item, i in zip(metadata, ids) if key_field in item)
+
+    def add(self, vectors: List[np.ndarray], metadata: List[Dict[str, Any]], **kwargs):
+        if len(vectors) == 0:
+            return
+        vectors_np = np.array(vectors, dtype='float32')
+        with self._lock:
+            self._add_to_partitions(vectors_np, metadata, np.arange(self._count, self._count + len(vectors_np), dtype='int64'))
+            self._count += len(vectors_np)
+            self._rebuild_routing()
+        self._bump_version()
+
+    def _ids_by_key(self, key_field: str) -> Dict[Any, int]:
+        """键到全局 id 的映射，首次使用时扫描一遍元数据，之后随写入增量维护。"""
+        key_ids = self._key_ids.get(key_field)
+        if key_ids is None:
+            key_ids = {}
+            for partition in self.partitions.values():
+                key_ids.update((item[key_field], int(i)) for item, i in zip(partition.metadata, partition.ids) if key_field in item)
+            self._key_ids[key_field] = key_ids
+        return key_ids
+
+    def upsert(self, vectors: List[np.ndarray], metadata: List[Dict[str, Any]], key_field: str = 'row_id'):
+        """
+        按键更新或插入。类别仍属于同一分区的条目在分区内原地替换；
+        类别改到其他分区的条目从原分区移到新分区，全局 id 保持不变；新的键追加到末尾。
+        """
+        if len(vectors) == 0:
+            return
+        vectors_np = np.array(vectors, dtype='float32')
+        # 同一批中重复的键只保留最后一条
+        rows = list({item[key_field]: row for row, item in enumerate(metadata)}.values())
+        with self._lock:
+            key_ids = self._ids_by_key(key_field)
+            new_rows, moved_rows, moved_ids = [], [], []
+            for row in rows:
+                item = metadata[row]
+                global_id = key_ids.get(item[key_field])
+                if global_id is None:
+                    new_rows.append(row)
+                    continue
+                slot, position = (int(v) for v in self._locations[global_id])
+                partition = self._slots[slot]
+                if partition.name != self.partition_for(item.get(self.category_field)):
+                    moved_rows.append(row)
+                    moved_ids.append(global_id)
+                    continue
+                # IndexFlat 的向量连续存放，可以直接原地覆盖
+                stored = faiss.rev_swig_ptr(partition.index.get_xb(), partition.index.ntotal * self.dimension).reshape(partition.index.ntotal, self.dimension)
+                partition.vector_sum += (_normalize(vectors_np[row:row + 1]) - _normalize(stored[position:position + 1]))[0]
+                stored[position] = vectors_np[row]
+                partition.metadata[position] = item
+                partition.dirty = True
+            if moved_rows:
+                moved_ids = np.array(moved_ids, dtype='int64')
+                locations = self._locations[moved_ids]
+                for slot, partition in enumerate(self._slots):
+                    partition.remove(np.sort(locations[locations[:, 0] == slot, 1]))
+                for name, partition in list(self.partitions.items()):
+                    if partition.index.ntotal == 0:
+                        self._removed_slugs.append(partition.slug)
+                        del self.partitions[name]
+                # 原分区中后续向量的位置已前移，先按剩余数据重建位置映射，再写入新分区
+                self._rebuild_locations()
+                self._add_to_partitions(vectors_np[moved_rows], [metadata[row] for row in moved_rows], moved_ids)
+            if new_rows:
+                self._add_to_partitions(vectors_np[new_rows], [metadata[row] for row in new_rows],
+                                        np.arange(self._count, self._count + len(new_rows), dtype='int64'))
+                self._count += len(new_rows)
+            self._rebuild_routing()
+        self._bump_version()
+
+    def _remove(self, ids: np.ndarray):
+        """删除指定全局 id 的向量，其余向量按原有顺序重新连续编号。"""
+        ids = np.unique(ids[(ids >= 0) & (ids < self._count)])
+        if len(ids) == 0:
+            return
+        locations = self._locations[ids]
+        for slot, partition in enumerate(self._slots):
+            partition.remove(np.sort(locations[locations[:, 0] == slot, 1]))
+        if ids[-1] != self._count - 1 or len(ids) != self._count - ids[0]:
+            # 不是只删除末尾的向量时，后面的 id 需要前移
+            for partition in self.partitions.values():
+                if len(partition.ids):
+                    partition.ids = partition.ids - np.searchsorted(ids, partition.ids)
+                    partition.ids_dirty = True
+        for name, partition in list(self.partitions.items()):
+            if partition.index.ntotal == 0:
+                self._removed_slugs.append(partition.slug)
+                del self.partitions[name]
+        self._rebuild_locations()
+
+    def drop_partition(self, name: str):
+        """清空一个分区（例如该类别的规则变化后重建），其余分区不受影响，但向量 id 会重新编号。"""
+        with self._lock:
+            partition = self.partitions.get(name)
+            if partition is None:
+                return
+            print(f"正在清空分区 '{name}'（{partition.index.ntotal} 条向量）...")
+            self._remove(partition.ids.copy())
+        self._bump_version()
+
+    def partition_stats(self) -> Dict[str, int]:
+        """各分区的向量数。"""
+        with self._lock:
+            return {name: partition.index.ntotal for name, partition in self.partitions.items()}
+
+    def _route(self, queries: np.ndarray, nprobe: int) -> np.ndarray:
+        """返回每个查询要访问的分区槽位，形状为 (len(queries), min(nprobe, 分区数))。"""
+        if nprobe >= len(self._slots):
+            return np.tile(np.arange(len(self._slots)), (len(queries), 1))
+        _, slots = self._routing.search(_normalize(queries), nprobe)
+        return slots
+
+    def search(
+        self,
+        vector: np.ndarray,
+        top_k: int,
+        output_fields: Optional[List[str]] = None,
+        nprobe: Optional[int] = None,
+        **kwargs
+    ) -> List[Dict[str, Any]]:
+        return self.search_batch([vector], top_k, output_fields=output_fields, nprobe=nprobe)[0]
+
+    def search_batch(
+        self,
+        vectors: List[np.ndarray],
+        top_k: int,
+        output_fields: Optional[List[str]] = None,
+        nprobe: Optional[int] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        :param nprobe: 本次检索访问的分区数，默认使用构造参数。
+        """
+        if len(vectors) == 0:
+            return []
+        queries = np.asarray(vectors, dtype='float32').reshape(len(vectors), self.dimension)
+        with self._lock:
+            if not self._slots:
+                return [[] for _ in range(len(queries))]
+            routes = self._route(queries, nprobe or self.nprobe)
+            hits: List[List[Tuple[float, int, int]]] = [[] for _ in range(len(queries))]
+            # 按分区合批：访问同一分区的查询只调用一次子索引的 search
+            for slot in np.unique(routes):
+                rows = np.flatnonzero((routes == slot).any(axis=1))
+                partition = self._slots[slot]
+                distances, positions = partition.index.search(queries[rows], min(top_k, partition.index.ntotal))
+                for row, row_distances, row_positions in zip(rows, distances, positions):
+                    hits[row].extend((float(d), int(slot), int(p)) for d, p in zip(row_distances, row_positions) if p != -1)
+            results = []
+            for row_hits in hits:
+                row_hits.sort(key=lambda hit: hit[0])
+                results.append([
+                    dict(self._slots[slot].metadata[p], id=int(self._slots[slot].ids[p]), distance=d)
+                    for d, slot, p in row_hits[:top_k]
+                ])
+        return results
+
+    def get_vectors(self, ids: List[int]) -> Optional[np.ndarray]:
+        vectors = np.empty((len(ids), self.dimension), dtype='float32')
+        with self._lock:
+            for row, i in enumerate(ids):
+                slot, position = self._locations[i] if 0 <= i < self._count else (-1, -1)
+                if slot == -1:
+                    raise KeyError(f"向量 id {i} 不存在。")
+                vectors[row] = self._slots[slot].index.reconstruct(int(position))
+        return vectors
+
+    def iter_vectors(self, batch_size: int = 4096) -> Iterator[Tuple[np.ndarray, List[Dict[str, Any]]]]:
+        for partition in list(self.partitions.values()):
+            for start in range(0, partition.index.ntotal, batch_size):
+                with self._lock:
+                    end = min(start + batch_size, partition.index.ntotal)
+                    batch = partition.index.reconstruct_n(start, end - start), partition.metadata[start:end]
+                yield batch
+
+    def count(self) -> Optional[int]:
+        return self._count
+
+    def checkpoint(self):
+        with self._lock:
+            self._save()
+
+    def truncate(self, count: int):
+        if count >= self._count:
+            return
+        with self._lock:
+            self._remove(np.arange(count, self._count, dtype='int64'))
+        self._bump_version()
+
+    def build_index(self):
+        with self._lock:
+            self._save()
+        self._bump_version()
+        print(f"分区索引已成功保存：{len(self.partitions)} 个分区，共 {self.count()} 条向量。")
+
+    def delete_collection(self):
+        print("正在删除旧的分区索引...")
+        with self._lock:
+            if os.path.exists(self.root_dir):
+                shutil.rmtree(self.root_dir)
+            self.partitions = {}
+            self._removed_slugs = []
+            self._rebuild_locations()
+            self._save(force=True)
+        self._bump_version()
+
+    def promote(self, target: Dict[str, Any]):
+        with self._lock:
+            self._save()
+            target_dir = target['root_dir']
+            if os.path.exists(target_dir + ".old"):
+                shutil.rmtree(target_dir + ".old")
+            # 先移走旧目录再改名，两次重命名之间检索进程读到的是旧的内存副本
+            if os.path.exists(target_dir):
+                os.replace(target_dir, target_dir + ".old")
+            os.replace(self.root_dir, target_dir)
+            if os.path.exists(target_dir + ".old"):
+                shutil.rmtree(target_dir + ".old")
+        print(f"暂存索引已提交到 {target_dir}")
+
+    def reload(self):
+        with self._lock:
+            self._load()
+        self._bump_version()
+
+    def release(self):
+        self.partitions = {}
+        self._slots = []
+        print("分区索引已从内存中释放。")
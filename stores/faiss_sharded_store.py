@@ -0,0 +1,103 @@
+import bisect
+import json
+import faiss
+import numpy as np
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+from .base import BaseVectorStore
+from .faiss_store import current_faiss_paths
+
+class ShardedFaissVectorStore(BaseVectorStore):
+    """
+    直接加载分布式构建的多个 Faiss 分片（见 shards.py register）提供检索，无需合并。
+    分片通过 faiss.IndexShards 并行检索，id 按分片顺序连续编号（successive_ids），
+    与合并后的单一索引中的 id 一致。该存储是只读的。
+    """
+    def __init__(self, manifest_path: str, dimension: int, threaded: bool = True, **kwargs):
+        self.manifest_path = manifest_path
+        self.dimension = dimension
+        self.threaded = threaded
+        self.index = None
+        self.metadata = []
+        self._load()
+
+    def _load(self):
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest['dimension'] != self.dimension:
+            raise ValueError(f"分片维度 ({manifest['dimension']}) 与配置 ({self.dimension}) 不符。")
+
+        self.index = faiss.IndexShards(self.dimension, self.threaded, True)
+        # IndexShards 不持有子索引的所有权，需要保留引用以免被回收
+        self._shards = []
+        self._offsets = []
+        self.metadata = []
+        for shard in manifest['shards']:
+            index_file, metadata_file = current_faiss_paths(shard['index_path'], shard['metadata_path'])
+            shard_index = faiss.read_index(index_file)
+            with open(metadata_file, 'r', encoding='utf-8') as f:
+                shard_metadata = json.load(f)
+            self._offsets.append(len(self.metadata))
+            self._shards.append(shard_index)
+            self.index.add_shard(shard_index)
+            self.metadata.extend(shard_metadata)
+        print(f"已加载 {len(self._shards)} 个 Faiss 分片，共 {len(self.metadata)} 条向量。")
+
+    def add(self, vectors: List[np.ndarray], metadata: List[Dict[str, Any]], **kwargs):
+        raise NotImplementedError("分片索引为只读，请重新构建分片后再合并或注册。")
+
+    def search(
+        self,
+        vector: np.ndarray,
+        top_k: int,
+        output_fields: Optional[List[str]] = None,
+        **kwargs
+    ) -> List[Dict[str, Any]]:
+        if self.index.ntotal == 0:
+            return []
+        query_vector_np = np.array([vector], dtype='float32')
+        distances, indices = self.index.search(query_vector_np, top_k)
+
+        results = []
+        for i in indices[0]:
+            if i != -1 and i < len(self.metadata):
+                results.append(dict(self.metadata[i], id=int(i)))
+        return results
+
+    def search_batch(
+        self,
+        vectors: List[np.ndarray],
+        top_k: int,
+        output_fields: Optional[List[str]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        if self.index.ntotal == 0 or len(vectors) == 0:
+            return [[] for _ in vectors]
+        distances, indices = self.index.search(np.asarray(vectors, dtype='float32'), top_k)
+        return [
+            [dict(self.metadata[i], id=int(i), distance=float(d)) for d, i in zip(row_distances, row_indices) if i != -1 and i < len(self.metadata)]
+            for row_distances, row_indices in zip(distances, indices)
+        ]
+
+    def get_vectors(self, ids: List[int]) -> Optional[np.ndarray]:
+        vectors = np.empty((len(ids), self.dimension), dtype='float32')
+        for row, i in enumerate(ids):
+            shard = bisect.bisect_right(self._offsets, i) - 1
+            vectors[row] = self._shards[shard].reconstruct(int(i - self._offsets[shard]))
+        return vectors
+
+    def iter_vectors(self, batch_size: int = 4096) -> Iterator[Tuple[np.ndarray, List[Dict[str, Any]]]]:
+        for shard_index, offset in zip(self._shards, self._offsets):
+            for start in range(0, shard_index.ntotal, batch_size):
+                end = min(start + batch_size, shard_index.ntotal)
+                yield shard_index.reconstruct_n(start, end - start), self.metadata[offset + start:offset + end]
+
+    def count(self) -> Optional[int]:
+        return self.index.ntotal
+
+    def delete_collection(self):
+        raise NotImplementedError("分片索引为只读，请直接删除分片目录。")
+
+    def release(self):
+        self.index = None
+        self._shards = []
+        self.metadata = []
+        print("Faiss 分片已从内存中释放。")
@@ -1,34 +1,112 @@
 import faiss
 import numpy as np
+import glob
 import json
 import os
-from typing import List, Dict, Any, Optional
-from .base import BaseVectorStore
+import threading
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+from .base import BaseVectorStore, StaleIndexError, file_signature
+
+
+def _pointer_path(index_path: str) -> str:
+    return index_path + ".current"
+
+
+def _read_pointer(index_path: str) -> Optional[Dict[str, Any]]:
+    """读取指向当前一代索引文件的指针，不存在时返回 None（尚未保存过，或是旧版本直接写在 index_path 上的索引）。"""
+    try:
+        with open(_pointer_path(index_path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _generation_paths(index_path: str, metadata_path: str, generation: int) -> Tuple[str, str]:
+    return f"{index_path}.g{generation:06d}", f"{metadata_path}.g{generation:06d}"
+
+
+def current_faiss_paths(index_path: str, metadata_path: str) -> Tuple[str, str]:
+    """
+    FaissVectorStore 当前一代的索引与元数据文件路径。
+    索引与元数据按代写入 <path>.gNNNNNN，再原子地替换指针文件 <index_path>.current 完成提交，
+    直接读取这两个文件的代码（例如分片合并）应通过该函数定位文件。没有指针时返回原路径。
+    """
+    pointer = _read_pointer(index_path)
+    if pointer is None:
+        return index_path, metadata_path
+    return _generation_paths(index_path, metadata_path, pointer['generation'])
+
+
+def _commit_generation(index_path: str, metadata_path: str, generation: int):
+    """替换指针使第 generation 代文件生效，然后删除此前各代以及旧版本的文件。"""
+    previous = _read_pointer(index_path)
+    with open(_pointer_path(index_path) + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump({'generation': generation}, f)
+    os.replace(_pointer_path(index_path) + ".tmp", _pointer_path(index_path))
+    # 正在读取旧文件的进程已打开文件，删除不影响其读完；尚未打开的会在 _load 中按新指针重试
+    stale = [index_path, metadata_path]
+    if previous is not None and previous['generation'] != generation:
+        stale.extend(_generation_paths(index_path, metadata_path, previous['generation']))
+    for path in stale:
+        if os.path.exists(path):
+            os.remove(path)
+
 
 class FaissVectorStore(BaseVectorStore):
+    """
+    单个 IndexFlatL2 与 JSON 元数据组成的向量存储。
+
+    保存时索引与元数据先写入新一代文件，再原子地替换指针文件（见 current_faiss_paths），
+    因此其他进程 reload 时读到的索引与元数据总是同一代，不会出现一新一旧。
+    """
+    supports_truncate = True
+
     def __init__(self, index_path: str, metadata_path: str, dimension: int, **kwargs):
         self.index_path = index_path
         self.metadata_path = metadata_path
         self.dimension = dimension
         self.index = None
         self.metadata = []
+        # 后台更新（upsert）与检索可能在不同线程中同时进行
+        self._lock = threading.RLock()
+        self._key_positions: Dict[str, Dict[Any, int]] = {}
+        # 最近一次加载或保存时索引文件的签名，保存前据此判断磁盘上的文件是否已被替换
+        self._disk_signature = None
         self._load()
 
-    def _load(self):
+    def _signature(self):
+        """指针文件的签名；旧版本没有指针时使用索引文件本身的签名。"""
+        return file_signature(_pointer_path(self.index_path)) or file_signature(self.index_path)
+
+    def _load(self, attempts: int = 3):
         """加载索引和元数据，如果不存在则创建新的。"""
-        if os.path.exists(self.index_path):
-            self.index = faiss.read_index(self.index_path)
-            if self.index.d != self.dimension:
-                print(f"警告: 索引维度 ({self.index.d}) 与配置 ({self.dimension}) 不符。将创建新索引。")
+        for attempt in range(attempts):
+            signature = self._signature()
+            index_file, metadata_file = current_faiss_paths(self.index_path, self.metadata_path)
+            if not os.path.exists(index_file):
+                if signature != self._signature() and attempt + 1 < attempts:
+                    # 读取指针之后新一代已提交、旧文件已删除，按新指针重新读取
+                    continue
                 self._create_new_index()
-        else:
+                return
+            try:
+                index = faiss.read_index(index_file)
+                metadata = []
+                if os.path.exists(metadata_file):
+                    with open(metadata_file, 'r', encoding='utf-8') as f:
+                        metadata = json.load(f)
+            except (OSError, RuntimeError):
+                if signature != self._signature() and attempt + 1 < attempts:
+                    continue
+                raise
+            break
+        if index.d != self.dimension:
+            print(f"警告: 索引维度 ({index.d}) 与配置 ({self.dimension}) 不符。将创建新索引。")
             self._create_new_index()
-            
-        if os.path.exists(self.metadata_path):
-             with open(self.metadata_path, 'r', encoding='utf-8') as f:
-                self.metadata = json.load(f)
-        else:
-            self.metadata = []
+            return
+        self.index = index
+        self.metadata = metadata
+        self._disk_signature = signature
 
     def _create_new_index(self):
         """创建一个新的空索引。"""
@@ -38,22 +116,75 @@ class FaissVectorStore(BaseVectorStore):
         os.makedirs(os.path.dirname(self.metadata_path), exist_ok=True)
         self.index = faiss.IndexFlatL2(self.dimension)
         self.metadata = []
-        self._save()
+        self._key_positions = {}
+        self._save(force=True)
 
-    def _save(self):
-        """保存索引和元数据到文件。"""
-        print(f"正在保存 Faiss 索引到 {self.index_path}")
-        faiss.write_index(self.index, self.index_path)
-        os.makedirs(os.path.dirname(self.metadata_path), exist_ok=True)
-        with open(self.metadata_path, 'w', encoding='utf-8') as f:
+    def _write_generation(self, index_path: str, metadata_path: str) -> int:
+        """把内存中的索引与元数据写成 index_path 的下一代文件（尚未提交），返回代号。"""
+        pointer = _read_pointer(index_path)
+        generation = (pointer['generation'] if pointer else 0) + 1
+        index_file, metadata_file = _generation_paths(index_path, metadata_path, generation)
+        os.makedirs(os.path.dirname(index_file), exist_ok=True)
+        os.makedirs(os.path.dirname(metadata_file), exist_ok=True)
+        faiss.write_index(self.index, index_file)
+        with open(metadata_file, 'w', encoding='utf-8') as f:
             json.dump(self.metadata, f, ensure_ascii=False, indent=2)
+        return generation
+
+    def _save(self, force: bool = False):
+        """
+        保存索引和元数据：先写入新一代文件，再替换指针提交，中途被终止时磁盘上仍是上一代完整的文件。
+        :param force: 为 False 时，如果索引在加载之后被其他进程替换（例如后台索引任务提交了新索引），
+            抛出 StaleIndexError 而不是用内存中的旧索引覆盖它；需要先调用 reload。
+        """
+        if not force and self._signature() != self._disk_signature:
+            raise StaleIndexError(f"{self.index_path} 已被其他进程更新，请先重新加载索引。")
+        print(f"正在保存 Faiss 索引到 {self.index_path}")
+        generation = self._write_generation(self.index_path, self.metadata_path)
+        _commit_generation(self.index_path, self.metadata_path, generation)
+        self._disk_signature = self._signature()
 
     def add(self, vectors: List[np.ndarray], metadata: List[Dict[str, Any]], **kwargs):
         if len(vectors) == 0:
             return
         vectors_np = np.array(vectors, dtype='float32')
-        self.index.add(vectors_np)
-        self.metadata.extend(metadata)
+        with self._lock:
+            self.index.add(vectors_np)
+            self.metadata.extend(metadata)
+            self._key_positions.clear()
+        self._bump_version()
+
+    def _positions_by_key(self, key_field: str) -> Dict[Any, int]:
+        """键到向量位置的映射，首次使用时扫描一遍元数据，之后随 upsert 增量维护。"""
+        positions = self._key_positions.get(key_field)
+        if positions is None:
+            positions = {item[key_field]: i for i, item in enumerate(self.metadata) if key_field in item}
+            self._key_positions[key_field] = positions
+        return positions
+
+    def upsert(self, vectors: List[np.ndarray], metadata: List[Dict[str, Any]], key_field: str = 'row_id'):
+        if len(vectors) == 0:
+            return
+        vectors_np = np.array(vectors, dtype='float32')
+        with self._lock:
+            positions = self._positions_by_key(key_field)
+            # IndexFlat 的向量连续存放，可以直接原地覆盖
+            stored = faiss.rev_swig_ptr(self.index.get_xb(), self.index.ntotal * self.dimension).reshape(self.index.ntotal, self.dimension)
+            new_vectors, new_metadata = [], []
+            for vector, item in zip(vectors_np, metadata):
+                position = positions.get(item[key_field])
+                if position is None:
+                    new_vectors.append(vector)
+                    new_metadata.append(item)
+                else:
+                    stored[position] = vector
+                    self.metadata[position] = item
+            if new_vectors:
+                for i, item in enumerate(new_metadata):
+                    positions[item[key_field]] = self.index.ntotal + i
+                self.index.add(np.array(new_vectors, dtype='float32'))
+                self.metadata.extend(new_metadata)
+        self._bump_version()
 
     def search(
         self, 
@@ -65,28 +196,96 @@ class FaissVectorStore(BaseVectorStore):
         if self.index.ntotal == 0:
             return []
         query_vector_np = np.array([vector], dtype='float32')
-        distances, indices = self.index.search(query_vector_np, top_k)
-        
-        results = []
-        for i in indices[0]:
-            if i != -1 and i < len(self.metadata):
-                results.append(self.metadata[i])
+        with self._lock:
+            distances, indices = self.index.search(query_vector_np, top_k)
+
+            results = []
+            for i in indices[0]:
+                if i != -1 and i < len(self.metadata):
+                    # 返回副本并附带向量在索引中的位置，避免调用方修改内存中的元数据
+                    results.append(dict(self.metadata[i], id=int(i)))
         return results
 
+    def search_batch(
+        self,
+        vectors: List[np.ndarray],
+        top_k: int,
+        output_fields: Optional[List[str]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        if self.index.ntotal == 0 or len(vectors) == 0:
+            return [[] for _ in vectors]
+        # 整批查询一次送入 Faiss，由其内部多线程并行计算
+        with self._lock:
+            distances, indices = self.index.search(np.asarray(vectors, dtype='float32'), top_k)
+            return [
+                [dict(self.metadata[i], id=int(i), distance=float(d)) for d, i in zip(row_distances, row_indices) if i != -1 and i < len(self.metadata)]
+                for row_distances, row_indices in zip(distances, indices)
+            ]
+
+    def get_vectors(self, ids: List[int]) -> Optional[np.ndarray]:
+        if not ids:
+            return np.empty((0, self.dimension), dtype='float32')
+        with self._lock:
+            return self.index.reconstruct_batch(np.array(ids, dtype='int64'))
+
+    def iter_vectors(self, batch_size: int = 4096) -> Iterator[Tuple[np.ndarray, List[Dict[str, Any]]]]:
+        for start in range(0, self.index.ntotal, batch_size):
+            with self._lock:
+                end = min(start + batch_size, self.index.ntotal)
+                batch = self.index.reconstruct_n(start, end - start), self.metadata[start:end]
+            yield batch
+
+    def count(self) -> Optional[int]:
+        return self.index.ntotal
+
+    def checkpoint(self):
+        with self._lock:
+            self._save()
+
+    def truncate(self, count: int):
+        if count >= self.index.ntotal:
+            return
+        with self._lock:
+            self.index.remove_ids(faiss.IDSelectorRange(count, self.index.ntotal))
+            self.metadata = self.metadata[:count]
+            self._key_positions.clear()
+        self._bump_version()
+
     def build_index(self):
         # FaissIndexFlatL2 是增量添加的，所以我们只需要在这里保存最终状态。
         self._save()
+        self._bump_version()
         print("Faiss 索引已成功保存。")
 
+    def _remove_files(self):
+        """删除该存储在磁盘上的指针与各代文件。"""
+        paths = [_pointer_path(self.index_path), self.index_path, self.metadata_path]
+        paths += glob.glob(glob.escape(self.index_path) + ".g*") + glob.glob(glob.escape(self.metadata_path) + ".g*")
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
     def delete_collection(self):
         print("正在删除旧的 Faiss 索引和元数据...")
-        if os.path.exists(self.index_path):
-            os.remove(self.index_path)
-        if os.path.exists(self.metadata_path):
-            os.remove(self.metadata_path)
+        self._remove_files()
         self._create_new_index()
+        self._bump_version()
         print("旧索引已成功删除并重新创建。")
         
+    def promote(self, target: Dict[str, Any]):
+        with self._lock:
+            # 写成目标路径的下一代文件，替换目标指针是唯一的提交点
+            generation = self._write_generation(target['index_path'], target['metadata_path'])
+            _commit_generation(target['index_path'], target['metadata_path'], generation)
+            self._remove_files()
+        print(f"暂存索引已提交到 {target['index_path']}")
+
+    def reload(self):
+        with self._lock:
+            self._load()
+            self._key_positions = {}
+        self._bump_version()
+
     def release(self):
         # 对于基于文件的 Faiss，此操作可以理解为清空内存中的对象，
         # 等待下次使用时重新从磁盘加载。
@@ -1,7 +1,8 @@
 from pymilvus import MilvusClient, FieldSchema, CollectionSchema, DataType
+import json
 import numpy as np
 from .base import BaseVectorStore
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 
 class MilvusVectorStore(BaseVectorStore):
     def __init__(self, uri, user, password, db_name, collection_name, dimension):
@@ -25,6 +26,7 @@ class MilvusVectorStore(BaseVectorStore):
     def add(self, vectors: List[np.ndarray], metadata: List[Dict[str, Any]], **kwargs):
         data = [{"vector": vec, "metadata": meta} for vec, meta in zip(vectors, metadata)]
         self.client.insert(self.collection_name, data)
+        self._bump_version()
 
     def search(
         self, 
@@ -52,19 +54,105 @@ class MilvusVectorStore(BaseVectorStore):
         processed_results = []
         for res in results[0]:
             metadata = res['entity']['metadata']
+            metadata['id'] = res['id']
             metadata['distance'] = res['distance']
             processed_results.append(metadata)
             
         return processed_results
 
+    def search_batch(
+        self,
+        vectors: List[np.ndarray],
+        top_k: int,
+        output_fields: Optional[List[str]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        if len(vectors) == 0:
+            return []
+        output_fields = list(output_fields or [])
+        if "metadata" not in output_fields:
+            output_fields.append("metadata")
+        # 一次请求提交整批查询向量
+        results = self.client.search(
+            collection_name=self.collection_name,
+            data=[np.asarray(vector).tolist() for vector in vectors],
+            limit=top_k,
+            output_fields=output_fields,
+            search_params={"metric_type": "L2"}
+        )
+        return [
+            [dict(res['entity']['metadata'], id=res['id'], distance=res['distance']) for res in hits]
+            for hits in results
+        ]
+
+    def get_vectors(self, ids: List[int]) -> Optional[np.ndarray]:
+        if not ids:
+            return np.empty((0, self.dimension), dtype='float32')
+        rows = self.client.get(self.collection_name, ids=ids, output_fields=["vector"])
+        vectors_by_id = {row['pk']: row['vector'] for row in rows}
+        return np.array([vectors_by_id[i] for i in ids], dtype='float32')
+
+    def iter_vectors(self, batch_size: int = 4096) -> Iterator[Tuple[np.ndarray, List[Dict[str, Any]]]]:
+        iterator = self.client.query_iterator(self.collection_name, batch_size=batch_size, output_fields=["vector", "metadata"])
+        try:
+            while True:
+                rows = iterator.next()
+                if not rows:
+                    break
+                yield np.array([row['vector'] for row in rows], dtype='float32'), [dict(row['metadata'], id=row['pk']) for row in rows]
+        finally:
+            iterator.close()
+
+    def upsert(self, vectors: List[np.ndarray], metadata: List[Dict[str, Any]], key_field: str = 'row_id'):
+        if len(vectors) == 0:
+            return
+        # 主键是自增的，无法直接按键覆盖：先删除相同键的旧条目，再插入新条目
+        keys = json.dumps([item[key_field] for item in metadata], ensure_ascii=False)
+        self.client.delete(self.collection_name, filter=f'metadata["{key_field}"] in {keys}')
+        self.add(vectors=vectors, metadata=metadata)
+
+    def count(self) -> Optional[int]:
+        return int(self.client.get_collection_stats(self.collection_name)['row_count'])
+
+    def checkpoint(self):
+        # 将已插入但仍在内存中的数据落盘
+        self.client.flush(self.collection_name)
+
     def delete_collection(self):
         if self.collection_name in self.client.list_collections():
             self.client.drop_collection(self.collection_name)
+        self._bump_version()
     
     def build_index(self):
-        # Milvus的AUTOINDEX是自动构建的，此函数为空操作
-        pass
+        # Milvus的AUTOINDEX是自动构建的，这里只需递增版本号使缓存失效
+        self._bump_version()
         
+    def promote(self, target: Dict[str, Any]):
+        self.client.flush(self.collection_name)
+        # 先加载暂存集合，改名后即可直接检索
+        self.client.load_collection(self.collection_name)
+        target_name = target['collection_name']
+        old_name = f"{target_name}_old"
+        collections = self.client.list_collections()
+        if old_name in collections:
+            self.client.drop_collection(old_name)
+        # 正式集合先改名移开而不是直接删除：新集合改名失败时可以恢复原状，检索不会失去数据
+        if target_name in collections:
+            self.client.rename_collection(target_name, old_name)
+        try:
+            self.client.rename_collection(self.collection_name, target_name)
+        except Exception:
+            if target_name in collections:
+                self.client.rename_collection(old_name, target_name)
+            raise
+        if target_name in collections:
+            self.client.drop_collection(old_name)
+        self.collection_name = target_name
+        print(f"暂存集合已提交为 '{target_name}'")
+
+    def reload(self):
+        self.client.load_collection(self.collection_name)
+        self._bump_version()
+
     def release(self):
         # Milvus 客户端会自动管理连接，但可以提供一个释放加载集合的接口
         self.client.release_collection(self.collection_name)
@@ -0,0 +1,347 @@
+"""
+轻量的性能埋点：各阶段耗时（span）、批大小等观测值、计数器（缓存命中、LLM token 数）以及进程内存。
+
+默认关闭。关闭时 span() 返回共享的空上下文管理器，observe() / increment() 只做一次布尔判断后返回，
+因此埋点可以留在热路径上。通过 configure(config['telemetry']) 开启后：
+- 耗时与观测值按序列（指标名 + 标签）汇总，导出累计的 _sum / _count，
+  以及基于每个序列最近 reservoir_size 个样本的 p50 / p90 / p99；
+- 指标以 Prometheus 文本格式导出：render_prometheus()、api_server.py 的 GET /metrics，
+  或配置 metrics_path 后由后台线程定期原子写入文件（可供 node_exporter 的 textfile collector 采集）；
+- 配置 log_path 后，每个 span 结束时追加一行 JSON 结构化日志（阶段、耗时、附加字段、异常）。
+
+用法:
+    with telemetry.span("encode", batch_size=len(images)):
+        vectors = encoder.encode_batch(images, texts)
+    telemetry.increment("cache_requests_total", cache="query", result="hit")
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from typing import Any, Dict, Optional, Tuple
+
+METRIC_PREFIX = "rag_"
+QUANTILES = (0.5, 0.9, 0.99)
+
+_LabelKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+_NOOP_SPAN = nullcontext()
+
+
+def _key(name: str, labels: Dict[str, Any]) -> _LabelKey:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    return str(value) if isinstance(value, int) else f"{value:.6g}"
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _process_memory() -> Dict[str, int]:
+    """当前常驻内存与峰值常驻内存（字节），无法获取的项省略。"""
+    memory = {}
+    try:
+        with open("/proc/self/statm", "r") as f:
+            memory["resident_memory_bytes"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 上单位是 KB，macOS 上是字节
+        memory["peak_resident_memory_bytes"] = peak if sys.platform == "darwin" else peak * 1024
+    except (ImportError, OSError):
+        pass
+    return memory
+
+
+class _Summary:
+    __slots__ = ("count", "total", "samples")
+
+    def __init__(self, reservoir_size: int):
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=reservoir_size)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+    def quantiles(self) -> Dict[float, float]:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {}
+        return {q: ordered[min(int(q * len(ordered)), len(ordered) - 1)] for q in QUANTILES}
+
+
+class MetricsRegistry:
+    """线程安全的指标注册表，保存 summary（耗时、批大小）、计数器和仪表值。"""
+    def __init__(self, reservoir_size: int = 2048):
+        self.reservoir_size = reservoir_size
+        self._summaries: Dict[_LabelKey, _Summary] = {}
+        self._counters: Dict[_LabelKey, float] = {}
+        self._gauges: Dict[_LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                summary = self._summaries[key] = _Summary(self.reservoir_size)
+            summary.observe(value)
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def reset(self):
+        with self._lock:
+            self._summaries.clear()
+            self._counters.clear()
+            self._gauges.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        当前所有指标的快照，便于在命令行脚本结束时打印或测试。
+        :return: {'summaries': {(name, labels): {'count', 'sum', 'p50', 'p90', 'p99'}}, 'counters': {...}, 'gauges': {...}}
+        """
+        with self._lock:
+            summaries = {
+                key: dict({'count': s.count, 'sum': s.total}, **{f"p{int(q * 100)}": v for q, v in s.quantiles().items()})
+                for key, s in self._summaries.items()
+            }
+            return {'summaries': summaries, 'counters': dict(self._counters), 'gauges': dict(self._gauges)}
+
+    def render_prometheus(self) -> str:
+        """按 Prometheus 文本格式（0.0.4）导出所有指标，另外附带进程内存。"""
+        snapshot = self.snapshot()
+        gauges = dict(snapshot['gauges'])
+        for name, value in _process_memory().items():
+            gauges[(f"process_{name}", ())] = value
+        lines = []
+
+        def group(items):
+            grouped: Dict[str, list] = {}
+            for (name, labels), value in sorted(items):
+                grouped.setdefault(METRIC_PREFIX + name, []).append((labels, value))
+            return grouped.items()
+
+        for name, series in group(snapshot['summaries'].items()):
+            lines.append(f"# TYPE {name} summary")
+            for labels, stats in series:
+                for q in QUANTILES:
+                    value = stats.get(f"p{int(q * 100)}")
+                    if value is not None:
+                        lines.append(f"{name}{_format_labels(labels, ('quantile', str(q)))} {_format_value(value)}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(stats['sum'])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {stats['count']}")
+        for name, series in group(snapshot['counters'].items()):
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for name, series in group(gauges.items()):
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in series:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class _Span:
+    __slots__ = ("stage", "fields", "start")
+
+    def __init__(self, stage: str, fields: Dict[str, Any]):
+        self.stage = stage
+        self.fields = fields
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        _registry.observe("stage_seconds", duration, stage=self.stage)
+        if _log_file is not None:
+            entry = {'ts': round(time.time(), 3), 'stage': self.stage, 'duration_ms': round(duration * 1000, 3)}
+            entry.update(self.fields)
+            if exc_type is not None:
+                entry['error'] = f"{exc_type.__name__}: {exc}"
+            _write_log(entry)
+        return False
+
+
+_enabled = False
+_registry = MetricsRegistry()
+_log_file = None
+_log_lock = threading.Lock()
+_exporter: Optional["_FileExporter"] = None
+
+
+def _write_log(entry: Dict[str, Any]):
+    line = json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+    with _log_lock:
+        if _log_file is not None:
+            _log_file.write(line)
+
+
+class _FileExporter:
+    """后台线程，每隔 interval 秒将指标原子写入 path。"""
+    def __init__(self, path: str, interval: float):
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="telemetry-exporter", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def write(self):
+        try:
+            write_metrics(self.path)
+        except OSError as e:
+            print(f"写入指标文件失败: {self.path}，错误: {e}")
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.write()
+
+
+def configure(config: Optional[Dict[str, Any]] = None):
+    """
+    根据 config.yaml 中的 telemetry 配置段开启或关闭埋点，可重复调用。
+    :param config: enabled, log_path（JSONL 结构化日志）, metrics_path（Prometheus 文本文件）,
+        export_interval（写入指标文件的间隔秒数）, reservoir_size（计算分位数的样本数）。
+    """
+    global _enabled, _log_file, _exporter
+    config = config or {}
+    shutdown()
+    _enabled = bool(config.get("enabled", False))
+    if not _enabled:
+        return
+    _registry.reservoir_size = config.get("reservoir_size", 2048)
+    log_path = config.get("log_path")
+    if log_path:
+        directory = os.path.dirname(log_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 行缓冲，进程被终止时最多丢失最后一行
+        _log_file = open(log_path, "a", encoding="utf-8", buffering=1)
+    if config.get("metrics_path"):
+        _exporter = _FileExporter(config["metrics_path"], config.get("export_interval", 15))
+
+
+def shutdown():
+    """停止后台写出并关闭日志文件，写出最后一次指标。"""
+    global _log_file, _exporter
+    if _exporter is not None:
+        _exporter.stop()
+        _exporter = None
+    with _log_lock:
+        if _log_file is not None:
+            _log_file.close()
+            _log_file = None
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def span(stage: str, **fields):
+    """
+    记录一个阶段的耗时。stage 作为指标标签，fields（例如批大小）只写入结构化日志。
+    :return: 上下文管理器；埋点关闭时为共享的空上下文管理器。
+    """
+    if not _enabled:
+        return _NOOP_SPAN
+    return _Span(stage, fields)
+
+
+def observe(name: str, value: float, **labels):
+    """记录一个观测值（例如批大小），导出为 summary。"""
+    if _enabled:
+        _registry.observe(name, value, **labels)
+
+
+def increment(name: str, value: float = 1, **labels):
+    """累加计数器（例如缓存命中数、token 数）。"""
+    if _enabled:
+        _registry.increment(name, value, **labels)
+
+
+def set_gauge(name: str, value: float, **labels):
+    if _enabled:
+        _registry.set_gauge(name, value, **labels)
+
+
+def record_cache(cache: str, hit: bool):
+    """记录一次缓存查询，命中率 = hit / (hit + miss)。"""
+    if _enabled:
+        _registry.increment("cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+def record_llm_usage(usage: Any, model: Optional[str] = None):
+    """记录一次 LLM 调用及其 token 用量，usage 为 OpenAI 响应中的 usage 对象（可能为 None）。"""
+    if not _enabled:
+        return
+    _registry.increment("llm_requests_total", model=model or "")
+    if usage is None:
+        return
+    _registry.increment("llm_tokens_total", getattr(usage, "prompt_tokens", 0) or 0, model=model or "", kind="prompt")
+    _registry.increment("llm_tokens_total", getattr(usage, "completion_tokens", 0) or 0, model=model or "", kind="completion")
+
+
+def snapshot() -> Dict[str, Any]:
+    return _registry.snapshot()
+
+
+def reset():
+    """清空已记录的指标，例如基准测试在各场景之间调用。"""
+    _registry.reset()
+
+
+def render_prometheus() -> str:
+    return _registry.render_prometheus()
+
+
+def write_metrics(path: str):
+    """将当前指标以 Prometheus 文本格式原子写入 path。"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+
+
+def format_stage_summary() -> str:
+    """各阶段耗时的单行摘要（次数、p50、p99，单位毫秒），供命令行脚本结束时打印。"""
+    parts = []
+    for (name, labels), stats in sorted(snapshot()['summaries'].items()):
+        if name != "stage_seconds":
+            continue
+        stage = dict(labels).get("stage", "")
+        parts.append(f"{stage} ×{stats['count']} p50 {stats.get('p50', 0) * 1000:.1f}ms p99 {stats.get('p99', 0) * 1000:.1f}ms")
+    return " | ".join(parts)
@@ -0,0 +1,109 @@
+"""
+ResilientGenerator 针对本地假服务（fake_openai_server.py）的测试：重试与退避、熔断器状态转换、长尾延迟下的对冲。
+"""
+import time
+
+import pytest
+
+from fake_openai_server import start_fake_openai_server
+from generators import LLM_ERROR_PREFIX, OpenAIGenerator, ResilientGenerator
+
+
+@pytest.fixture
+def fake_server():
+    servers = []
+
+    def start(**behavior_options):
+        server, base_url = start_fake_openai_server(**behavior_options)
+        servers.append(server)
+        return server, base_url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def make_generator(base_url: str, **options) -> ResilientGenerator:
+    inner = OpenAIGenerator(model="fake-model", api_type="custom", api_key="test", base_url=base_url, max_retries=0, raise_errors=True)
+    options = dict({"timeout": 10.0, "backoff_base": 0.01, "backoff_max": 0.05, "hedge": False}, **options)
+    return ResilientGenerator(inner, **options)
+
+
+def test_retries_until_success(fake_server):
+    server, base_url = fake_server(latency_ms=5, jitter_ms=0, error_rate=0.5, seed=7)
+    generator = make_generator(base_url, max_retries=6, breaker_failure_threshold=100)
+    results = [generator.generate("你好") for _ in range(20)]
+    assert not any(result.startswith(LLM_ERROR_PREFIX) for result in results)
+    # 注入的 500 错误被重试掩盖，因此请求数多于调用数
+    assert server.behavior.request_count > 20
+
+
+def test_gives_up_after_max_retries_and_counts_one_breaker_failure(fake_server):
+    server, base_url = fake_server(latency_ms=5, jitter_ms=0, error_rate=1.0)
+    generator = make_generator(base_url, max_retries=2, breaker_failure_threshold=5)
+    result = generator.generate("你好")
+    assert result.startswith(LLM_ERROR_PREFIX)
+    assert server.behavior.request_count == 3
+    assert generator.breaker._consecutive_failures == 1
+    assert generator.breaker.state == "closed"
+
+
+def test_stream_retries_before_first_token(fake_server):
+    server, base_url = fake_server(latency_ms=5, jitter_ms=0, error_rate=1.0, token_delay_ms=0)
+    generator = make_generator(base_url, max_retries=1, breaker_failure_threshold=100)
+    tokens = list(generator.generate_stream("你好"))
+    assert server.behavior.request_count == 2
+    assert tokens[-1].startswith(LLM_ERROR_PREFIX)
+
+    server.behavior.error_rate = 0.0
+    assert not "".join(generator.generate_stream("你好")).startswith(LLM_ERROR_PREFIX)
+
+
+def test_breaker_opens_then_half_opens_then_closes(fake_server):
+    server, base_url = fake_server(latency_ms=5, jitter_ms=0, error_rate=1.0)
+    generator = make_generator(base_url, max_retries=0, breaker_failure_threshold=2, breaker_reset_timeout=0.3)
+
+    generator.generate("你好")
+    assert generator.breaker.state == "closed"
+    generator.generate("你好")
+    assert generator.breaker.state == "open"
+
+    # 熔断期间直接拒绝，不访问上游
+    requests_before = server.behavior.request_count
+    assert "熔断" in generator.generate("你好")
+    assert server.behavior.request_count == requests_before
+
+    # 半开状态下探测失败：重新打开
+    time.sleep(0.35)
+    assert generator.breaker.state == "half_open"
+    generator.generate("你好")
+    assert generator.breaker.state == "open"
+
+    # 半开状态下探测成功：关闭
+    time.sleep(0.35)
+    server.behavior.error_rate = 0.0
+    assert not generator.generate("你好").startswith(LLM_ERROR_PREFIX)
+    assert generator.breaker.state == "closed"
+
+
+def test_hedging_cuts_tail_latency(fake_server):
+    tail_latency = 1.0
+    server, base_url = fake_server(latency_ms=20, jitter_ms=5, tail_latency_ms=tail_latency * 1000, seed=3)
+    # 长尾比例较高，对冲等待时间取中位数，避免长尾样本把 p95 推到长尾延迟上
+    generator = make_generator(base_url, hedge=True, hedge_quantile=0.5, hedge_min_samples=10, hedge_min_delay=0.05, max_retries=0)
+    # 先积累没有长尾的延迟样本
+    for _ in range(10):
+        generator.generate("你好")
+    assert generator.hedge_delay() is not None
+
+    server.behavior.tail_prob = 0.3
+    latencies = []
+    for _ in range(20):
+        start = time.monotonic()
+        assert not generator.generate("你好").startswith(LLM_ERROR_PREFIX)
+        latencies.append(time.monotonic() - start)
+    assert generator.hedged_requests > 0
+    # 长尾请求由对冲请求兜底，调用延迟远低于注入的长尾延迟
+    assert sorted(latencies)[len(latencies) // 2] < 0.2
+    # 只有主请求与对冲请求同时落入长尾时才会慢（概率约 0.09）
+    assert sum(latency >= tail_latency for latency in latencies) <= 3
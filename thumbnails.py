@@ -0,0 +1,182 @@
+import hashlib
+import io
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional
+
+import requests
+from PIL import Image
+
+import telemetry
+
+FORMAT_EXTENSIONS = {'WEBP': '.webp', 'JPEG': '.jpg'}
+
+
+class ThumbnailCache:
+    """
+    UI 展示用缩略图的本地缓存。
+
+    - 缩略图按原图内容的 sha256 命名，内容相同的图片（例如不同 URL 指向同一张图）只保存一份；
+    - 图片来源（URL / 本地路径）到内容哈希的映射保存在 refs 目录下，本地文件的修改时间和大小也计入来源键，
+      文件被替换后会重新生成；
+    - 缓存未命中时由有界线程池下载并生成缩略图，同一来源同时只处理一次；
+    - 建立索引时流水线已经读取过图片，可以直接调用 put 生成缩略图，避免展示时再次下载。
+    """
+    def __init__(
+        self,
+        cache_dir: str = "thumbnail_cache",
+        max_size: int = 256,
+        format: str = "WEBP",
+        quality: int = 80,
+        max_workers: int = 8,
+        fetch_timeout: float = 10.0
+    ):
+        """
+        :param cache_dir: 缓存目录。
+        :param max_size: 缩略图最长边的像素数。
+        :param format: 缩略图格式，WEBP 或 JPEG。
+        :param quality: 编码质量（1-100）。
+        :param max_workers: 处理缓存未命中的最大线程数。
+        :param fetch_timeout: 下载远程图片的超时时间（秒）。
+        """
+        self.format = format.upper()
+        if self.format not in FORMAT_EXTENSIONS:
+            raise ValueError(f"不支持的缩略图格式: {format}，可选: {list(FORMAT_EXTENSIONS)}")
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.quality = quality
+        self.fetch_timeout = fetch_timeout
+        self._refs_dir = os.path.join(cache_dir, "refs")
+        os.makedirs(self._refs_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="thumbnail")
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]] = None) -> "ThumbnailCache":
+        """根据配置（thumbnails 段）创建缓存。"""
+        return cls(**(config or {}))
+
+    # --- 路径与键 ---
+
+    @staticmethod
+    def _source_key(source: str) -> str:
+        if not source.startswith(('http://', 'https://')) and os.path.exists(source):
+            stat = os.stat(source)
+            source = f"{os.path.abspath(source)}:{stat.st_size}:{stat.st_mtime_ns}"
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+    def _thumbnail_path(self, content_hash: str) -> str:
+        return os.path.join(self.cache_dir, content_hash[:2], f"{content_hash}{FORMAT_EXTENSIONS[self.format]}")
+
+    def _ref_path(self, source_key: str) -> str:
+        return os.path.join(self._refs_dir, source_key)
+
+    @staticmethod
+    def _atomic_write(path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    # --- 生成 ---
+
+    def _render(self, image: Image.Image) -> bytes:
+        thumbnail = image.convert('RGB')
+        thumbnail.thumbnail((self.max_size, self.max_size))
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, format=self.format, quality=self.quality)
+        return buffer.getvalue()
+
+    def put_bytes(self, data: bytes, image: Optional[Image.Image] = None) -> str:
+        """
+        为图片内容生成缩略图（已存在则直接返回），不记录来源，适用于上传的查询图片。
+        :param data: 原图的字节内容。
+        :param image: 已解码的图片，提供时不再重复解码。
+        :return: 缩略图的本地路径。
+        """
+        path = self._thumbnail_path(hashlib.sha256(data).hexdigest())
+        if not os.path.exists(path):
+            if image is None:
+                image = Image.open(io.BytesIO(data))
+            self._atomic_write(path, self._render(image))
+        return path
+
+    def put(self, source: str, data: bytes, image: Optional[Image.Image] = None) -> str:
+        """为指定来源的图片生成缩略图并记录来源到内容的映射，返回缩略图路径。"""
+        path = self.put_bytes(data, image)
+        content_hash = os.path.splitext(os.path.basename(path))[0]
+        self._atomic_write(self._ref_path(self._source_key(source)), content_hash.encode('ascii'))
+        return path
+
+    def _read_source(self, source: str) -> bytes:
+        if source.startswith(('http://', 'https://')):
+            session = getattr(self._local, 'session', None)
+            if session is None:
+                session = self._local.session = requests.Session()
+            response = session.get(source, timeout=self.fetch_timeout)
+            response.raise_for_status()
+            return response.content
+        with open(source, 'rb') as f:
+            return f.read()
+
+    def _create(self, source: str, source_key: str) -> str:
+        try:
+            return self.put(source, self._read_source(source))
+        finally:
+            with self._lock:
+                self._inflight.pop(source_key, None)
+
+    # --- 查询 ---
+
+    def get(self, source: str) -> Optional[str]:
+        """只查询本地缓存，命中时返回缩略图路径，否则返回 None（不会下载）。"""
+        try:
+            with open(self._ref_path(self._source_key(source)), 'r', encoding='ascii') as f:
+                path = self._thumbnail_path(f.read().strip())
+        except OSError:
+            return None
+        return path if os.path.exists(path) else None
+
+    def submit(self, source: str) -> Future:
+        """提交一个缩略图请求，命中缓存时返回已完成的 Future。"""
+        path = self.get(source)
+        telemetry.record_cache("thumbnail", hit=path is not None)
+        if path is not None:
+            future = Future()
+            future.set_result(path)
+            return future
+        source_key = self._source_key(source)
+        with self._lock:
+            future = self._inflight.get(source_key)
+            if future is None:
+                future = self._executor.submit(self._create, source, source_key)
+                self._inflight[source_key] = future
+            return future
+
+    def get_many(self, sources: Iterable[str], timeout: Optional[float] = None) -> List[Optional[str]]:
+        """
+        并发获取一组图片的缩略图路径，顺序与 sources 一致。
+        生成失败或超时的图片返回 None，调用方可以回退为显示原图。
+        """
+        sources = [str(source) for source in sources]
+        futures = [self.submit(source) for source in sources]
+        paths = []
+        for source, future in zip(sources, futures):
+            try:
+                paths.append(future.result(timeout=timeout))
+            except Exception as e:
+                print(f"生成缩略图失败: {source}，错误: {e}")
+                paths.append(None)
+        return paths
+
+    def prefetch(self, sources: Iterable[str]):
+        """在后台为一组图片生成缩略图，不等待结果。"""
+        for source in sources:
+            self.submit(str(source))
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,65 @@
+import re
+from functools import lru_cache
+from typing import Optional
+
+# 匹配中日韩统一表意文字及全角标点，这类字符通常各自占用约 1 个 token
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+
+@lru_cache(maxsize=8)
+def _get_encoding(model: Optional[str]):
+    """
+    加载 tiktoken 编码器；tiktoken 未安装或编码文件无法获取时返回 None，由调用方使用启发式估计。
+    编码文件首次使用时需要联网下载，离线环境下会抛出网络错误；结果会被缓存，不会每次调用都重试下载。
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding("cl100k_base")
+        except KeyError:
+            # 未知模型使用通用编码
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"警告: 无法加载 tiktoken 编码，改用启发式估计 token 数: {e}")
+        return None
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """
+    在本地统计文本的 token 数。
+    优先使用 tiktoken 精确计数，不可用时退化为启发式估计：
+    每个中日韩字符约 1 个 token，其余字符约 4 个字符 1 个 token。
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: Optional[str] = None, ellipsis: str = "…") -> str:
+    """
+    将文本截断到不超过 max_tokens 个 token，被截断时在末尾追加省略号。
+    """
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return encoding.decode(tokens[:max_tokens]).rstrip() + ellipsis
+    # 启发式：二分查找满足预算的最长前缀
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid], model) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low].rstrip() + ellipsis
@@ -1,22 +1,26 @@
 import streamlit as st
-from PIL import Image
-import json
 import os
 import yaml
-import sys
 from typing import Dict, Any, Tuple, List
-import pandas as pd
-from tqdm import tqdm
 import math
 import io
-from urllib.parse import urlparse
+import hashlib
+import time
 
 # 从项目模块中导入核心组件
-from encoders import create_encoder, BaseEncoder
-from stores import create_vector_store, BaseVectorStore
-from reranker import GenerativeAssistant
-from prompts import create_prompt_template
-from utils import get_config, save_uploaded_file, get_image_from_url_or_path
+import telemetry
+from encoders import BaseEncoder
+from stores import BaseVectorStore
+from reranker import GenerativeAssistant, is_cacheable_answer
+from backend import create_backend
+from query_cache import QueryResultCache
+from data_sources import iter_record_batches
+from annotation_store import AnnotationStore
+from indexing_jobs import IndexingJobManager, ACTIVE_STATES, JOB_SUCCEEDED, JOB_CANCELLED, format_job
+from thumbnails import ThumbnailCache
+from reencode_worker import ReencodeWorker, ROW_ID_FIELD, STATUS_PENDING, STATUS_SYNCING, STATUS_SYNCED, STATUS_FAILED
+from auto_annotate import AutoAnnotator, ANNOTATION_STATUS_COLUMN, DRAFT_STATUS
+from utils import save_uploaded_file
 
 # Streamlit页面基础设置
 st.set_page_config(layout="wide", page_title="多模态 RAG 问答")
@@ -30,10 +34,12 @@ if 'backend' not in st.session_state:
     st.session_state['backend'] = None
 if 'qa_history' not in st.session_state:
     st.session_state['qa_history'] = []
-if 'annotation_df' not in st.session_state:
-    st.session_state['annotation_df'] = None
+if 'annotation_store' not in st.session_state:
+    st.session_state['annotation_store'] = None
 if 'annotation_page' not in st.session_state:
     st.session_state['annotation_page'] = 1
+if 'dirty_rows' not in st.session_state:
+    st.session_state['dirty_rows'] = {}  # row_id -> 修改时间
 
 # 为配置表单添加持久化状态
 if 'llm_provider' not in st.session_state:
@@ -75,38 +81,123 @@ def initialize_backend(_config: Dict[str, Any]) -> Tuple[BaseEncoder, BaseVector
         if "base_url" in creds and creds["base_url"]:
             os.environ["OPENAI_BASE_URL"] = creds["base_url"]
             
-    encoder = create_encoder(_config["encoder"])
-    vector_store = create_vector_store(_config["vector_store"])
-    assistant = GenerativeAssistant(llm_config)
-    return encoder, vector_store, assistant
-
-def perform_indexing(df: pd.DataFrame, vector_store: BaseVectorStore, encoder: BaseEncoder, progress_bar) -> Tuple[bool, str]:
-    try:
-        items_to_index = df.to_dict('records')
-        vector_store.delete_collection()
-        
-        batch_size = 32
-        num_batches = (len(items_to_index) + batch_size - 1) // batch_size
-        
-        for i in range(num_batches):
-            batch_items = items_to_index[i * batch_size : (i + 1) * batch_size]
-            
-            image_urls = [item['url'] for item in batch_items]
-            texts = [item.get('desc', '') for item in batch_items] # 添加文本描述
-            
-            # 批量编码
-            vectors = [encoder.encode(image=url, text=txt) for url, txt in zip(image_urls, texts)]
-            
-            # 使用新的接口
-            vector_store.add(vectors=vectors, metadata=batch_items)
-            
-            progress_bar.progress((i + 1) / num_batches)
-            
-        vector_store.build_index()
-        return True, f"成功为 {len(items_to_index)} 条数据建立了索引。"
-    except Exception as e:
-        st.error(f"建立索引时发生错误: {e}")
-        return False, f"建立索引时发生错误: {e}"
+    return create_backend(_config)
+
+@st.cache_resource
+def get_query_cache(max_entries: int, ttl_seconds: float) -> QueryResultCache:
+    # 作为全局资源在所有会话间共享，使并发的相同请求可以合并
+    return QueryResultCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+
+@st.cache_resource
+def get_thumbnail_cache() -> ThumbnailCache:
+    # 全局共享一个线程池和本地缓存目录
+    return ThumbnailCache.from_config(load_base_config().get("thumbnails", {}))
+
+def show_images(sources: List[str], columns=None, **image_kwargs):
+    """
+    通过缩略图缓存显示一组图片：先并发获取全部缩略图，再依次渲染，生成失败时回退为原图。
+    :param sources: 图片 URL 或本地路径。
+    :param columns: 与 sources 一一对应的 st.columns，为 None 时在当前位置依次显示。
+    :param image_kwargs: 传给 st.image 的参数，值为列表时按图片逐一取值（例如 caption）。
+    """
+    paths = get_thumbnail_cache().get_many(sources)
+    for i, (source, path) in enumerate(zip(sources, paths)):
+        kwargs = {k: (v[i] if isinstance(v, list) else v) for k, v in image_kwargs.items()}
+        if columns is not None:
+            with columns[i]:
+                st.image(path or source, **kwargs)
+        else:
+            st.image(path or source, **kwargs)
+
+def open_annotation_store(uploaded_file) -> Tuple[AnnotationStore, bool]:
+    """
+    打开上传文件对应的标注库。同一文件（内容相同）复用已有的库，保留之前的标注；
+    否则将文件保存到本地后流式导入，不在内存中构建整个 DataFrame。
+    :return: (标注库, 是否为新导入)
+    """
+    data_dir = load_base_config().get("annotation", {}).get("data_dir", "annotation_data")
+    content_digest = hashlib.sha256(uploaded_file.getbuffer()).hexdigest()
+    source = f"{uploaded_file.name}:{content_digest}"
+    db_name = content_digest[:16]
+    store = AnnotationStore(os.path.join(data_dir, f"{db_name}.db"))
+    if store.source == source:
+        return store, False
+    file_path = save_uploaded_file(uploaded_file)
+    store.import_batches(iter_record_batches(file_path), source=source)
+    return store, True
+
+@st.cache_resource
+def get_indexing_jobs() -> IndexingJobManager:
+    return IndexingJobManager(load_base_config().get("indexing", {}).get("jobs_dir", "faiss_data/jobs"))
+
+def apply_finished_job(job: Dict[str, Any]):
+    """后台任务提交新索引后，让本会话的向量存储重新加载，并重新同步任务开始后修改过的数据。"""
+    encoder, vector_store, _ = st.session_state.backend
+    vector_store.reload()
+    st.session_state.app_state = "READY"
+    worker = get_reencode_worker()
+    worker.reset()
+    # 任务开始前的修改已包含在新索引中；之后的修改可能未被读取，重新提交（按键更新是幂等的）
+    st.session_state.dirty_rows = {row_id: edited_at for row_id, edited_at in st.session_state.dirty_rows.items() if edited_at >= job['created_at']}
+    annotation_store = st.session_state.annotation_store
+    if annotation_store is not None:
+        for row_id in st.session_state.dirty_rows:
+            record = annotation_store.get(row_id)
+            if record is not None:
+                worker.submit(row_id, record)
+
+@st.fragment(run_every=2)
+def show_indexing_job():
+    """定时轮询后台索引任务的状态，只刷新这一块区域。"""
+    jobs = get_indexing_jobs()
+    job_id = st.session_state.get('indexing_job_id')
+    job = jobs.get(job_id) if job_id else (jobs.active() or jobs.latest())
+    if job is None:
+        return
+    if job['status'] in ACTIVE_STATES:
+        total = job.get('total_rows') or 0
+        st.progress(min(job['completed'] / total, 1.0) if total else 0.0, text=format_job(job))
+        if job.get('stages'):
+            st.caption(f"各阶段吞吐量: {job['stages']}")
+        if job.get('recent_errors'):
+            st.caption(f"最近的失败: {job['recent_errors'][-1]}")
+        if job['cancel_requested']:
+            st.info("正在取消，等待处理中的数据完成...")
+        elif st.button("取消索引任务", key=f"cancel_{job['id']}"):
+            jobs.cancel(job['id'])
+        st.caption("索引在后台进行，期间问答仍使用原有索引。")
+    elif job['status'] == JOB_SUCCEEDED:
+        if st.session_state.get('applied_job_id') != job['id']:
+            apply_finished_job(job)
+            st.session_state.applied_job_id = job['id']
+            # 整页刷新，使问答页面解锁
+            st.rerun()
+        message = f"✅ 成功为 {job['written']} 条数据建立了索引。"
+        if job['failed']:
+            message += f" {job['failed']} 条数据处理失败（例如{job['recent_errors'][0] if job['recent_errors'] else ''}）。"
+        st.success(message + " 现在可以去“开始问答”啦！")
+    elif job['status'] == JOB_CANCELLED:
+        st.warning(f"索引任务已取消，继续使用原有索引。{format_job(job)}")
+    else:
+        st.error(f"索引失败: {job.get('error')}")
+
+def get_reencode_worker() -> ReencodeWorker:
+    """当前后端对应的增量重编码后台线程，后端重新初始化后随之重建。"""
+    encoder, vector_store, _ = st.session_state.backend
+    worker = st.session_state.get('reencode_worker')
+    if worker is None or worker.vector_store is not vector_store:
+        if worker is not None:
+            worker.stop()
+        worker = ReencodeWorker(encoder, vector_store, key_field=ROW_ID_FIELD)
+        st.session_state.reencode_worker = worker
+    return worker
+
+SYNC_STATUS_LABELS = {
+    STATUS_PENDING: "⏳ 等待同步到索引",
+    STATUS_SYNCING: "🔄 正在同步到索引",
+    STATUS_SYNCED: "✅ 已同步到索引",
+    STATUS_FAILED: "❌ 同步失败",
+}
 
 # 7. 构建主UI界面
 st.title("🚀 多模态 RAG 问答")
@@ -198,62 +289,51 @@ with tab2:
                         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                     )
                 uploaded_file = st.file_uploader(
-                    "支持 .csv 和 .xlsx 格式", 
-                    type=["csv", "xlsx"], 
+                    "支持 .csv、.xlsx、.parquet 和 .arrow 格式", 
+                    type=["csv", "xlsx", "parquet", "arrow", "feather"], 
                     key="file_uploader"
                 )
-                if uploaded_file:
+                # 上传控件在每次重新运行时都会返回同一个文件，只在文件变化时导入
+                if uploaded_file and st.session_state.get('annotation_upload_id') != uploaded_file.file_id:
                     try:
-                        if uploaded_file.name.endswith('.csv'):
-                            st.session_state.annotation_df = pd.read_csv(uploaded_file)
-                        else:
-                            st.session_state.annotation_df = pd.read_excel(uploaded_file)
-                        st.success("文件上传成功！")
+                        with st.spinner("正在导入数据..."):
+                            st.session_state.annotation_store, imported = open_annotation_store(uploaded_file)
+                        st.session_state.annotation_upload_id = uploaded_file.file_id
+                        st.success("文件上传成功！" if imported else "文件上传成功，已恢复之前的标注进度。")
                     except Exception as e:
                         st.error(f"读取文件时出错: {e}")
         
         with right:
             with st.container(border=True):
                 st.markdown("##### 2. 建立索引")
-                if st.session_state.annotation_df is not None:
-                    st.metric("待索引数据量", f"{len(st.session_state.annotation_df)} 条")
-                    if st.button("开始建立索引", type="primary"):
-                        encoder, vector_store, _ = st.session_state.backend
-                        progress_bar = st.progress(0, "正在建立索引...")
-                        success, message = perform_indexing(st.session_state.annotation_df, vector_store, encoder, progress_bar)
-                        if success:
-                            st.session_state.app_state = "READY"
-                            st.success(f"✅ {message} 现在可以去“开始问答”啦！")
-                            progress_bar.progress(1.0, "索引完成！")
-                        else:
-                            st.error(f"索引失败: {message}")
+                if st.session_state.annotation_store is not None:
+                    st.metric("待索引数据量", f"{st.session_state.annotation_store.counts()['total']} 条")
+                    # 索引在后台工作进程中构建，完成后再替换正式索引，不阻塞页面和问答
+                    if st.button("开始建立索引", type="primary", disabled=get_indexing_jobs().active() is not None):
+                        try:
+                            st.session_state.indexing_job_id = get_indexing_jobs().submit(
+                                load_base_config(),
+                                {'db_path': st.session_state.annotation_store.db_path},
+                                total_rows=st.session_state.annotation_store.counts()['total']
+                            )
+                        except Exception as e:
+                            st.error(f"无法启动索引任务: {e}")
+                    show_indexing_job()
                 else:
                     st.info("请先上传数据文件。")
         
         st.divider()
 
         st.subheader("在线数据标注平台")
-        if st.session_state.annotation_df is not None:
-            # 创建一个工作副本
-            df = st.session_state.annotation_df.copy()
+        if st.session_state.annotation_store is not None:
+            annotation_store = st.session_state.annotation_store
 
             # --- 1. 标注状态分析 ---
-            # 确保列存在，如果不存在则填充为空字符串
-            if 'desc' not in df.columns:
-                df['desc'] = ''
-            if 'category' not in df.columns:
-                df['category'] = ''
-
-            # 填充NaN值以便统一处理
-            df['desc'] = df['desc'].fillna('')
-            df['category'] = df['category'].fillna('')
-
-            # 判断是否已标注 (描述和类别都不为空)
-            df['is_annotated'] = (df['desc'].str.strip() != '') & (df['category'].str.strip() != '')
-            
-            total_items = len(df)
-            annotated_count = df['is_annotated'].sum()
-            unannotated_count = total_items - annotated_count
+            # 是否已标注 (描述和类别都不为空，且不是等待审核的自动标注草稿) 在写入时计算，计数由标注库增量维护
+            annotation_counts = annotation_store.counts()
+            total_items = annotation_counts['total']
+            annotated_count = annotation_counts['annotated']
+            unannotated_count = annotation_counts['unannotated']
 
             # --- 2. UI - 状态指标与筛选 ---
             c1, c2, c3 = st.columns(3)
@@ -263,16 +343,53 @@ with tab2:
                 st.metric("已标注", f"{annotated_count} 条")
             with c3:
                 st.metric("待标注", f"{unannotated_count} 条")
-            
+
+            # 修改后的数据同步到索引的进度
+            if st.session_state.dirty_rows and st.session_state.app_state == "READY":
+                sync_counts = get_reencode_worker().status_counts()
+                st.caption(" · ".join(f"{SYNC_STATUS_LABELS[s]} {n} 条" for s, n in sync_counts.items() if n))
+
             if unannotated_count == 0:
                 st.success("🎉 恭喜！所有数据都已标注完成。")
 
+            # --- 批量自动标注：近邻投票建议类别 + LLM 起草描述，结果以草稿状态等待人工审核 ---
+            if unannotated_count > 0:
+                with st.expander("🤖 批量自动标注"):
+                    if st.session_state.app_state != "READY":
+                        st.info("自动标注需要参考已标注数据，请先构建索引。")
+                    else:
+                        annotation_config = load_base_config().get("annotation", {})
+                        use_llm = st.checkbox("使用 LLM 起草描述", value=True, help="取消勾选时只根据相似样本建议类别。")
+                        if st.button("开始自动标注", use_container_width=True):
+                            encoder, vector_store, assistant = st.session_state.backend
+                            batch_config = assistant.llm_config.get("batch", {})
+                            annotator = AutoAnnotator(
+                                encoder,
+                                vector_store,
+                                llm_config=assistant.llm_config if use_llm else None,
+                                top_k=annotation_config.get("top_k", 5),
+                                max_concurrency=batch_config.get("max_concurrency", 8),
+                                requests_per_minute=batch_config.get("requests_per_minute"),
+                                tokens_per_minute=batch_config.get("tokens_per_minute")
+                            )
+                            progress_bar = st.progress(0, text="正在自动标注...")
+                            try:
+                                stats = annotator.annotate_store(
+                                    annotation_store,
+                                    batch_size=annotation_config.get("batch_size", 32),
+                                    progress_callback=lambda done, total: progress_bar.progress(done / total, text=f"正在自动标注 {done}/{total}...")
+                                )
+                            finally:
+                                annotator.close()
+                            st.toast(f"自动标注完成：成功 {stats['annotated']} 条，失败 {stats['failed']} 条。")
+                            st.rerun()
+
             with st.container(border=True):
                 st.markdown("##### 筛选与视图")
                 filter_c1, filter_c2 = st.columns([3, 1])
                 
                 # 按类别筛选
-                all_categories = sorted([cat for cat in df['category'].unique() if cat])
+                all_categories = annotation_store.categories()
                 selected_categories = filter_c1.multiselect(
                     "按类别筛选",
                     options=all_categories,
@@ -286,21 +403,15 @@ with tab2:
                     help="勾选此项以查看所有缺少描述或类别的数据。"
                 )
 
-            # --- 3. 应用筛选逻辑 ---
-            df_to_display = df
-
-            if show_only_unannotated:
-                df_to_display = df_to_display[~df_to_display['is_annotated']]
-            
-            if selected_categories:
-                df_to_display = df_to_display[df_to_display['category'].isin(selected_categories)]
+            # --- 3. 应用筛选逻辑：只查询计数，数据按页从标注库读取 ---
+            matched_count = annotation_store.count(unannotated_only=show_only_unannotated, categories=selected_categories)
 
-            st.markdown(f"**查询结果: {len(df_to_display)} 条**")
+            st.markdown(f"**查询结果: {matched_count} 条**")
 
             # --- 4. 分页与表单展示 ---
-            if not df_to_display.empty:
+            if matched_count > 0:
                 items_per_page = 5
-                total_pages = math.ceil(len(df_to_display) / items_per_page)
+                total_pages = math.ceil(matched_count / items_per_page)
                 
                 # 如果筛选后当前页码超出范围，重置为第一页
                 if st.session_state.annotation_page > total_pages:
@@ -309,22 +420,53 @@ with tab2:
                 page_number = st.number_input('页码', min_value=1, max_value=total_pages, value=st.session_state.annotation_page)
                 st.session_state.annotation_page = page_number
                 
-                start_idx = (page_number - 1) * items_per_page
-                end_idx = start_idx + items_per_page
-                
-                for index, row in df_to_display.iloc[start_idx:end_idx].iterrows():
+                # 记录看过的各页的最后一条记录作为键集分页的游标：从最近的已知页开始定位，
+                # 顺序翻页时不需要从头跳过前面所有的行；筛选条件变化后游标失效
+                view_key = (show_only_unannotated, tuple(selected_categories))
+                if st.session_state.get('annotation_cursor_view') != view_key:
+                    st.session_state.annotation_cursor_view = view_key
+                    st.session_state.annotation_cursors = {}
+                cursors = st.session_state.annotation_cursors
+                known_page = max((p for p in cursors if p < page_number), default=0)
+                page_rows = annotation_store.page(
+                    (page_number - 1 - known_page) * items_per_page,
+                    items_per_page,
+                    unannotated_only=show_only_unannotated,
+                    categories=selected_categories,
+                    after=cursors.get(known_page)
+                )
+                if page_rows:
+                    cursors[page_number] = {'row_id': page_rows[-1]['row_id'], 'category': page_rows[-1]['category']}
+                # 整页的缩略图并发获取，缓存命中时不再下载原图
+                page_thumbnails = get_thumbnail_cache().get_many([row['url'] for row in page_rows])
+                for row, thumbnail_path in zip(page_rows, page_thumbnails):
+                    index = row['row_id']
                     with st.container(border=True):
                         c1, c2 = st.columns([1, 2])
                         with c1:
-                            st.image(row['url'], use_container_width=True, caption=f"ID: {index}")
+                            st.image(thumbnail_path or row['url'], use_container_width=True, caption=f"ID: {index}")
+                            if row.get(ANNOTATION_STATUS_COLUMN) == DRAFT_STATUS:
+                                st.caption(f"🤖 自动标注草稿，类别置信度 {row.get('suggested_confidence', 0):.2f}，请审核后保存。")
+                            if index in st.session_state.dirty_rows:
+                                sync_status = get_reencode_worker().status(index) if st.session_state.app_state == "READY" else None
+                                if sync_status is None:
+                                    st.caption("✏️ 已修改，建立索引后生效")
+                                else:
+                                    label = SYNC_STATUS_LABELS[sync_status['status']]
+                                    st.caption(f"{label}: {sync_status['error']}" if sync_status['error'] else label)
                         with c2:
                             with st.form(f"form_{index}"):
                                 new_desc = st.text_area("描述 (desc)", value=row.get('desc', ''), height=150)
                                 new_cat = st.text_input("类别 (category)", value=row.get('category', ''))
                                 if st.form_submit_button("保存更改"):
-                                    # 直接在原始DataFrame上修改
-                                    st.session_state.annotation_df.at[index, 'desc'] = new_desc
-                                    st.session_state.annotation_df.at[index, 'category'] = new_cat
+                                    # 写入标注库（立即落盘）；人工保存即视为审核通过
+                                    edited = annotation_store.update(
+                                        index, desc=new_desc, category=new_cat, **{ANNOTATION_STATUS_COLUMN: 'reviewed'}
+                                    )
+                                    # 标记为已修改；索引已建立时交给后台线程重新编码并增量更新索引
+                                    st.session_state.dirty_rows[index] = time.time()
+                                    if st.session_state.app_state == "READY":
+                                        get_reencode_worker().submit(index, edited)
                                     st.toast(f"ID {index} 已更新！")
                                     # 重新运行以刷新界面和统计数据
                                     st.rerun()
@@ -341,7 +483,7 @@ with tab3:
         for msg in st.session_state.qa_history:
             with st.chat_message(msg["role"]):
                 if msg.get("image_query"):
-                    st.image(msg["image_query"], width=150)
+                    st.image(get_thumbnail_cache().put_bytes(msg["image_query"]), width=150)
                 if msg.get("text_query"):
                     st.write(msg["text_query"])
                 
@@ -351,8 +493,8 @@ with tab3:
                     
                     # 如果有指定的推荐图片，则直接展示
                     if msg.get("recommended_item"):
-                        st.image(
-                            msg["recommended_item"]["url"], 
+                        show_images(
+                            [msg["recommended_item"]["url"]],
                             caption=f"为您推荐: {msg['recommended_item'].get('desc', '')[:50]}",
                             use_container_width=True
                         )
@@ -360,10 +502,12 @@ with tab3:
                     # 将所有参考图片放入折叠面板中
                     if msg.get("references"):
                         with st.expander("查看所有参考图片"):
-                            cols = st.columns(len(msg["references"]))
-                            for i, ref in enumerate(msg["references"]):
-                                with cols[i]:
-                                    st.image(ref['url'], caption=ref.get('desc', '')[:50], use_container_width=True)
+                            show_images(
+                                [ref['url'] for ref in msg["references"]],
+                                columns=st.columns(len(msg["references"])),
+                                caption=[ref.get('desc', '')[:50] for ref in msg["references"]],
+                                use_container_width=True
+                            )
 
         query_image_upload = st.file_uploader("上传查询图片", type=["jpg", "png", "jpeg"])
         query_text_input = st.text_area("输入你的问题")
@@ -394,29 +538,76 @@ with tab3:
             query_image_path = "temp_query_image.jpg"
 
         with st.chat_message("assistant"):
-            with st.spinner("思考中..."):
-                encoder, vector_store, assistant = st.session_state.backend
-                
+            encoder, vector_store, assistant = st.session_state.backend
+            base_config = load_base_config()
+            instruction = last_user_msg.get("text_query", "请描述这张图片，并找到相似的商品。")
+
+            def retrieve_candidates():
                 # 编码
-                query_vector = encoder.encode(image=query_image_path, text=last_user_msg.get("text_query"))
-                
+                with telemetry.span("encode", batch_size=1):
+                    query_vector = encoder.encode(image=query_image_path, text=last_user_msg.get("text_query"))
                 # 检索
-                candidates = vector_store.search(vector=query_vector, top_k=5)
-                
-                # 生成 (现在返回三元组)
-                answer_text, recommended_idx, references = assistant.answer(
-                    instruction=last_user_msg.get("text_query", "请描述这张图片，并找到相似的商品。"),
+                with telemetry.span("search", top_k=5):
+                    return query_vector, vector_store.search(vector=query_vector, top_k=5)
+
+            def run_qa_pipeline():
+                query_vector, candidates = retrieve_candidates()
+                # 生成 (现在返回三元组)，传入查询向量以复用语义缓存
+                return assistant.answer(
+                    instruction=instruction,
                     candidates=candidates,
                     query_image=query_image_path,
-                    query_text=last_user_msg.get("text_query")
+                    query_text=last_user_msg.get("text_query"),
+                    query_vector=query_vector
                 )
-                
-                # 准备要存入历史记录的消息体
-                assistant_message = {
-                    "role": "assistant", 
-                    "answer": answer_text,
-                    "references": references,
-                    "recommended_item": references[recommended_idx] if recommended_idx is not None else None
-                }
-                st.session_state.qa_history.append(assistant_message)
-                st.rerun()
+
+            query_cache = None
+            cache_config = base_config.get("query_cache", {})
+            if cache_config.get("enabled", False):
+                query_cache = get_query_cache(cache_config.get("max_entries", 1024), cache_config.get("ttl_seconds", 600))
+            cache_args = {
+                "image_bytes": last_user_msg.get("image_query"),
+                "text": last_user_msg.get("text_query"),
+                "index_version": vector_store.index_version,
+            }
+
+            if base_config.get("llm", {}).get("stream", False):
+                # 流式模式：命中缓存时直接展示，否则边生成边渲染
+                cached = query_cache.lookup(**cache_args) if query_cache else None
+                if cached is not None:
+                    answer_text, recommended_idx, references = cached
+                else:
+                    with st.spinner("检索中..."):
+                        query_vector, candidates = retrieve_candidates()
+                        streaming_answer = assistant.answer_stream(
+                            instruction=instruction,
+                            candidates=candidates,
+                            query_image=query_image_path,
+                            query_text=last_user_msg.get("text_query"),
+                            query_vector=query_vector
+                        )
+                    st.write_stream(streaming_answer)
+                    answer_text = streaming_answer.answer_text
+                    recommended_idx = streaming_answer.recommended_index
+                    references = streaming_answer.candidates
+                    # 只缓存完整生成的回答：中途出错的回答末尾是错误信息，不能复用
+                    if query_cache and streaming_answer.finished and not streaming_answer.failed:
+                        query_cache.store(value=(answer_text, recommended_idx, references), **cache_args)
+            else:
+                with st.spinner("思考中..."):
+                    if query_cache:
+                        answer_text, recommended_idx, references = query_cache.get_or_compute(
+                            compute_fn=run_qa_pipeline, should_cache=is_cacheable_answer, **cache_args
+                        )
+                    else:
+                        answer_text, recommended_idx, references = run_qa_pipeline()
+
+            # 准备要存入历史记录的消息体
+            assistant_message = {
+                "role": "assistant", 
+                "answer": answer_text,
+                "references": references,
+                "recommended_item": references[recommended_idx] if recommended_idx is not None else None
+            }
+            st.session_state.qa_history.append(assistant_message)
+            st.rerun()